@@ -1,12 +1,30 @@
+import ipaddress
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Sequence
+
 import geoip2.database
+import maxminddb
+import numpy as np
+
+from lruCache import LRUCache
+
+PARALLEL_CHUNK_SIZE = 8192  # IPs resolved by a worker process per task
+COUNTRY_CACHE_SIZE = 1 << 18  # IPs whose country is kept (LRU), ~40 MB
+PREFIX_TABLE_SUFFIX = ".prefixes.npz"  # Prefix table cache, next to the database
+_MISSING = object()  # Cache miss marker, distinct from a network without a country
 
 
 class IPGeolocation:
     """A wrapper for the GeoIP2 database to handle lookups"""
 
-    def __init__(self, db_path):
+    def __init__(self, db_path, mode=maxminddb.MODE_AUTO):
+        self.db_path = db_path
+        self._cache: LRUCache[str] = LRUCache(COUNTRY_CACHE_SIZE)
+        self._prefix_table = None
         try:
-            self.reader = geoip2.database.Reader(db_path)
+            self.reader = geoip2.database.Reader(db_path, mode=mode)
         except FileNotFoundError:
             print(f"ERROR: GeoLite2 database not found at '{db_path}'.")
             print(
@@ -14,8 +32,21 @@ class IPGeolocation:
             )
             self.reader = None
 
+    def build_id(self):
+        """Identifies the database build, so results derived from it can be invalidated."""
+        if not self.reader:
+            return "none"
+        metadata = self.reader.metadata()
+        return f"{metadata.database_type}-{metadata.build_epoch}"
+
     def get_country(self, ip_address):
         """Returns the ISO 3166-1 alpha-2 country code for an IP."""
+        country = self._cache.get(ip_address, _MISSING)  # None is a valid country
+        if country is _MISSING:
+            country = self._cache.put(ip_address, self._lookup_country(ip_address))
+        return country
+
+    def _lookup_country(self, ip_address):
         if not self.reader:
             return "XX"  # Return a dummy code if DB is missing
         try:
@@ -30,3 +61,190 @@ class IPGeolocation:
         except Exception as e:
             print(f"Could not look up IP {ip_address}: {e}")
             return "XX"
+
+    def _load_prefix_table(self):
+        """
+        Loads the prefix table from its cache file when it was extracted from the same database
+        build, otherwise extracts it (a walk over the whole database) and writes the cache file.
+        """
+        path = self.db_path + PREFIX_TABLE_SUFFIX
+        build_id = self.build_id()
+        try:
+            self._prefix_table = _read_prefix_table(path, build_id)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            self._prefix_table = None
+        if self._prefix_table is None:
+            self._extract_prefix_table()
+            try:
+                _write_prefix_table(path, build_id, self._prefix_table)
+            except OSError:
+                pass  # A read-only location only costs the next run an extraction
+
+    def _extract_prefix_table(self):
+        """
+        Extracts every IPv4 network of the database once, as sorted (start, end, country) columns.
+        Networks in a MaxMind database never overlap, so a lookup is a binary search on `start`.
+        """
+        starts, ends, countries = [], [], []
+        with maxminddb.open_database(self.db_path) as db:
+            for network, record in db:
+                if network.version != 4:
+                    continue
+                starts.append(int(network.network_address))
+                ends.append(int(network.broadcast_address))
+                countries.append((record or {}).get("country", {}).get("iso_code"))
+
+        order = np.argsort(starts, kind="stable")
+        self._prefix_table = (
+            np.asarray(starts, dtype=np.uint32)[order],
+            np.asarray(ends, dtype=np.uint32)[order],
+            [countries[i] for i in order],
+        )
+
+    def get_countries(self, ip_addresses: Iterable[str]) -> List[str]:
+        """
+        Returns the country code of every IP, like `get_country` would.
+        IPs not seen before are sorted and resolved together against a prefix table extracted
+        once from the database, instead of doing one database lookup per IP.
+        """
+        ip_addresses = list(ip_addresses)
+        pending = [
+            ip
+            for ip in dict.fromkeys(ip_addresses)
+            if ip not in self._cache
+            and not ip.startswith(("127.", "192.", "10."))  # get_country answers these
+        ]
+        resolved: Dict[str, str] = {}  # Kept apart: the cache may evict some of them
+
+        if pending and self.reader:
+            ipv4, numbers = [], []
+            for ip in pending:
+                try:
+                    numbers.append(int(ipaddress.IPv4Address(ip)))
+                    ipv4.append(ip)
+                except ValueError:
+                    pass  # IPv6 and invalid IPs go through get_country
+
+            if ipv4:
+                if self._prefix_table is None:
+                    self._load_prefix_table()
+                starts, ends, countries = self._prefix_table
+
+                numbers = np.asarray(numbers, dtype=np.uint32)
+                order = np.argsort(numbers)
+                sorted_numbers = numbers[order]
+                positions = np.searchsorted(starts, sorted_numbers, side="right") - 1
+                found = (positions >= 0) & (
+                    sorted_numbers <= ends[np.maximum(positions, 0)]
+                )
+                for ip_position, position, is_found in zip(
+                    order.tolist(), positions.tolist(), found.tolist()
+                ):
+                    resolved[ipv4[ip_position]] = self._cache.put(
+                        ipv4[ip_position], countries[position] if is_found else "XX"
+                    )
+
+        return _answers(self, ip_addresses, resolved)
+
+    def get_countries_parallel(
+        self,
+        ip_addresses: Iterable[str],
+        workers: int,
+        chunk_size: int = PARALLEL_CHUNK_SIZE,
+    ) -> List[str]:
+        """
+        Returns the country code of every IP, like `get_country` would, resolving the IPs not
+        seen before across `workers` processes. Each worker opens its own memory-mapped reader
+        and resolves whole chunks; the chunks are merged back in order.
+        """
+        ip_addresses = list(ip_addresses)
+        pending = [ip for ip in dict.fromkeys(ip_addresses) if ip not in self._cache]
+        resolved: Dict[str, str] = {}
+
+        if pending and self.reader:
+            chunks = [
+                pending[i : i + chunk_size] for i in range(0, len(pending), chunk_size)
+            ]
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(self.db_path,),
+            ) as executor:
+                for chunk, countries in zip(
+                    chunks, executor.map(_resolve_chunk, chunks)
+                ):
+                    for ip, country in zip(chunk, countries):
+                        resolved[ip] = self._cache.put(ip, country)
+
+        return _answers(self, ip_addresses, resolved)
+
+
+# region Aux functions
+def _read_prefix_table(path: str, build_id: str):
+    """The prefix table cached in `path`, or None if it was extracted from another build."""
+    with np.load(path, allow_pickle=False) as cached:
+        if str(cached["build_id"]) != build_id:
+            return None
+        names = [name or None for name in cached["names"].tolist()]  # "" for no country
+        return (
+            cached["starts"],
+            cached["ends"],
+            [names[code] for code in cached["codes"].tolist()],
+        )
+
+
+def _write_prefix_table(path: str, build_id: str, prefix_table):
+    """Writes the prefix table with its countries interned, then moves it into place."""
+    starts, ends, countries = prefix_table
+    codes: Dict[str | None, int] = {}
+    country_codes = [codes.setdefault(country, len(codes)) for country in countries]
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            build_id=np.array(build_id),
+            starts=starts,
+            ends=ends,
+            codes=np.asarray(country_codes, dtype=np.uint16),
+            names=np.array([country or "" for country in codes]),
+        )
+    os.replace(tmp_path, path)
+
+
+def _answers(
+    geo_locator: IPGeolocation, ip_addresses: List[str], resolved: Dict[str, str]
+) -> List[str]:
+    """The country of every IP: the resolved ones, then the cache or a database lookup."""
+    return [
+        resolved[ip] if ip in resolved else geo_locator.get_country(ip)
+        for ip in ip_addresses
+    ]
+
+
+# endregion
+
+
+# region Worker processes
+_worker_locator: IPGeolocation | None = None
+
+
+def _mmap_mode() -> int:
+    """Memory-mapped reads, through the C extension of maxminddb when it is installed."""
+    try:
+        import maxminddb.extension  # noqa: F401
+    except ImportError:
+        return maxminddb.MODE_MMAP
+    return maxminddb.MODE_MMAP_EXT
+
+
+def _init_worker(db_path: str):
+    global _worker_locator
+    _worker_locator = IPGeolocation(db_path, mode=_mmap_mode())
+
+
+def _resolve_chunk(ip_addresses: Sequence[str]) -> List[str]:
+    return [_worker_locator.get_country(ip) for ip in ip_addresses]
+
+
+# endregion
@@ -0,0 +1,160 @@
+from dataclasses import dataclass
+from typing import List, Sequence, Set
+
+import numpy as np
+
+from taps import PathSelector
+
+PAIR_BLOCK_SIZE = 1 << 20  # (guard, exit) pairs evaluated at once for the middle relay
+
+
+@dataclass
+class ExactEvaluation:
+    """
+    Exact probabilities of the path selection of a PathSelector, over all possible paths.
+    Like the Monte Carlo estimates of evaluate.py, paths that can't be built count as
+    neither compromised nor vulnerable.
+
+    Attributes:
+        guard_in_adversary (float): Probability that the guard is in an adversary country.
+        middle_in_adversary (float | None): Probability that the middle is in an adversary
+            country, None unless asked for (it costs one term per (guard, exit) pair).
+        exit_in_adversary (float): Probability that the exit is in an adversary country.
+        correlation (float): Probability that a country sees both ends of the path,
+            i.e. {client, guard} & {exit, destination} is not empty.
+        valid (float): Probability that a path can be built at all.
+    """
+
+    guard_in_adversary: float = 0.0
+    middle_in_adversary: float | None = None
+    exit_in_adversary: float = 0.0
+    correlation: float = 0.0
+    valid: float = 0.0
+
+
+def evaluate_exact(
+    selector: PathSelector, adversaries: Set[str], with_middle: bool = False
+) -> ExactEvaluation:
+    """
+    Computes the probabilities of ExactEvaluation from the selection distributions.
+
+    Guards are drawn from the secure guard pool proportionally to bandwidth, and every guard
+    of the same country (and ASN, with filter_asn_country) shares one secure exit pool:
+    the guards are grouped like that and each group is weighted by its exit pool, which takes
+    a few operations per exit of each group.
+    The middle is drawn from all the relays but the guard and the exit, so its probability of
+    being in an adversary country (`with_middle`) is summed over every (guard, exit) pair.
+    """
+    return evaluate_exact_many(selector, [adversaries], with_middle)[0]
+
+
+def evaluate_exact_many(
+    selector: PathSelector,
+    adversary_sets: Sequence[Set[str]],
+    with_middle: bool = False,
+) -> List[ExactEvaluation]:
+    """
+    evaluate_exact against each of `adversary_sets`, in a single pass over the pools of the
+    selector: only the adversary columns of the computation depend on the set.
+    """
+    relays = selector.relays
+    n_sets = len(adversary_sets)
+    bandwidth = relays.bandwidth.astype(np.float64)
+    is_adversary = np.array(
+        [
+            [country in adversaries for country in relays.countries]
+            for adversaries in adversary_sets
+        ],
+        dtype=bool,
+    ).reshape(n_sets, len(relays.countries))[:, relays.country_codes]
+    adversary_bandwidth = np.where(is_adversary, bandwidth, 0.0)
+    total_bandwidth = bandwidth.sum()
+    total_adversary_bandwidth = adversary_bandwidth.sum(axis=1)
+
+    client = relays.country_ids.get(selector.config.client_country, -1)
+    destination = relays.country_ids.get(selector.config.destination_country, -1)
+    same_ends = selector.config.client_country == selector.config.destination_country
+
+    guard_in_adversary = np.zeros(n_sets)
+    middle_in_adversary = np.zeros(n_sets)
+    exit_in_adversary = np.zeros(n_sets)
+    correlation = 0.0
+    valid_paths = 0.0
+
+    # Unless at most two relays have bandwidth, every (guard, exit) pair leaves a middle
+    every_pair_has_middle = np.count_nonzero(bandwidth) > 2
+    guards = np.asarray(selector.guard_sampler.nodes, dtype=np.int64)
+    if len(guards) and bandwidth[guards].sum() > 0:
+        guard_probabilities = bandwidth[guards] / bandwidth[guards].sum()
+        group_keys = relays.country_codes[guards].astype(np.int64)
+        if selector.filter_asn_country:
+            group_keys = group_keys * len(relays.asns) + relays.asn_codes[guards]
+    else:
+        group_keys = np.empty(0, dtype=np.int64)
+
+    for key in np.unique(group_keys):
+        in_group = group_keys == key
+        group_guards = guards[in_group]
+        group_probabilities = guard_probabilities[in_group]
+        exits = np.asarray(selector.exit_sampler(group_guards[0]).nodes, dtype=np.int64)
+        if len(exits) == 0 or bandwidth[exits].sum() == 0:
+            continue  # No exit for these guards, their paths can't be built
+        exit_probabilities = bandwidth[exits] / bandwidth[exits].sum()
+
+        guard_country = relays.country_codes[group_guards[0]]
+        exit_countries = relays.country_codes[exits]
+        vulnerable = (
+            same_ends
+            | (exit_countries == client)
+            | (exit_countries == guard_country)
+            | (guard_country == destination)
+        )
+
+        if every_pair_has_middle and not with_middle:
+            p_group = group_probabilities.sum()
+            valid_paths += p_group
+            guard_in_adversary += is_adversary[:, group_guards] @ group_probabilities
+            exit_in_adversary += p_group * (is_adversary[:, exits] @ exit_probabilities)
+            correlation += p_group * (exit_probabilities @ vulnerable)
+            continue
+
+        # Per guard of the group, summed over its exits. A pair (guard, exit) only leads to
+        # a path when some bandwidth is left to draw the middle from, which then is in an
+        # adversary country with probability (adversary bandwidth left / bandwidth left).
+        block = max(1, PAIR_BLOCK_SIZE // (len(exits) * n_sets))
+        for start in range(0, len(group_guards), block):
+            rows = group_guards[start : start + block, None]
+            same_relay = rows == exits[None, :]
+            left = total_bandwidth - (
+                bandwidth[rows] + np.where(same_relay, 0.0, bandwidth[exits][None, :])
+            )
+            has_middle = left > 0
+            pairs = np.where(has_middle, exit_probabilities[None, :], 0.0)
+            p_guards = group_probabilities[start : start + block]
+
+            valid = p_guards * pairs.sum(axis=1)
+            valid_paths += valid.sum()
+            guard_in_adversary += is_adversary[:, rows[:, 0]] @ valid
+            exit_in_adversary += (pairs @ is_adversary[:, exits].T).T @ p_guards
+            correlation += p_guards @ (pairs @ vulnerable)
+            if with_middle:
+                adversary_left = total_adversary_bandwidth[:, None, None] - (
+                    adversary_bandwidth[:, rows]
+                    + np.where(
+                        same_relay, 0.0, adversary_bandwidth[:, exits][:, None, :]
+                    )
+                )
+                middle_in_adversary += (
+                    pairs * adversary_left / np.where(has_middle, left, 1.0)
+                ).sum(axis=2) @ p_guards
+
+    return [
+        ExactEvaluation(
+            guard_in_adversary=guard_in_adversary[i],
+            middle_in_adversary=middle_in_adversary[i] if with_middle else None,
+            exit_in_adversary=exit_in_adversary[i],
+            correlation=correlation,
+            valid=valid_paths,
+        )
+        for i in range(n_sets)
+    ]
@@ -14,3 +14,16 @@ def __is_node_acceptable(score: float, s_star: float, alpha_params: Params) -> b
     return (score >= s_star * alpha_params.accept_upper) and (
         (1 - score) <= (1 - s_star) * alpha_params.accept_lower
     )
+
+
+# Same checks over arrays of scores, returning boolean masks
+def __are_nodes_safe(scores, s_star: float, alpha_params: Params):
+    return (scores >= s_star * alpha_params.safe_upper) & (
+        (1 - scores) <= (1 - s_star) * alpha_params.safe_lower
+    )
+
+
+def __are_nodes_acceptable(scores, s_star: float, alpha_params: Params):
+    return (scores >= s_star * alpha_params.accept_upper) & (
+        (1 - scores) <= (1 - s_star) * alpha_params.accept_lower
+    )
@@ -0,0 +1,275 @@
+import argparse
+import json
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Sequence
+
+import numpy as np
+
+from models import TorNode, InputConfig, Params, Result, parse_input_config
+from sampler import WeightedSampler
+from relayTable import RelayTable
+from taps import (
+    PathSelector,
+    MAX_MIDDLE_REDRAWS,
+    GEOLITE_DB_PATH,
+    DEFAULT_NODES_DATA_PATH,
+    DEFAULT_CONFIG_PATH,
+    GUARD_PARAMS,
+    EXIT_PARAMS,
+)
+
+
+@dataclass
+class PathBatch:
+    """
+    A batch of paths stored as relay index arrays into `relays`.
+    An index of -1 means that the path could not be built (same as select_path returning None).
+    `Result` objects are only created when a path is accessed.
+    """
+
+    relays: RelayTable
+    guards: np.ndarray
+    middles: np.ndarray
+    exits: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.guards)
+
+    @property
+    def valid(self) -> np.ndarray:
+        return (self.guards >= 0) & (self.middles >= 0) & (self.exits >= 0)
+
+    def result(self, i: int) -> Result | None:
+        if self.guards[i] < 0 or self.middles[i] < 0 or self.exits[i] < 0:
+            return None
+        return Result(
+            guard_node=self.relays.node(self.guards[i]),
+            middle_node=self.relays.node(self.middles[i]),
+            exit_node=self.relays.node(self.exits[i]),
+        )
+
+    def __iter__(self) -> Iterator[Result | None]:
+        return (self.result(i) for i in range(len(self)))
+
+    def results(self) -> List[Result | None]:
+        return list(self)
+
+    def __getitem__(self, part: slice) -> "PathBatch":
+        return PathBatch(
+            self.relays, self.guards[part], self.middles[part], self.exits[part]
+        )
+
+
+# region Aux functions
+def _draw(sampler: WeightedSampler, size: int, rng: np.random.Generator) -> np.ndarray:
+    """Draws `size` relay indices from a sampler whose pool holds relay indices."""
+    cumulative = np.asarray(sampler.cumulative, dtype=np.float64)
+    points = rng.uniform(0, cumulative[-1], size)
+    positions = np.searchsorted(cumulative, points, side="left")
+    return np.asarray(sampler.nodes, dtype=np.int64)[positions]
+
+
+# endregion
+
+
+def draw_paths(
+    selector: PathSelector, n: int, rng: np.random.Generator | None = None
+) -> PathBatch:
+    """
+    Draws `n` paths from a PathSelector in bulk.
+    Guards are drawn first, then the exits of each guard country group, then the middles,
+    which are drawn from the whole consensus and redrawn when they hit the guard or the exit.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    relays = selector.relays
+
+    guards = np.full(n, -1, dtype=np.int64)
+    middles = np.full(n, -1, dtype=np.int64)
+    exits = np.full(n, -1, dtype=np.int64)
+
+    # Step 1: Guards
+    if not selector.guard_sampler.nodes:
+        return PathBatch(relays, guards, middles, exits)
+    guards[:] = _draw(selector.guard_sampler, n, rng)
+
+    # Step 2: Exits, one draw per group of guards that share the same exit pool
+    path_keys = relays.country_codes[guards].astype(np.int64)
+    if selector.filter_asn_country:
+        path_keys = path_keys * len(relays.asns) + relays.asn_codes[guards]
+
+    for key in np.unique(path_keys):
+        members = np.flatnonzero(path_keys == key)
+        exit_sampler = selector.exit_sampler(guards[members[0]])
+        if not exit_sampler.nodes:
+            continue
+        exits[members] = _draw(exit_sampler, len(members), rng)
+
+    # Step 3: Middles, from the whole consensus excluding the chosen guard and exit
+    pending = np.flatnonzero(exits >= 0)
+    if len(pending) == 0:
+        return PathBatch(relays, guards, middles, exits)
+
+    fingerprints = relays.fingerprints
+    for _ in range(MAX_MIDDLE_REDRAWS):
+        middles[pending] = _draw(selector.middle_sampler, len(pending), rng)
+        middle_fingerprints = fingerprints[middles[pending]]
+        collides = (middle_fingerprints == fingerprints[guards[pending]]) | (
+            middle_fingerprints == fingerprints[exits[pending]]
+        )
+        pending = pending[collides]
+        if len(pending) == 0:
+            break
+
+    # Paths whose guard and exit hold (almost) all the bandwidth fall back to an exact draw
+    for i in pending:
+        candidates = np.flatnonzero(
+            (fingerprints != fingerprints[guards[i]])
+            & (fingerprints != fingerprints[exits[i]])
+        )
+        if len(candidates) == 0:
+            middles[i] = -1
+            continue
+        sampler = WeightedSampler(
+            candidates.tolist(), relays.bandwidth[candidates].tolist()
+        )
+        middles[i] = _draw(sampler, 1, rng)[0]
+
+    return PathBatch(relays, guards, middles, exits)
+
+
+def select_paths(
+    nodes: List[TorNode] | RelayTable,
+    config: InputConfig,
+    alpha_guard: Params,
+    alpha_exit: Params,
+    n: int,
+    seed: int | None = None,
+    filter_asn_country: bool = False,
+) -> PathBatch:
+    """
+    Batch version of select_path: draws `n` Guard-Middle-Exit paths at once.
+    """
+    selector = PathSelector(nodes, config, alpha_guard, alpha_exit, filter_asn_country)
+    return draw_paths(selector, n, np.random.default_rng(seed))
+
+
+def select_paths_for_configs(
+    nodes: List[TorNode] | RelayTable,
+    configs: Sequence[InputConfig],
+    alpha_guard: Params,
+    alpha_exit: Params,
+    n: int = 1,
+    seed: int | None = None,
+    filter_asn_country: bool = False,
+) -> List[PathBatch]:
+    """
+    Draws `n` paths for each config, returning one PathBatch per config in the same order.
+    Configs are grouped by their selection key (client country, destination country,
+    destination and alliances): each group builds its trust map and secure pools once, in
+    one PathSelector, and the paths of all its members are drawn in a single bulk draw.
+    """
+    relays = nodes if isinstance(nodes, RelayTable) else RelayTable.from_nodes(nodes)
+    rng = np.random.default_rng(seed)
+
+    groups: Dict[tuple, List[int]] = {}
+    for i, config in enumerate(configs):
+        groups.setdefault(config.selection_key(), []).append(i)
+
+    batches: List[PathBatch | None] = [None] * len(configs)
+    for members in groups.values():
+        selector = PathSelector(
+            relays, configs[members[0]], alpha_guard, alpha_exit, filter_asn_country
+        )
+        paths = draw_paths(selector, n * len(members), rng)
+        for j, i in enumerate(members):
+            batches[i] = paths[j * n : (j + 1) * n]
+    return batches
+
+
+def read_input_configs(
+    path: str, geo_locator, default_alliances: List[dict] | None = None
+) -> List[InputConfig]:
+    """
+    Reads client configs from a JSONL file, one config object (as in the input JSON files)
+    per line. Lines without "Alliances" get `default_alliances`.
+    """
+    configs = []
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                config_data = {"Alliances": default_alliances or [], **json.loads(line)}
+                configs.append(parse_input_config(config_data, geo_locator))
+    return configs
+
+
+def main(argv: List[str] | None = None):
+    """Command-line entry point: draws paths for every client config of a JSONL file."""
+    from GeoLocator import IPGeolocation
+    from snapshot import load_relay_table_cached
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--nodes",
+        dest="nodes_data_path",
+        default=DEFAULT_NODES_DATA_PATH,
+        help="Path to the Tor nodes consensus JSON file",
+    )
+    parser.add_argument(
+        "--configs",
+        dest="configs_path",
+        required=True,
+        help="JSONL file with one client config per line",
+    )
+    parser.add_argument(
+        "--config",
+        dest="config_path",
+        default=DEFAULT_CONFIG_PATH,
+        help="Config JSON file whose alliances are used by configs without their own",
+    )
+    parser.add_argument("--paths", type=int, default=1, help="Paths per config")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    geo_locator = IPGeolocation(GEOLITE_DB_PATH)
+    if not geo_locator.reader:
+        exit()
+    with open(args.config_path, "r") as f:
+        default_alliances = json.load(f).get("Alliances", [])
+    configs = read_input_configs(args.configs_path, geo_locator, default_alliances)
+    relays = load_relay_table_cached(args.nodes_data_path, geo_locator)
+
+    batches = select_paths_for_configs(
+        relays,
+        configs,
+        Params(**GUARD_PARAMS),
+        Params(**EXIT_PARAMS),
+        n=args.paths,
+        seed=args.seed,
+    )
+    # One JSON line per config: its paths as [guard, middle, exit] fingerprints
+    for config, paths in zip(configs, batches):
+        fingerprints = [
+            (
+                [
+                    path.guard_node.fingerprint,
+                    path.middle_node.fingerprint,
+                    path.exit_node.fingerprint,
+                ]
+                if path
+                else None
+            )
+            for path in paths
+        ]
+        print(
+            json.dumps(
+                {
+                    "Client": config.client,
+                    "Destination": config.destination,
+                    "paths": fingerprints,
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Tuple
+
+from GeoLocator import IPGeolocation
+from models import Params, parse_input_config, parse_tor_nodes
+from relayTable import RelayTable
+from syntheticConsensus import SyntheticGeoLocator, generate_relays
+from taps import (
+    PathSelector,
+    _bandwidth_weighted_choice,
+    _find_secure_relays,
+    _get_country_trust_map,
+    guard_security,
+    select_guard_node,
+    select_exit_node,
+    select_middle_node,
+    select_path,
+    GEOLITE_DB_PATH,
+    GUARD_PARAMS,
+    EXIT_PARAMS,
+)
+
+BENCHMARK_RELAYS = 5_000  # Size of the fixed synthetic consensus
+BENCHMARK_SEED = 0
+BENCHMARK_CONFIG = {
+    "Alliances": [
+        {"countries": ["US", "GB", "CA"], "trust": 0.6},
+        {"countries": ["RU"], "trust": 0.2},
+        {"countries": ["DE", "FR", "NL"], "trust": 0.9},
+    ],
+    "Client": "1.0.0.1",
+    "Destination": "2.0.0.2",
+}
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = (
+    0.25  # A hot path regresses when 25% slower (or bigger) than the baseline
+)
+DEFAULT_BASELINE_PATH = "benchmark_baseline.json"
+SELECT_DRAWS = 1_000  # PathSelector.select calls per run
+
+
+@dataclass
+class BenchmarkResult:
+    """
+    Measurements of one hot path.
+
+    Attributes:
+        calls (int): Calls of the hot path per run.
+        per_call_us (float): Time per call of the fastest sample, in microseconds.
+        calls_per_s (float): Calls per second of the fastest sample (paths per second for
+            the path selection benchmarks).
+        peak_bytes (int): Peak memory allocated during one run (tracemalloc).
+    """
+
+    calls: int
+    per_call_us: float
+    calls_per_s: float
+    peak_bytes: int
+
+
+def measure(run: Callable[[], object], calls: int, repeat: int) -> BenchmarkResult:
+    """
+    Times `repeat` samples of `run`, which makes `calls` calls of a hot path, then traces
+    one run. Each sample loops over `run` for at least 0.2 s (timeit autorange).
+    """
+    timer = timeit.Timer(run)
+    loops, _ = timer.autorange()
+    best = min(timer.repeat(repeat, loops)) / loops
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return BenchmarkResult(
+        calls=calls,
+        per_call_us=best / calls * 1e6,
+        calls_per_s=calls / best if best > 0 else float("inf"),
+        peak_bytes=peak_bytes,
+    )
+
+
+# region Aux functions
+def _hot_paths(
+    n_relays: int, seed: int, db_path: str
+) -> Dict[str, Tuple[Callable[[], object], int]]:
+    """
+    Returns the (run, calls) of every hot path, over a synthetic consensus of `n_relays`.
+    Runs seed `random` first, so that they draw the same relays every time.
+    """
+    records = list(generate_relays(n_relays, seed))
+    synthetic_locator = SyntheticGeoLocator()
+    nodes = parse_tor_nodes(records, synthetic_locator)
+    relays = RelayTable.from_nodes(nodes)
+    config = parse_input_config(BENCHMARK_CONFIG, synthetic_locator)
+    trust_map = _get_country_trust_map(config)
+    guard_params = Params(**GUARD_PARAMS)
+    exit_params = Params(**EXIT_PARAMS)
+    guard_scores = {
+        node.fingerprint: guard_security(config.client_country, node.country, trust_map)
+        for node in nodes
+    }
+    total_bandwidth = sum(node.bandwidth.measured for node in nodes)
+
+    random.seed(seed)
+    guard = select_guard_node(nodes, config, guard_params, trust_map)
+    exit_node = select_exit_node(nodes, config, exit_params, trust_map, guard)
+    selector = PathSelector(relays, config, guard_params, exit_params)
+
+    def seeded(function):
+        def run():
+            random.seed(seed)
+            return function()
+
+        return run
+
+    def draw_paths():
+        for _ in range(SELECT_DRAWS):
+            selector.select()
+
+    hot_paths = {
+        "parse_tor_nodes": (lambda: parse_tor_nodes(records, synthetic_locator), 1),
+        "_find_secure_relays": (
+            lambda: _find_secure_relays(
+                nodes, guard_scores, guard_params, total_bandwidth
+            ),
+            1,
+        ),
+        "_bandwidth_weighted_choice": (
+            seeded(lambda: _bandwidth_weighted_choice(nodes)),
+            1,
+        ),
+        "select_guard_node": (
+            seeded(lambda: select_guard_node(nodes, config, guard_params, trust_map)),
+            1,
+        ),
+        "select_exit_node": (
+            seeded(
+                lambda: select_exit_node(nodes, config, exit_params, trust_map, guard)
+            ),
+            1,
+        ),
+        "select_middle_node": (
+            seeded(lambda: select_middle_node(nodes, guard, exit_node)),
+            1,
+        ),
+        "select_path": (
+            seeded(lambda: select_path(relays, config, guard_params, exit_params)),
+            1,
+        ),
+        "PathSelector.select": (seeded(draw_paths), SELECT_DRAWS),
+    }
+
+    if os.path.exists(db_path):
+        geo_locator = IPGeolocation(db_path)
+        ips = [record["ip"] for record in records]
+
+        def lookup_countries():
+            geo_locator._cache.clear()  # Measure database lookups, not the cache
+            for ip in ips:
+                geo_locator.get_country(ip)
+
+        hot_paths["IPGeolocation.get_country"] = (lookup_countries, len(ips))
+    return hot_paths
+
+
+# endregion
+
+
+def run_benchmarks(
+    n_relays: int = BENCHMARK_RELAYS,
+    seed: int = BENCHMARK_SEED,
+    repeat: int = DEFAULT_REPEAT,
+    db_path: str = GEOLITE_DB_PATH,
+) -> Dict[str, BenchmarkResult]:
+    """Measures every hot path. IPGeolocation.get_country is only measured when `db_path` exists."""
+    return {
+        name: measure(run, calls, repeat)
+        for name, (run, calls) in _hot_paths(n_relays, seed, db_path).items()
+    }
+
+
+def find_regressions(
+    results: Dict[str, BenchmarkResult],
+    baseline: Dict[str, dict],
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> List[str]:
+    """
+    Returns a description of every hot path whose time per call or peak memory is more
+    than `tolerance` above the baseline. Hot paths missing from either side are skipped.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for field in ("per_call_us", "peak_bytes"):
+            reference = baseline[name][field]
+            value = getattr(result, field)
+            if reference > 0 and value > reference * (1 + tolerance):
+                regressions.append(
+                    f"{name}: {field} {value:.1f} vs baseline {reference:.1f} "
+                    f"(+{value / reference - 1:.0%})"
+                )
+    return regressions
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the path selection hot paths against a stored baseline"
+    )
+    parser.add_argument("--relays", type=int, default=BENCHMARK_RELAYS)
+    parser.add_argument("--seed", type=int, default=BENCHMARK_SEED)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Allowed slowdown (or memory growth) over the baseline, as a fraction",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store these results as the new baseline instead of comparing to it",
+    )
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.relays, args.seed, args.repeat)
+    print(f"{'hot path':>28} | {'us/call':>10} | {'calls/s':>10} | {'peak KB':>9}")
+    for name, result in results.items():
+        print(
+            f"{name:>28} | {result.per_call_us:>10.1f} | {result.calls_per_s:>10.0f} | "
+            f"{result.peak_bytes / 1e3:>9.1f}"
+        )
+
+    setup = {
+        "relays": args.relays,
+        "seed": args.seed,
+        "python": platform.python_version(),
+    }
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {
+                    "setup": setup,
+                    "results": {name: asdict(r) for name, r in results.items()},
+                },
+                f,
+                indent=2,
+            )
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):  # The gate must not pass without a reference
+        print(
+            f"ERROR: No baseline at {args.baseline}, "
+            "run with --update-baseline to create it"
+        )
+        sys.exit(2)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["setup"] != setup:
+        print(f"ERROR: The baseline was measured with {baseline['setup']}, not {setup}")
+        sys.exit(2)
+
+    regressions = find_regressions(results, baseline["results"], args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"No hot path regressed by more than {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
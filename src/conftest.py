@@ -0,0 +1,114 @@
+import ipaddress
+import json
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import geoip2.database
+import geoip2.errors
+import pytest
+
+from datasetRegistry import registry
+from models import InputConfig, Params, TorNode, parse_input_config, parse_tor_nodes
+from relayTable import RelayTable
+from syntheticConsensus import SyntheticGeoLocator, generate_relays
+from taps import PathSelector, GUARD_PARAMS, EXIT_PARAMS
+
+SYNTHETIC_CONFIG_PATH = "../inputs/inputOriginal.json"
+
+
+@pytest.fixture(scope="session")
+def datasets():
+    """
+    The consensuses, configs and GeoIP reader of the tests, loaded once per process.
+    Each pytest-xdist worker is its own process: it loads them once, from the snapshot.
+    """
+    return registry
+
+
+@dataclass
+class SyntheticSelection:
+    """
+    A synthetic consensus and the client config of SYNTHETIC_CONFIG_PATH, both located by
+    SyntheticGeoLocator, with the default Params. The relay table is shared (read-only).
+    """
+
+    geo_locator: SyntheticGeoLocator
+    nodes: List[TorNode]
+    relays: RelayTable
+    alliances: List[dict]
+    config: InputConfig
+    alpha_guard: Params
+    alpha_exit: Params
+
+    def selector(self) -> PathSelector:
+        return PathSelector(self.relays, self.config, self.alpha_guard, self.alpha_exit)
+
+
+@pytest.fixture(scope="session")
+def synthetic_selection() -> Callable[[int], SyntheticSelection]:
+    """`synthetic_selection(n_relays)` returns a SyntheticSelection, built once per size."""
+    built: Dict[int, SyntheticSelection] = {}
+
+    def build(n_relays: int = 2_000) -> SyntheticSelection:
+        if n_relays not in built:
+            geo_locator = SyntheticGeoLocator()
+            with open(SYNTHETIC_CONFIG_PATH) as f:
+                config_data = json.load(f)
+            nodes = parse_tor_nodes(list(generate_relays(n_relays)), geo_locator)
+            built[n_relays] = SyntheticSelection(
+                geo_locator=geo_locator,
+                nodes=nodes,
+                relays=RelayTable.from_nodes(nodes).freeze(),
+                alliances=config_data["Alliances"],
+                config=parse_input_config(config_data, geo_locator),
+                alpha_guard=Params(**GUARD_PARAMS),
+                alpha_exit=Params(**EXIT_PARAMS),
+            )
+        return built[n_relays]
+
+    return build
+
+
+class StubGeoIPReader:
+    """
+    Stands in for geoip2.database.Reader over a few (network, country) pairs, so the GeoIP
+    tests do not need the GeoLite2 database. A None country is a network without a country.
+    """
+
+    def __init__(
+        self, networks: Sequence[Tuple[str, str | None]], build_epoch: int = 1
+    ):
+        self.networks = [
+            (ipaddress.ip_network(network), country) for network, country in networks
+        ]
+        self.build_epoch = build_epoch
+
+    def metadata(self):
+        return SimpleNamespace(
+            database_type="Stub-Country", build_epoch=self.build_epoch
+        )
+
+    def country(self, ip_address: str):
+        ip = ipaddress.ip_address(ip_address)
+        for network, country in self.networks:
+            if ip in network:
+                return SimpleNamespace(country=SimpleNamespace(iso_code=country))
+        raise geoip2.errors.AddressNotFoundError(f"{ip_address} not found", ip_address)
+
+
+@pytest.fixture
+def stub_geoip_reader(monkeypatch) -> Callable[..., None]:
+    """
+    `stub_geoip_reader(networks, build_epoch)` makes every IPGeolocation created afterwards
+    (worker processes included, as they are forked) read a StubGeoIPReader.
+    """
+
+    def install(networks: Sequence[Tuple[str, str | None]], build_epoch: int = 1):
+        monkeypatch.setattr(
+            geoip2.database,
+            "Reader",
+            lambda db_path, mode=None: StubGeoIPReader(networks, build_epoch),
+        )
+
+    return install
@@ -0,0 +1,107 @@
+import json
+import sys
+from itertools import islice
+from typing import IO, Iterable, Iterator, Tuple
+
+from relayTable import RelayTable, RelayTableBuilder
+
+READ_CHUNK_SIZE = 1 << 16  # Characters read from the consensus at a time
+STDIN_PATH = "-"
+GEOLOCATION_BATCH_SIZE = 4096  # Relays geolocated together
+
+
+def iter_json_array(fp: IO[str], chunk_size: int = READ_CHUNK_SIZE) -> Iterator:
+    """
+    Yields the elements of a top-level JSON array one at a time, reading `fp` in chunks,
+    so that the whole document is never held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    expecting = "["  # '[', then an element or ']', then ',' or ']' after each element
+
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+
+        need_more = pos == len(buffer)
+        if not need_more:
+            char = buffer[pos]
+            if expecting == "[":
+                if char != "[":
+                    raise ValueError(
+                        "The consensus file must be a JSON array of relays"
+                    )
+                pos += 1
+                expecting = "element"
+                continue
+            if char == "]" and expecting != "next element":
+                return
+            if expecting == ",":
+                if char != ",":
+                    raise ValueError("Expected ',' between the relays of the consensus")
+                pos += 1
+                expecting = "next element"
+                continue
+
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                need_more = True
+            else:
+                # A value that ends with the buffer (e.g. a number) may go on in the next chunk
+                need_more = end == len(buffer) and not eof
+                if not need_more:
+                    yield element
+                    pos = end
+                    expecting = ","
+                    continue
+
+        if eof:
+            raise ValueError("Unexpected end of the consensus file")
+        chunk = fp.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+
+def iter_relay_records(path: str) -> Iterator[dict]:
+    """Yields the relay records of a consensus JSON file, or of stdin when `path` is '-'."""
+    if path == STDIN_PATH:
+        yield from iter_json_array(sys.stdin)
+        return
+    with open(path, "r") as f:
+        yield from iter_json_array(f)
+
+
+def geolocate(
+    records: Iterable[dict], geo_locator, batch_size: int = GEOLOCATION_BATCH_SIZE
+) -> Iterator[Tuple[dict, str]]:
+    """
+    Pairs every relay record with the country of its IP.
+    Records are resolved in bounded batches through the bulk lookup of the geolocator.
+    """
+    records = iter(records)
+    while batch := list(islice(records, batch_size)):
+        countries = geo_locator.get_countries(record["ip"] for record in batch)
+        yield from zip(batch, countries)
+
+
+def build_relay_table(located_records: Iterable[Tuple[dict, str]]) -> RelayTable:
+    """Appends geolocated relay records straight into the columns of a RelayTable."""
+    builder = RelayTableBuilder()
+    for record, country in located_records:
+        builder.append(record, country)
+    return builder.build()
+
+
+def load_relay_table(path: str, geo_locator) -> RelayTable:
+    """
+    Streams a consensus into a RelayTable: records are read, geolocated and appended one at a
+    time, so peak memory stays close to the size of the final table.
+    Exit policies are parsed once per distinct policy when the table is built.
+    """
+    return build_relay_table(geolocate(iter_relay_records(path), geo_locator))
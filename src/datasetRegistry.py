@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+from typing import Callable, Dict, Tuple
+
+from GeoLocator import IPGeolocation
+from models import InputConfig, TorNode, parse_input_config, parse_tor_nodes
+from relayTable import RelayTable
+from snapshot import load_relay_table_cached
+from taps import GEOLITE_DB_PATH
+
+
+class DatasetRegistry:
+    """
+    Memoizes the datasets loaded in a process: GeoIP readers, relay tables, parsed nodes
+    and client configs, keyed by the path, modification time and size of their file (and
+    the GeoIP build for what was geolocated). A file that changes on disk is loaded again,
+    and the entries of its previous versions are dropped.
+
+    Datasets are shared between every caller and must not be modified: relay tables are
+    handed out frozen (RelayTable.freeze) and nodes as tuples.
+    Relay tables are loaded through their binary snapshot (see load_relay_table_cached),
+    so other processes, such as the workers of pytest-xdist, only pay for reading it.
+    """
+
+    def __init__(self):
+        self._entries: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind: str, path: str, load: Callable, *extra_key):
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+            version = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            version = None  # Let `load` report the missing file
+        key = (kind, path, version, *extra_key)
+
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+        value = load()
+        with self._lock:
+            # Drop the entries of the previous versions of the file
+            for stale in [k for k in self._entries if k[:2] == key[:2] and k != key]:
+                del self._entries[stale]
+            return self._entries.setdefault(key, value)
+
+    def geo_locator(self, db_path: str = GEOLITE_DB_PATH) -> IPGeolocation:
+        return self._get("geo_locator", db_path, lambda: IPGeolocation(db_path))
+
+    def relays(self, nodes_path: str, db_path: str = GEOLITE_DB_PATH) -> RelayTable:
+        """Returns the relay table of a consensus file, geolocated with `db_path`."""
+        geo_locator = self.geo_locator(db_path)
+        return self._get(
+            "relays",
+            nodes_path,
+            lambda: load_relay_table_cached(nodes_path, geo_locator).freeze(),
+            geo_locator.build_id(),
+        )
+
+    def nodes(
+        self, nodes_path: str, db_path: str = GEOLITE_DB_PATH
+    ) -> Tuple[TorNode, ...]:
+        """Returns the parsed TorNodes of a consensus file, geolocated with `db_path`."""
+        geo_locator = self.geo_locator(db_path)
+
+        def load():
+            with open(nodes_path) as f:
+                return tuple(parse_tor_nodes(json.load(f), geo_locator))
+
+        return self._get("nodes", nodes_path, load, geo_locator.build_id())
+
+    def input_config(
+        self, config_path: str, db_path: str = GEOLITE_DB_PATH
+    ) -> InputConfig:
+        """Returns the parsed client config of a JSON file, geolocated with `db_path`."""
+        geo_locator = self.geo_locator(db_path)
+
+        def load():
+            with open(config_path) as f:
+                return parse_input_config(json.load(f), geo_locator)
+
+        return self._get("input_config", config_path, load, geo_locator.build_id())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+registry = DatasetRegistry()  # Shared by everything that runs in this process
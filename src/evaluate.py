@@ -1,11 +1,19 @@
+import argparse
 import json
 
-from models import parse_input_config, parse_tor_nodes
-from taps import select_path, _get_country_trust_map
+from models import parse_input_config
+from snapshot import load_relay_table_cached
+from taps import _get_country_trust_map, PathSelector
+from metrics import (
+    AdversaryAvoidance,
+    CorrelationVulnerability,
+    PathBandwidth,
+    LoadDistribution,
+    run_metrics,
+)
+from analytic import evaluate_exact
 from GeoLocator import IPGeolocation
 from models import Params
-from collections import Counter
-
 
 GEOLITE_DB_PATH = "../GeoLite2-Country_20250610/GeoLite2-Country.mmdb"
 NODES_DATA_PATH = "../inputs/tor_consensus.json"
@@ -27,137 +35,126 @@ EXIT_PARAMS = {
 }
 
 
-def evaluate_adversary_avoidance(
-    all_nodes, input_config, guard_params, exit_params, n_runs
-):
-    ADVERSARY_THRESHOLD = 0.5
+ADVERSARY_THRESHOLD = 0.5
 
+
+def get_adversaries(input_config, threshold=ADVERSARY_THRESHOLD):
     trust_map = _get_country_trust_map(input_config)
-    adversaries = {c for c, t in trust_map.items() if t < ADVERSARY_THRESHOLD}
+    return {c for c, t in trust_map.items() if t < threshold}
 
-    guard_compromised_count = 0
-    middle_compromised_count = 0
-    exit_compromised_count = 0
 
-    for _ in range(n_runs):
-        path = select_path(all_nodes, input_config, guard_params, exit_params)
-        if not path:
-            continue
+def evaluate_metrics(
+    all_nodes, input_config, guard_params, exit_params, metrics, seed=None, workers=None
+):
+    """Evaluates every metric in a single pass over one stream of paths, then prints them."""
+    selector = PathSelector(all_nodes, input_config, guard_params, exit_params)
+    for metric in run_metrics(selector, metrics, seed, workers):
+        metric.print_report()
 
-        if path.guard_node.country in adversaries:
-            guard_compromised_count += 1
-        if path.middle_node.country in adversaries:
-            middle_compromised_count += 1
-        if path.exit_node.country in adversaries:
-            exit_compromised_count += 1
 
-    print(
-        f"################# Adversary Avoidance (Threshold: < {ADVERSARY_THRESHOLD}) - (Runs: {n_runs}) #################"
+def evaluate_adversary_avoidance(
+    all_nodes, input_config, guard_params, exit_params, n_runs, seed=None, workers=None
+):
+    adversaries = get_adversaries(input_config)
+    metric = AdversaryAvoidance(adversaries, n_runs, ADVERSARY_THRESHOLD)
+    evaluate_metrics(
+        all_nodes, input_config, guard_params, exit_params, [metric], seed, workers
     )
-    print(f"Guard in adversary country: {guard_compromised_count / n_runs:.2%}")
-    print(f"Middle in adversary country: {middle_compromised_count / n_runs:.2%}")
-    print(f"Exit in adversary country: {exit_compromised_count / n_runs:.2%}")
-    print("##########################################################################")
 
 
 def evaluate_correlation_vulnerability(
-    all_nodes, input_config, guard_params, exit_params, n_runs
+    all_nodes, input_config, guard_params, exit_params, n_runs, seed=None, workers=None
 ):
-    vulnerable_path_count = 0
-
-    for _ in range(n_runs):
-        path = select_path(all_nodes, input_config, guard_params, exit_params)
-        if not path:
-            continue
-
-        entry_countries = {input_config.client_country, path.guard_node.country}
-        exit_countries = {path.exit_node.country, input_config.destination_country}
+    metric = CorrelationVulnerability(input_config, n_runs)
+    evaluate_metrics(
+        all_nodes, input_config, guard_params, exit_params, [metric], seed, workers
+    )
 
-        if entry_countries.intersection(exit_countries):
-            vulnerable_path_count += 1
 
-    print(
-        f"################# Path Correlation Vulnerability (Runs: {n_runs}) #################"
+def evaluate_path_bandwidth(
+    all_nodes, input_config, guard_params, exit_params, n_runs, seed=None, workers=None
+):
+    metric = PathBandwidth(n_runs)
+    evaluate_metrics(
+        all_nodes, input_config, guard_params, exit_params, [metric], seed, workers
     )
-    print(f"Paths vulnerable to correlation: {vulnerable_path_count / n_runs:.2%}")
-    print("##########################################################################")
-
 
-def evaluate_path_bandwidth(all_nodes, input_config, guard_params, exit_params, n_runs):
-    path_bandwidths = []
 
-    for _ in range(n_runs):
-        path = select_path(all_nodes, input_config, guard_params, exit_params)
-        if not path:
-            continue
+def evaluate_load_distribution(
+    all_nodes, input_config, guard_params, exit_params, n_runs, seed=None, workers=None
+):
+    metric = LoadDistribution(n_runs)
+    evaluate_metrics(
+        all_nodes, input_config, guard_params, exit_params, [metric], seed, workers
+    )
 
-        effective_bw = min(
-            path.guard_node.bandwidth.measured,
-            path.middle_node.bandwidth.measured,
-            path.exit_node.bandwidth.measured,
-        )
-        path_bandwidths.append(effective_bw)
 
-    avg_bw = sum(path_bandwidths) / len(path_bandwidths)
+def evaluate_exact_probabilities(
+    all_nodes, input_config, guard_params, exit_params, threshold=ADVERSARY_THRESHOLD
+):
+    """Prints the exact probabilities that the Monte Carlo evaluations above estimate."""
+    selector = PathSelector(all_nodes, input_config, guard_params, exit_params)
+    exact = evaluate_exact(
+        selector, get_adversaries(input_config, threshold), with_middle=True
+    )
 
     print(
-        f" ################# Path Performance (bandwidth) (Runs: {n_runs}) #################"
+        f"################# Exact Evaluation (Threshold: < {threshold}) #################"
     )
-    print(f"Average path bandwidth: {avg_bw / 1e6:.2f} MB/s")
-    print("##########################################################################")
-
-
-def evaluate_load_distribution(
-    all_nodes, input_config, guard_params, exit_params, n_runs
-):
-    guard_counts = Counter()
-    middle_counts = Counter()
-    exit_counts = Counter()
-
-    for _ in range(n_runs):
-        path = select_path(all_nodes, input_config, guard_params, exit_params)
-        if not path:
-            continue
-
-        guard_counts[path.guard_node.fingerprint] += 1
-        middle_counts[path.middle_node.fingerprint] += 1
-        exit_counts[path.exit_node.fingerprint] += 1
-
-    print(f"################# Load Distribution (Runs: {n_runs}) #################")
-    print(f"Guard nodes chosen: {len(guard_counts)} unique relays")
-    print(f"Most common guard: {guard_counts.most_common(1)}")
-    print(f"Exit nodes chosen: {len(exit_counts)} unique relays")
-    print(f"Most common exit: {exit_counts.most_common(1)}")
+    print(f"Guard in adversary country: {exact.guard_in_adversary:.2%}")
+    print(f"Middle in adversary country: {exact.middle_in_adversary:.2%}")
+    print(f"Exit in adversary country: {exact.exit_in_adversary:.2%}")
+    print(f"Paths vulnerable to correlation: {exact.correlation:.2%}")
     print("##########################################################################")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed of the simulations (random if unset)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Worker processes (all CPUs if unset)"
+    )
+    parser.add_argument(
+        "--exact",
+        action="store_true",
+        help="Also print the exact probabilities, to cross-check the simulations",
+    )
+    args = parser.parse_args()
+
     with open(CONFIG_PATH) as f:
         input_config_data = json.load(f)
-    with open(NODES_DATA_PATH) as f:
-        all_nodes_data = json.load(f)
 
     geo_locator = IPGeolocation(GEOLITE_DB_PATH)
     input_config = parse_input_config(input_config_data, geo_locator)
-    all_nodes = parse_tor_nodes(all_nodes_data, geo_locator)
+    all_nodes = load_relay_table_cached(NODES_DATA_PATH, geo_locator)
 
     guard_params = Params(**GUARD_PARAMS)
     exit_params = Params(**EXIT_PARAMS)
 
-    evaluate_adversary_avoidance(
-        all_nodes, input_config, guard_params, exit_params, n_runs=1000
-    )
-
-    evaluate_correlation_vulnerability(
-        all_nodes, input_config, guard_params, exit_params, n_runs=1000
-    )
-
-    evaluate_path_bandwidth(
-        all_nodes, input_config, guard_params, exit_params, n_runs=1000
+    # One stream of 10000 paths feeds every metric, each reads the runs it needs
+    evaluate_metrics(
+        all_nodes,
+        input_config,
+        guard_params,
+        exit_params,
+        [
+            AdversaryAvoidance(
+                get_adversaries(input_config), 1000, ADVERSARY_THRESHOLD
+            ),
+            CorrelationVulnerability(input_config, 1000),
+            PathBandwidth(1000),
+            LoadDistribution(10000),
+        ],
+        seed=args.seed,
+        workers=args.workers,
     )
 
-    evaluate_load_distribution(
-        all_nodes, input_config, guard_params, exit_params, n_runs=10000
-    )
+    if args.exact:
+        evaluate_exact_probabilities(all_nodes, input_config, guard_params, exit_params)
 
     print("--------------------------------------------------------------------------")
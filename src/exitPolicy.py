@@ -0,0 +1,238 @@
+import copy
+import ipaddress
+from bisect import bisect_right
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from lruCache import LRUCache
+from models import ExitRule, EXIT_POLICY_CACHE_SIZE
+
+MAX_PORT = 65535
+MAX_IPV4 = 2**32 - 1
+MAX_IPV6 = 2**128 - 1
+DESTINATION_CACHE_SIZE = 1024  # (IP segment, port) answers kept per index (LRU)
+
+
+@dataclass(slots=True, frozen=True)
+class CompiledRule:
+    """
+    An exit rule as integer ranges.
+
+    Attributes:
+        accept (bool): True for 'accept' rules, False for 'reject' rules.
+        version (int): IP version of the addresses the rule applies to, 0 for any address
+            ('*', which also matches destinations that are not IP addresses).
+        ip_low (int): First address the rule applies to.
+        ip_high (int): Last address the rule applies to.
+        port_low (int): First port the rule applies to.
+        port_high (int): Last port the rule applies to.
+    """
+
+    accept: bool
+    version: int
+    ip_low: int
+    ip_high: int
+    port_low: int
+    port_high: int
+
+
+def _parse_ports(port: str) -> Tuple[int, int]:
+    if port == "*":
+        return 1, MAX_PORT
+    low, _, high = port.partition("-")
+    return int(low), int(high or low)
+
+
+def compile_exit_rule(rule: ExitRule) -> CompiledRule | None:
+    """
+    Compiles an exit rule. Addresses can be '*', '*4', '*6', an IP address or a CIDR range
+    (IPv6 ones possibly in brackets), ports can be '*', a port or a 'low-high' range.
+    'accept6' and 'reject6' rules only apply to IPv6 addresses.
+    Returns None for malformed rules.
+    """
+    try:
+        if rule.address == "*":
+            version, ip_low, ip_high = 0, 0, MAX_IPV6
+        elif rule.address == "*4":
+            version, ip_low, ip_high = 4, 0, MAX_IPV4
+        elif rule.address == "*6":
+            version, ip_low, ip_high = 6, 0, MAX_IPV6
+        else:
+            network = ipaddress.ip_network(
+                rule.address.replace("[", "").replace("]", ""), strict=False
+            )
+            version = network.version
+            ip_low = int(network.network_address)
+            ip_high = int(network.broadcast_address)
+        port_low, port_high = _parse_ports(rule.port)
+    except ValueError:
+        return None
+
+    if rule.action.endswith("6"):
+        if version == 4:
+            return None
+        version = 6
+    return CompiledRule(
+        accept=rule.action in ("accept", "accept6"),
+        version=version,
+        ip_low=ip_low,
+        ip_high=ip_high,
+        port_low=port_low,
+        port_high=port_high,
+    )
+
+
+@lru_cache(maxsize=EXIT_POLICY_CACHE_SIZE)
+def compile_exit_policy(rules: Tuple[ExitRule, ...]) -> Tuple[CompiledRule, ...]:
+    """Compiles every rule of a policy, dropping the malformed ones."""
+    compiled = (compile_exit_rule(rule) for rule in rules)
+    return tuple(rule for rule in compiled if rule is not None)
+
+
+def policy_accepts(
+    policy: Sequence[CompiledRule], ip: int, port: int | None = None, version: int = 4
+) -> bool:
+    """
+    Evaluates a compiled policy with Tor's first-match semantics: the first rule that matches
+    the destination decides, and a destination that no rule matches is rejected.
+    `version` is the IP version of `ip` (see parse_destination).
+    Without a port, returns whether the policy accepts the IP on at least one port.
+    """
+    if port is not None:
+        for rule in policy:
+            if (
+                (rule.version == 0 or rule.version == version)
+                and rule.ip_low <= ip <= rule.ip_high
+                and rule.port_low <= port <= rule.port_high
+            ):
+                return rule.accept
+        return False
+
+    # Ports that no earlier rule has decided yet, as (low, high) ranges
+    undecided = [(1, MAX_PORT)]
+    for rule in policy:
+        if rule.version != 0 and rule.version != version:
+            continue
+        if not rule.ip_low <= ip <= rule.ip_high:
+            continue
+        overlaps = any(
+            low <= rule.port_high and rule.port_low <= high for low, high in undecided
+        )
+        if not overlaps:
+            continue
+        if rule.accept:
+            return True
+
+        remaining = []
+        for low, high in undecided:
+            if low < rule.port_low:
+                remaining.append((low, min(high, rule.port_low - 1)))
+            if high > rule.port_high:
+                remaining.append((max(low, rule.port_high + 1), high))
+        undecided = remaining
+        if not undecided:
+            return False
+    return False
+
+
+def parse_destination(ip: str) -> Tuple[int, int]:
+    """
+    Returns the (IP version, address as an int) of a destination, (0, 0) when it isn't an IP
+    address: only '*' rules apply to such destinations.
+    """
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return 0, 0
+    return address.version, int(address)
+
+
+class ExitPolicyIndex:
+    """
+    Answers "which relays can exit to (ip, port)" for a set of relays.
+
+    Policies are compiled once per distinct policy. The IPv4 space is cut at every range
+    boundary of every rule, so inside one segment each rule matches either every address or
+    none: an IPv4 destination is mapped to its segment with a binary search, and the accepting
+    policies of each (segment, port) are computed once and cached. Other destinations (IPv6,
+    or not IP addresses) are rare, their answers are cached per address. Relays are grouped by
+    policy, so collecting the relays of the accepting policies doesn't scan the relays.
+    """
+
+    def __init__(
+        self,
+        policies: Sequence[Sequence[ExitRule]],
+        policy_codes: np.ndarray,
+        cache_size: int = DESTINATION_CACHE_SIZE,
+    ):
+        self.compiled = [compile_exit_policy(tuple(rules)) for rules in policies]
+
+        boundaries = {0}
+        for policy in self.compiled:
+            for rule in policy:
+                if rule.version != 4:
+                    continue  # '*' rules span the whole IPv4 space
+                boundaries.add(rule.ip_low)
+                if rule.ip_high < MAX_IPV4:
+                    boundaries.add(rule.ip_high + 1)
+        self.boundaries: List[int] = sorted(boundaries)
+        self._group_relays(policy_codes)
+
+        self._accepting: LRUCache[np.ndarray] = LRUCache(cache_size)
+
+    def _group_relays(self, policy_codes: np.ndarray):
+        # Relays grouped by policy: relays of policy p are order[offsets[p]:offsets[p + 1]]
+        self.policy_codes = policy_codes
+        self.order = np.argsort(policy_codes, kind="stable")
+        counts = np.bincount(policy_codes, minlength=len(self.compiled))
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    def regroup(self, policy_codes: np.ndarray) -> "ExitPolicyIndex":
+        """
+        Returns an index over the same policies for another set of relays.
+        The compiled policies, IP segments and cached answers only depend on the policies,
+        so they are shared; only the grouping of the relays is redone.
+        """
+        index = copy.copy(self)
+        index._group_relays(policy_codes)
+        return index
+
+    def segment(self, ip: int) -> int:
+        """Returns the index of the IP segment that contains `ip`."""
+        return bisect_right(self.boundaries, ip) - 1
+
+    def _accepting_policies(
+        self, version: int, point: int, port: int | None
+    ) -> np.ndarray:
+        # IPv4 destinations are cached by segment: every address of one behaves the same
+        ip = self.boundaries[point] if version == 4 else point
+        return np.array(
+            [policy_accepts(policy, ip, port, version) for policy in self.compiled],
+            dtype=bool,
+        )
+
+    def accepting_policies(
+        self, destination_ip: str, port: int | None = None
+    ) -> np.ndarray:
+        """Returns one boolean per policy: whether it allows exiting to the destination."""
+        version, ip = parse_destination(destination_ip)
+        key = (version, self.segment(ip) if version == 4 else ip, port)
+        accepting = self._accepting.get(key)
+        if accepting is None:
+            accepting = self._accepting.put(key, self._accepting_policies(*key))
+        return accepting
+
+    def relays(self, destination_ip: str, port: int | None = None) -> np.ndarray:
+        """Returns the sorted indices of the relays that can exit to the destination."""
+        accepting = np.flatnonzero(self.accepting_policies(destination_ip, port))
+        groups = [self.order[self.offsets[p] : self.offsets[p + 1]] for p in accepting]
+        if not groups:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(groups))
+
+    def mask(self, destination_ip: str, port: int | None = None) -> np.ndarray:
+        """Returns one boolean per relay: whether it can exit to the destination."""
+        return self.accepting_policies(destination_ip, port)[self.policy_codes]
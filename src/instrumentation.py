@@ -0,0 +1,133 @@
+import math
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+# Instrumentation is off unless a Profile is enabled: every hook then costs one call, one
+# global lookup and one comparison. This module only imports the standard library, so that
+# importing taps stays cheap.
+
+
+class Histogram:
+    """
+    Distribution of recorded values, counted in power-of-two buckets, with their exact
+    count, sum, min and max. Quantiles are upper bounds of their bucket (within 2x).
+    """
+
+    __slots__ = ("buckets", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}  # Values in [2 ** (b - 1), 2 ** b), by b
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def record(self, value: float):
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        bucket = math.frexp(value)[1] if value > 0 else 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Returns an upper bound of the `q` quantile of the recorded values."""
+        if not self.count:
+            return 0.0
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= q * self.count:
+                return min(math.ldexp(1.0, bucket), self.max)
+        return self.max
+
+
+class Profile:
+    """
+    Histograms recorded while the profile is enabled.
+
+    Attributes:
+        timings (Dict[str, Histogram]): Wall time of each stage of path selection, in
+            microseconds.
+        sizes (Dict[str, Histogram]): Size of each pool of path selection (secure guards,
+            filtered exits, secure exits, middle candidates) and other counts.
+    """
+
+    def __init__(self):
+        self.timings: Dict[str, Histogram] = defaultdict(Histogram)
+        self.sizes: Dict[str, Histogram] = defaultdict(Histogram)
+
+    def report(self) -> str:
+        lines = [
+            f"{'stage':>24} | {'calls':>7} | {'mean us':>10} | {'p50 us':>10} | "
+            f"{'p99 us':>10} | {'max us':>10}"
+        ]
+        for name, h in self.timings.items():
+            lines.append(
+                f"{name:>24} | {h.count:>7} | {h.mean:>10.1f} | {h.quantile(0.5):>10.1f} | "
+                f"{h.quantile(0.99):>10.1f} | {h.max:>10.1f}"
+            )
+        lines.append(
+            f"{'pool':>24} | {'samples':>7} | {'mean':>10} | {'min':>10} | "
+            f"{'p50':>10} | {'max':>10}"
+        )
+        for name, h in self.sizes.items():
+            lines.append(
+                f"{name:>24} | {h.count:>7} | {h.mean:>10.1f} | {h.min:>10.0f} | "
+                f"{h.quantile(0.5):>10.0f} | {h.max:>10.0f}"
+            )
+        return "\n".join(lines)
+
+
+# The enabled profile, None when instrumentation is off. Per-draw code (PathSelector.select)
+# reads it once and only calls the hooks below when it is set.
+active_profile: Profile | None = None
+
+
+def enable() -> Profile:
+    """Starts recording into a new profile, and returns it."""
+    global active_profile
+    active_profile = Profile()
+    return active_profile
+
+
+def disable() -> Profile | None:
+    """Stops recording, and returns the profile that was enabled."""
+    global active_profile
+    profile, active_profile = active_profile, None
+    return profile
+
+
+@contextmanager
+def profiling() -> Iterator[Profile]:
+    """Records the path selections of the `with` block into the profile it yields."""
+    profile = enable()
+    try:
+        yield profile
+    finally:
+        disable()
+
+
+# region Hooks
+def stage_start() -> float:
+    """Returns the start time of a stage to pass to stage_end, 0 when instrumentation is off."""
+    return time.perf_counter() if active_profile is not None else 0.0
+
+
+def stage_end(name: str, start: float):
+    if active_profile is not None and start:
+        active_profile.timings[name].record((time.perf_counter() - start) * 1e6)
+
+
+def record_size(name: str, size: int):
+    if active_profile is not None:
+        active_profile.sizes[name].record(size)
+
+
+# endregion
@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+from typing import Generic, Hashable, Iterator, TypeVar
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """
+    Keeps the values of the `maxsize` most recently used keys.
+
+    Unlike functools.lru_cache on a bound method, the cache holds no reference back to the
+    object that owns it, so that object is freed as soon as it is unreachable instead of
+    waiting for the cyclic garbage collector.
+    Every operation holds a lock, so a cache can be shared with the thread reloading the
+    consensus.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[Hashable, V] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, default=None) -> V | None:
+        """Returns the value of `key` and marks it as the most recently used, or `default`."""
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                return default
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: V) -> V:
+        """Stores `value` for `key`, evicting the least recently used key if full, and returns it."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def values(self) -> Iterator[V]:
+        with self._lock:
+            return iter(list(self._entries.values()))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,67 @@
+import argparse
+import gc
+import tracemalloc
+
+from models import parse_tor_nodes
+from relayTable import RelayTable
+from syntheticConsensus import SyntheticGeoLocator, generate_relays
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+
+def measure_footprint(n_relays: int, seed: int = 0) -> dict:
+    """
+    Returns the memory held by `parse_tor_nodes` (and the RelayTable built from it) for
+    `n_relays` synthetic relays, together with the peak memory while parsing.
+    Records are generated lazily, so they are not counted in the footprint.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        nodes = parse_tor_nodes(generate_relays(n_relays, seed), SyntheticGeoLocator())
+        nodes_bytes, nodes_peak = tracemalloc.get_traced_memory()
+
+        tracemalloc.reset_peak()
+        relays = RelayTable.from_nodes(nodes)
+        total_bytes, table_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "relays": n_relays,
+        "nodes_bytes": nodes_bytes,
+        "nodes_peak_bytes": nodes_peak,
+        "table_bytes": total_bytes - nodes_bytes,
+        "table_peak_bytes": table_peak,
+        "bytes_per_node": nodes_bytes / n_relays,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Memory report of parse_tor_nodes for synthetic consensuses"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="Number of synthetic relays of each run",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"{'relays':>10} | {'nodes MB':>9} | {'peak MB':>8} | {'table MB':>9} | {'B/node':>7}"
+    )
+    for n_relays in args.sizes:
+        report = measure_footprint(n_relays, args.seed)
+        print(
+            f"{report['relays']:>10} | {report['nodes_bytes'] / 1e6:>9.1f} | "
+            f"{report['nodes_peak_bytes'] / 1e6:>8.1f} | {report['table_bytes'] / 1e6:>9.1f} | "
+            f"{report['bytes_per_node']:>7.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Iterable, List, Set
+
+import numpy as np
+
+from batch import PathBatch
+from models import InputConfig
+from monteCarlo import iter_simulate, RUNS_PER_CHUNK
+from taps import PathSelector
+
+
+class Metric(ABC):
+    """
+    Accumulates one evaluation metric over a stream of paths.
+
+    Metrics are fed PathBatch chunks through `update`, in stream order, and print their
+    results with `print_report`.
+    A metric only looks at the first `n_runs` paths of the stream, so metrics with different
+    run counts can share one stream (see run_metrics).
+    """
+
+    title = ""
+
+    def __init__(self, n_runs: int):
+        self.n_runs = n_runs
+
+    @abstractmethod
+    def update(self, paths: PathBatch):
+        pass
+
+    @abstractmethod
+    def print_report(self):
+        pass
+
+
+class AdversaryAvoidance(Metric):
+    """Counts the paths whose guard, middle or exit is in an adversary country."""
+
+    def __init__(self, adversaries: Set[str], n_runs: int, threshold: float):
+        super().__init__(n_runs)
+        self.adversaries = adversaries
+        self.threshold = threshold
+        self.guard_hits = self.middle_hits = self.exit_hits = 0
+
+    def update(self, paths: PathBatch):
+        relays = paths.relays
+        is_adversary = np.array(
+            [country in self.adversaries for country in relays.countries], dtype=bool
+        )
+        valid = paths.valid
+        self.guard_hits += int(
+            is_adversary[relays.country_codes[paths.guards[valid]]].sum()
+        )
+        self.middle_hits += int(
+            is_adversary[relays.country_codes[paths.middles[valid]]].sum()
+        )
+        self.exit_hits += int(
+            is_adversary[relays.country_codes[paths.exits[valid]]].sum()
+        )
+
+    def print_report(self):
+        print(
+            f"################# Adversary Avoidance (Threshold: < {self.threshold}) - (Runs: {self.n_runs}) #################"
+        )
+        print(f"Guard in adversary country: {self.guard_hits / self.n_runs:.2%}")
+        print(f"Middle in adversary country: {self.middle_hits / self.n_runs:.2%}")
+        print(f"Exit in adversary country: {self.exit_hits / self.n_runs:.2%}")
+        print(
+            "##########################################################################"
+        )
+
+
+class CorrelationVulnerability(Metric):
+    """Counts the paths where a country sees both ends: {client, guard} & {exit, destination}."""
+
+    def __init__(self, config: InputConfig, n_runs: int):
+        super().__init__(n_runs)
+        self.config = config
+        self.vulnerable = 0
+
+    def update(self, paths: PathBatch):
+        relays = paths.relays
+        valid = paths.valid
+        guard_countries = relays.country_codes[paths.guards[valid]]
+        exit_countries = relays.country_codes[paths.exits[valid]]
+        client = relays.country_ids.get(self.config.client_country, -1)
+        destination = relays.country_ids.get(self.config.destination_country, -1)
+
+        vulnerable = (
+            (exit_countries == client)
+            | (guard_countries == exit_countries)
+            | (guard_countries == destination)
+        )
+        if self.config.client_country == self.config.destination_country:
+            vulnerable[:] = True
+        self.vulnerable += int(vulnerable.sum())
+
+    def print_report(self):
+        print(
+            f"################# Path Correlation Vulnerability (Runs: {self.n_runs}) #################"
+        )
+        print(f"Paths vulnerable to correlation: {self.vulnerable / self.n_runs:.2%}")
+        print(
+            "##########################################################################"
+        )
+
+
+class PathBandwidth(Metric):
+    """Averages the effective bandwidth of the paths, the lowest of their three relays."""
+
+    def __init__(self, n_runs: int):
+        super().__init__(n_runs)
+        self.total_bandwidth = 0
+        self.n_paths = 0
+
+    def update(self, paths: PathBatch):
+        bandwidth = paths.relays.bandwidth
+        valid = paths.valid
+        effective = np.minimum(
+            np.minimum(bandwidth[paths.guards[valid]], bandwidth[paths.middles[valid]]),
+            bandwidth[paths.exits[valid]],
+        )
+        self.total_bandwidth += int(effective.sum())
+        self.n_paths += len(effective)
+
+    def print_report(self):
+        avg_bw = self.total_bandwidth / self.n_paths
+        print(
+            f" ################# Path Performance (bandwidth) (Runs: {self.n_runs}) #################"
+        )
+        print(f"Average path bandwidth: {avg_bw / 1e6:.2f} MB/s")
+        print(
+            "##########################################################################"
+        )
+
+
+class LoadDistribution(Metric):
+    """Counts how many times each relay is chosen as guard, middle and exit."""
+
+    def __init__(self, n_runs: int):
+        super().__init__(n_runs)
+        self.guard_counts = Counter()
+        self.middle_counts = Counter()
+        self.exit_counts = Counter()
+        self.relays = None
+
+    def update(self, paths: PathBatch):
+        # Counted by relay index, in path order, so ties keep the order of first appearance
+        self.relays = paths.relays
+        valid = paths.valid
+        self.guard_counts.update(paths.guards[valid].tolist())
+        self.middle_counts.update(paths.middles[valid].tolist())
+        self.exit_counts.update(paths.exits[valid].tolist())
+
+    def _most_common(self, counts: Counter) -> List[tuple]:
+        return [
+            (self.relays.fingerprints[i].decode(), count)
+            for i, count in counts.most_common(1)
+        ]
+
+    def print_report(self):
+        print(
+            f"################# Load Distribution (Runs: {self.n_runs}) #################"
+        )
+        print(f"Guard nodes chosen: {len(self.guard_counts)} unique relays")
+        print(f"Most common guard: {self._most_common(self.guard_counts)}")
+        print(f"Exit nodes chosen: {len(self.exit_counts)} unique relays")
+        print(f"Most common exit: {self._most_common(self.exit_counts)}")
+        print(
+            "##########################################################################"
+        )
+
+
+def run_metrics(
+    selector: PathSelector,
+    metrics: Iterable[Metric],
+    seed: int | None = None,
+    workers: int | None = None,
+    chunk_size: int = RUNS_PER_CHUNK,
+) -> List[Metric]:
+    """
+    Draws one stream of paths, as long as the largest run count of `metrics`, and feeds
+    each metric its first `n_runs` paths. Returns the metrics.
+    Chunks are fed as they are drawn, so memory is bounded by the chunk size, not by the
+    run counts.
+    """
+    metrics = list(metrics)
+    n_runs = max((metric.n_runs for metric in metrics), default=0)
+    start = 0
+    for paths in iter_simulate(selector, n_runs, seed, workers, chunk_size):
+        for metric in metrics:
+            if metric.n_runs > start:
+                metric.update(paths[: metric.n_runs - start])
+        start += len(paths)
+    return metrics
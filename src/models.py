@@ -1,5 +1,9 @@
+import sys
 from dataclasses import dataclass
-from typing import List
+from functools import lru_cache
+from typing import List, Tuple
+
+EXIT_POLICY_CACHE_SIZE = 65536  # Distinct exit policy strings kept parsed and shared
 
 
 @dataclass
@@ -46,6 +50,7 @@ class InputConfig:
         destination (str): The destination IP address.
         client_country (str): The country code of the client IP.
         destination_country (str): The country code of the destination IP.
+        destination_port (int | None): The destination port, None if any port will do.
     """
 
     alliances: List[Alliance]
@@ -53,9 +58,23 @@ class InputConfig:
     destination: str
     client_country: str = ""
     destination_country: str = ""
+    destination_port: int | None = None
+
+    def selection_key(self) -> tuple:
+        """
+        Returns everything path selection depends on besides the relays and parameters:
+        configs with the same key get the same trust map, guard pool and exit pools.
+        """
+        return (
+            self.client_country,
+            self.destination_country,
+            self.destination,
+            self.destination_port,
+            tuple((tuple(a.countries), a.trust) for a in self.alliances),
+        )
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Bandwidth:
     """
     Represents bandwidth information for a Tor node.
@@ -71,7 +90,7 @@ class Bandwidth:
     burst: int
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ExitRule:
     """
     Represents an exit policy rule for a Tor node.
@@ -87,16 +106,21 @@ class ExitRule:
     port: str
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class TorNode:
+    """
+    Represents a relay of the consensus.
+    Nodes are immutable; relays with the same exit policy string share the same `exit` tuple.
+    """
+
     fingerprint: str
     nickname: str
     ip: str
     port: int
     bandwidth: Bandwidth
-    family: List[str]
+    family: Tuple[str, ...]
     asn: str
-    exit: List[ExitRule]
+    exit: Tuple[ExitRule, ...]
     country: str = ""
 
 
@@ -127,26 +151,55 @@ def parse_input_config(config_data, geo_locator):
         destination=dest_ip,
         client_country=client_country,
         destination_country=dest_country,
+        destination_port=config_data.get("DestinationPort"),
     )
 
 
-def parse_tor_nodes(nodes_data, geo_locator) -> List[TorNode]:
+def parse_tor_nodes(
+    nodes_data, geo_locator, workers: int | None = None
+) -> List[TorNode]:
+    """
+    Builds the TorNode of every relay record.
+    With `workers`, the countries of the relays are resolved across that many processes
+    (see IPGeolocation.get_countries_parallel) and used as returned, so the parent does no
+    lookups even when the consensus has more IPs than the cache of the geolocator holds.
+    """
+    if workers:
+        nodes_data = list(nodes_data)
+        countries = geo_locator.get_countries_parallel(
+            (node["ip"] for node in nodes_data), workers
+        )
+        located = zip(nodes_data, countries)
+    else:
+        located = ((node, geo_locator.get_country(node["ip"])) for node in nodes_data)
+
     return [
         TorNode(
             fingerprint=node["fingerprint"],
             nickname=node["nickname"],
             ip=node["ip"],
-            country=geo_locator.get_country(node["ip"]),
+            country=intern_country(country),
             port=node["port"],
             bandwidth=Bandwidth(**node["bandwidth"]),
-            family=node["family"],
-            asn=node["asn"],
-            exit=parse_exit_rules(node["exit"]),
+            family=tuple(node["family"]),
+            asn=sys.intern(node["asn"]),
+            exit=_shared_exit_rules(node["exit"]),
         )
-        for node in nodes_data
+        for node, country in located
     ]
 
 
+def intern_country(country: str | None) -> str | None:
+    """Interns a country code. GeoIP has networks without a country, left as None."""
+    return sys.intern(country) if isinstance(country, str) else country
+
+
+@lru_cache(maxsize=EXIT_POLICY_CACHE_SIZE)
+def _shared_exit_rules(exit_str: str) -> Tuple[ExitRule, ...]:
+    """Parses an exit policy once and shares the result between every relay that has it."""
+    return tuple(parse_exit_rules(exit_str))
+
+
 def parse_exit_rules(exit_str: str) -> List[ExitRule]:
     rules = []
     for rule in exit_str.split(","):
@@ -157,6 +210,6 @@ def parse_exit_rules(exit_str: str) -> List[ExitRule]:
         if len(parts) != 2:
             continue
         action, rest = parts
-        address, port = rest.split(":")
+        address, _, port = rest.rpartition(":")  # IPv6 addresses contain ':' too
         rules.append(ExitRule(action=action, address=address, port=port))
     return rules
@@ -0,0 +1,114 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from models import TorNode, InputConfig, Params
+from relayTable import RelayTable
+from batch import PathBatch, draw_paths
+from taps import PathSelector
+
+RUNS_PER_CHUNK = 4096  # Paths drawn per task, each task has its own RNG stream
+CHUNKS_IN_FLIGHT_PER_WORKER = 2  # Chunks drawn ahead of the consumer by iter_simulate
+
+# Selector of the running simulation, inherited by the forked workers (copy-on-write)
+_selector: PathSelector | None = None
+
+
+# region Aux functions
+def _draw_chunk(
+    task: Tuple[np.random.SeedSequence, int],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    seed_sequence, size = task
+    paths = draw_paths(_selector, size, np.random.default_rng(seed_sequence))
+    return paths.guards, paths.middles, paths.exits
+
+
+def _can_fork() -> bool:
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+# endregion
+
+
+def iter_simulate(
+    selector: PathSelector,
+    n_runs: int,
+    seed: int | None = None,
+    workers: int | None = None,
+    chunk_size: int = RUNS_PER_CHUNK,
+) -> Iterator[PathBatch]:
+    """
+    Draws `n_runs` paths from a PathSelector across a pool of `workers` processes
+    (all the CPUs by default), and yields them in order, one chunk at a time.
+
+    The runs are cut into chunks of `chunk_size` paths, and chunk k always draws from the
+    k-th child of SeedSequence(seed): the paths only depend on the seed and the chunk size,
+    never on the number of workers or on which worker ran which chunk. At most
+    CHUNKS_IN_FLIGHT_PER_WORKER chunks per worker are drawn ahead of the consumer.
+    Workers are forked after the selector is built, so they share the relay table and the
+    secure pools instead of rebuilding them; where fork is not available the chunks run in
+    this process.
+    """
+    global _selector
+
+    sizes = [min(chunk_size, n_runs - start) for start in range(0, n_runs, chunk_size)]
+    tasks = list(zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes))
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+
+    _selector = selector
+    try:
+        if workers > 1 and _can_fork():
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("fork")
+            ) as executor:
+                in_flight = deque()
+                for task in tasks:
+                    in_flight.append(executor.submit(_draw_chunk, task))
+                    if len(in_flight) >= workers * CHUNKS_IN_FLIGHT_PER_WORKER:
+                        yield PathBatch(selector.relays, *in_flight.popleft().result())
+                while in_flight:
+                    yield PathBatch(selector.relays, *in_flight.popleft().result())
+        else:
+            for task in tasks:
+                yield PathBatch(selector.relays, *_draw_chunk(task))
+    finally:
+        _selector = None
+
+
+def simulate(
+    selector: PathSelector,
+    n_runs: int,
+    seed: int | None = None,
+    workers: int | None = None,
+    chunk_size: int = RUNS_PER_CHUNK,
+) -> PathBatch:
+    """The `n_runs` paths of iter_simulate, merged back into one PathBatch."""
+    chunks = list(iter_simulate(selector, n_runs, seed, workers, chunk_size))
+    if not chunks:
+        empty = np.empty(0, dtype=np.int64)
+        return PathBatch(selector.relays, empty, empty, empty)
+    return PathBatch(
+        selector.relays,
+        np.concatenate([chunk.guards for chunk in chunks]),
+        np.concatenate([chunk.middles for chunk in chunks]),
+        np.concatenate([chunk.exits for chunk in chunks]),
+    )
+
+
+def simulate_paths(
+    nodes: List[TorNode] | RelayTable,
+    config: InputConfig,
+    alpha_guard: Params,
+    alpha_exit: Params,
+    n_runs: int,
+    seed: int | None = None,
+    workers: int | None = None,
+    filter_asn_country: bool = False,
+) -> PathBatch:
+    """Parallel, reproducible version of batch.select_paths (see simulate)."""
+    selector = PathSelector(nodes, config, alpha_guard, alpha_exit, filter_asn_country)
+    return simulate(selector, n_runs, seed, workers)
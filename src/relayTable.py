@@ -0,0 +1,337 @@
+import sys
+from array import array
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from models import TorNode, ExitRule, Bandwidth, _shared_exit_rules, intern_country
+from exitPolicy import ExitPolicyIndex
+from lruCache import LRUCache
+from sampler import WeightedSampler
+
+FINGERPRINT_BYTES = 40  # Fingerprints are 40 hex characters
+FINGERPRINT_DTYPE = f"S{FINGERPRINT_BYTES}"
+EXIT_BITMAP_CACHE_SIZE = 256  # Destinations whose exit bitmap is kept per table (LRU)
+
+
+# region Aux functions
+def _encode_fingerprint(fingerprint: str) -> bytes:
+    """Encodes a fingerprint for the fixed-width column, which would truncate a longer one."""
+    encoded = fingerprint.encode()
+    if len(encoded) > FINGERPRINT_BYTES:
+        raise ValueError(f"Invalid fingerprint: {fingerprint}")
+    return encoded
+
+
+# endregion
+
+
+class RelayTable:
+    """
+    The relays of a consensus stored as aligned columns (struct of arrays).
+
+    Hot columns, used by scoring and selection:
+        fingerprints (np.ndarray): Fingerprints as fixed-width bytes.
+        bandwidth (np.ndarray): Measured bandwidth (int64).
+        country_codes (np.ndarray): Interned country of each relay, an index into `countries`.
+        asn_codes (np.ndarray): Interned ASN of each relay, an index into `asns`.
+        policy_codes (np.ndarray): Interned exit policy of each relay, an index into `policies`.
+
+    Every other field is only needed to build the TorNode of a chosen relay, which is
+    done lazily by `node(i)`. A table built from parsed nodes keeps them and returns them
+    as they are; a table built by RelayTableBuilder keeps the remaining fields as cold columns
+    (`nicknames`, `ips`, `ports`, `average`, `burst` and `families`).
+    """
+
+    def __init__(
+        self,
+        fingerprints: np.ndarray,
+        bandwidth: np.ndarray,
+        country_codes: np.ndarray,
+        countries: List[str],
+        asn_codes: np.ndarray,
+        asns: List[str],
+        policy_codes: np.ndarray,
+        policies: List[Sequence[ExitRule]],
+        nodes: Sequence[TorNode] | None = None,
+        nicknames: Sequence[str] | None = None,
+        ips: Sequence[str] | None = None,
+        ports: np.ndarray | None = None,
+        average: np.ndarray | None = None,
+        burst: np.ndarray | None = None,
+        families: Sequence[tuple] | None = None,
+    ):
+        self.fingerprints = fingerprints
+        self.bandwidth = bandwidth
+        self.country_codes = country_codes
+        self.countries = countries
+        self.country_ids = {country: i for i, country in enumerate(countries)}
+        self.asn_codes = asn_codes
+        self.asns = asns
+        self.asn_ids = {asn: i for i, asn in enumerate(asns)}
+        self.policy_codes = policy_codes
+        self.policies = policies
+        self._nodes = nodes
+        self.nicknames = nicknames
+        self.ips = ips
+        self.ports = ports
+        self.average = average
+        self.burst = burst
+        self.families = families
+        self._views: Dict[int, TorNode] = {}
+        self._rows: Dict[bytes, int] | None = None
+        self._exit_index: ExitPolicyIndex | None = None
+        self._middle_sampler: WeightedSampler | None = None
+        self._exit_bitmaps: LRUCache[np.ndarray] = LRUCache(EXIT_BITMAP_CACHE_SIZE)
+
+    @classmethod
+    def from_nodes(cls, nodes: Sequence[TorNode]) -> "RelayTable":
+        """Builds the columns of an already parsed list of nodes, which is kept for `node(i)`."""
+        countries: Dict[str, int] = {}
+        asns: Dict[str, int] = {}
+        policies: Dict[tuple, int] = {}
+        shared_policies: Dict[int, int] = {}  # id of a shared exit tuple -> policy code
+        policy_rules: List[Sequence[ExitRule]] = []
+
+        n = len(nodes)
+        fingerprints = [_encode_fingerprint(node.fingerprint) for node in nodes]
+        country_codes = np.empty(n, dtype=np.int16)
+        asn_codes = np.empty(n, dtype=np.int32)
+        policy_codes = np.empty(n, dtype=np.int32)
+
+        for i, node in enumerate(nodes):
+            country_codes[i] = countries.setdefault(node.country, len(countries))
+            asn_codes[i] = asns.setdefault(node.asn, len(asns))
+            code = shared_policies.get(id(node.exit))
+            if code is None:
+                code = policies.setdefault(tuple(node.exit), len(policy_rules))
+                if code == len(policy_rules):
+                    policy_rules.append(node.exit)
+                shared_policies[id(node.exit)] = code
+            policy_codes[i] = code
+
+        return cls(
+            fingerprints=np.array(fingerprints, dtype=FINGERPRINT_DTYPE),
+            bandwidth=np.fromiter(
+                (node.bandwidth.measured for node in nodes), dtype=np.int64, count=n
+            ),
+            country_codes=country_codes,
+            countries=list(countries),
+            asn_codes=asn_codes,
+            asns=list(asns),
+            policy_codes=policy_codes,
+            policies=policy_rules,
+            nodes=nodes,
+        )
+
+    def __len__(self) -> int:
+        return len(self.bandwidth)
+
+    def node(self, i: int) -> TorNode:
+        """Returns the TorNode of relay `i`, building it from the columns on first use."""
+        if self._nodes is not None:
+            return self._nodes[i]
+
+        i = int(i)
+        node = self._views.get(i)
+        if node is None:
+            node = TorNode(
+                fingerprint=self.fingerprints[i].decode(),
+                nickname=self.nicknames[i],
+                ip=self.ips[i],
+                port=int(self.ports[i]),
+                bandwidth=Bandwidth(
+                    measured=int(self.bandwidth[i]),
+                    average=int(self.average[i]),
+                    burst=int(self.burst[i]),
+                ),
+                family=self.families[i],
+                asn=self.asn(i),
+                exit=self.policies[self.policy_codes[i]],
+                country=self.country(i),
+            )
+            self._views[i] = node
+        return node
+
+    def row(self, fingerprint: str) -> int:
+        """Returns the index of the relay with `fingerprint`, raising KeyError if there is none."""
+        if self._rows is None:
+            self._rows = {
+                fingerprint: i
+                for i, fingerprint in enumerate(self.fingerprints.tolist())
+            }
+        return self._rows[fingerprint.encode()]
+
+    def freeze(self) -> "RelayTable":
+        """Makes the array columns read-only, for tables shared between several users."""
+        for column in (
+            self.fingerprints,
+            self.bandwidth,
+            self.country_codes,
+            self.asn_codes,
+            self.policy_codes,
+            self.ports,
+            self.average,
+            self.burst,
+        ):
+            if isinstance(column, np.ndarray):
+                column.flags.writeable = False
+        return self
+
+    def cold_columns(self) -> Dict[str, Sequence]:
+        """Returns the per-relay fields that are not hot columns, building them from the nodes if needed."""
+        if self.nicknames is not None:
+            return {
+                "nicknames": self.nicknames,
+                "ips": self.ips,
+                "ports": self.ports,
+                "average": self.average,
+                "burst": self.burst,
+                "families": self.families,
+            }
+        nodes = self._nodes
+        return {
+            "nicknames": [node.nickname for node in nodes],
+            "ips": [node.ip for node in nodes],
+            "ports": np.array([node.port for node in nodes], dtype=np.intc),
+            "average": np.array(
+                [node.bandwidth.average for node in nodes], dtype=np.int64
+            ),
+            "burst": np.array([node.bandwidth.burst for node in nodes], dtype=np.int64),
+            "families": [node.family for node in nodes],
+        }
+
+    def country(self, i: int) -> str:
+        return self.countries[self.country_codes[i]]
+
+    def asn(self, i: int) -> str:
+        return self.asns[self.asn_codes[i]]
+
+    @property
+    def exit_index(self) -> ExitPolicyIndex:
+        """The compiled exit-policy index of the relays, built on first use."""
+        if self._exit_index is None:
+            self._exit_index = ExitPolicyIndex(self.policies, self.policy_codes)
+        return self._exit_index
+
+    @property
+    def middle_sampler(self) -> WeightedSampler:
+        """
+        Bandwidth-weighted sampler over the indices of every relay, built on first use and
+        shared by every PathSelector of the table (middles are drawn from it by rejection).
+        """
+        if self._middle_sampler is None:
+            self._middle_sampler = WeightedSampler(
+                range(len(self)), self.bandwidth.tolist()
+            )
+        return self._middle_sampler
+
+    def reuse_exit_index(self, previous: "RelayTable"):
+        """
+        Reuses the exit-policy index of `previous`, a table whose policies are the same as the
+        first policies of this one, instead of compiling it again.
+        """
+        if previous._exit_index is not None and len(previous.policies) == len(
+            self.policies
+        ):
+            self._exit_index = previous._exit_index.regroup(self.policy_codes)
+
+    def reuse_middle_sampler(self, previous: "RelayTable", first_changed: int):
+        """
+        Builds the middle sampler from the one of `previous`, if it was built, when the first
+        `first_changed` relays of both tables are the same: their cumulative bandwidth is
+        kept and only the rows from `first_changed` on are summed again.
+        """
+        sampler = previous._middle_sampler
+        if sampler is None:
+            return
+        cumulative = sampler.cumulative[:first_changed]
+        offset = cumulative[-1] if cumulative else 0
+        cumulative += (np.cumsum(self.bandwidth[first_changed:]) + offset).tolist()
+        self._middle_sampler = WeightedSampler.from_cumulative(
+            range(len(self)), cumulative
+        )
+
+    def exit_bitmap(self, destination_ip: str, port: int | None = None) -> np.ndarray:
+        """
+        Returns the packed bitmap of the relays whose exit policy allows the destination
+        (on any port when `port` is None). Bitmaps of the last EXIT_BITMAP_CACHE_SIZE
+        destinations are cached.
+        """
+        key = (destination_ip, port)
+        bitmap = self._exit_bitmaps.get(key)
+        if bitmap is None:
+            bitmap = self._exit_bitmaps.put(
+                key, np.packbits(self.exit_index.mask(destination_ip, port))
+            )
+        return bitmap
+
+    def exit_mask(self, destination_ip: str, port: int | None = None) -> np.ndarray:
+        """Returns `exit_bitmap` unpacked to one boolean per relay."""
+        return np.unpackbits(
+            self.exit_bitmap(destination_ip, port), count=len(self)
+        ).view(bool)
+
+
+class RelayTableBuilder:
+    """
+    Builds a RelayTable one relay record at a time, without keeping the records or TorNode objects.
+    Numeric columns grow as compact arrays and are handed to NumPy without a copy at the end.
+    """
+
+    def __init__(self):
+        self.fingerprints = bytearray()
+        self.bandwidth = array("q")
+        self.average = array("q")
+        self.burst = array("q")
+        self.ports = array("i")
+        self.country_codes = array("h")
+        self.asn_codes = array("i")
+        self.policy_codes = array("i")
+        self.nicknames: List[str] = []
+        self.ips: List[str] = []
+        self.families: List[tuple] = []
+        self.countries: Dict[str, int] = {}
+        self.asns: Dict[str, int] = {}
+        self.policies: Dict[str, int] = {}
+
+    def append(self, record: dict, country: str):
+        """Adds one relay record (in the consensus JSON format) located in `country`."""
+        fingerprint = _encode_fingerprint(record["fingerprint"])
+        self.fingerprints += fingerprint.ljust(FINGERPRINT_BYTES, b"\0")
+
+        bandwidth = record["bandwidth"]
+        self.bandwidth.append(bandwidth["measured"])
+        self.average.append(bandwidth["average"])
+        self.burst.append(bandwidth["burst"])
+        self.ports.append(record["port"])
+
+        self.country_codes.append(
+            self.countries.setdefault(country, len(self.countries))
+        )
+        self.asn_codes.append(self.asns.setdefault(record["asn"], len(self.asns)))
+        self.policy_codes.append(
+            self.policies.setdefault(record["exit"], len(self.policies))
+        )
+
+        self.nicknames.append(record["nickname"])
+        self.ips.append(record["ip"])
+        self.families.append(tuple(record["family"]))
+
+    def build(self) -> RelayTable:
+        return RelayTable(
+            fingerprints=np.frombuffer(self.fingerprints, dtype=FINGERPRINT_DTYPE),
+            bandwidth=np.frombuffer(self.bandwidth, dtype=np.int64),
+            country_codes=np.frombuffer(self.country_codes, dtype=np.int16),
+            countries=[intern_country(country) for country in self.countries],
+            asn_codes=np.frombuffer(self.asn_codes, dtype=np.intc),
+            asns=[sys.intern(asn) for asn in self.asns],
+            policy_codes=np.frombuffer(self.policy_codes, dtype=np.intc),
+            policies=[_shared_exit_rules(policy) for policy in self.policies],
+            nicknames=self.nicknames,
+            ips=self.ips,
+            ports=np.frombuffer(self.ports, dtype=np.intc),
+            average=np.frombuffer(self.average, dtype=np.int64),
+            burst=np.frombuffer(self.burst, dtype=np.int64),
+            families=self.families,
+        )
@@ -0,0 +1,55 @@
+import random
+import sys
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Iterable, Sequence
+
+INT_BYTES = 32  # Size of a Python int (relay index or cumulative bandwidth)
+
+
+class WeightedSampler:
+    """
+    Bandwidth-weighted sampler over a fixed pool of nodes.
+    The pool can hold anything (e.g. relay indices) when its `weights` are given explicitly.
+
+    The cumulative bandwidth of the pool is computed once, so a draw is a binary search
+    (O(log n)) instead of a linear scan. For the same random stream it picks exactly the
+    same node as the linear scan it replaces.
+    """
+
+    def __init__(self, nodes: Sequence, weights: Iterable[int] | None = None):
+        self.nodes = nodes
+        if weights is None:
+            weights = (node.bandwidth.measured for node in nodes)
+        self.cumulative = list(accumulate(weights))
+        self.total_bandwidth = self.cumulative[-1] if self.cumulative else 0
+
+    @classmethod
+    def from_cumulative(cls, nodes: Sequence, cumulative: list) -> "WeightedSampler":
+        """A sampler over `nodes` whose cumulative bandwidth is already known."""
+        sampler = cls.__new__(cls)
+        sampler.nodes = nodes
+        sampler.cumulative = cumulative
+        sampler.total_bandwidth = cumulative[-1] if cumulative else 0
+        return sampler
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def nbytes(self) -> int:
+        """Estimated memory of the sampling table (and of the pool when it is a list)."""
+        size = sys.getsizeof(self.cumulative) + INT_BYTES * len(self.cumulative)
+        if isinstance(self.nodes, list):  # A pool of relay indices, as PathSelector has
+            size += sys.getsizeof(self.nodes) + INT_BYTES * len(self.nodes)
+        return size
+
+    def index(self, rng=random) -> int:
+        """Draws the index of a node in the pool. The pool must not be empty."""
+        selection_point = rng.uniform(0, self.total_bandwidth)
+        return bisect_left(self.cumulative, selection_point)
+
+    def choice(self, rng=random):
+        """Draws a node from the pool, or None if the pool is empty."""
+        if not self.nodes:
+            return None
+        return self.nodes[self.index(rng)]
@@ -0,0 +1,226 @@
+import argparse
+import csv
+import gc
+import json
+import logging as log
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+
+from consensusLoader import load_relay_table
+from models import Params, parse_input_config, parse_tor_nodes
+from syntheticConsensus import SyntheticGeoLocator, generate_config, write_consensus
+from taps import PathSelector, select_path, GUARD_PARAMS, EXIT_PARAMS
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_ALLIANCES = [3]
+SELECT_DRAWS = 1_000  # Paths drawn to time PathSelector.select
+STUDY_COLUMNS = ["relays", "alliances", "stage", "seconds", "peak_mb"]
+
+
+def measure_stage(run: Callable[[], object]) -> Tuple[float, float]:
+    """
+    Returns the time of one run of `run` (seconds) and its peak memory (MB), traced in a
+    second run since tracemalloc slows the traced code down.
+    """
+    gc.collect()
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak_bytes / 1e6
+
+
+def run_study(
+    sizes: List[int],
+    alliance_counts: List[int],
+    seed: int = 0,
+    workdir: str | None = None,
+) -> List[dict]:
+    """
+    Measures each stage of path selection over generated consensuses of every size:
+    - loading: `json.load` + parse_tor_nodes, and the streaming load_relay_table;
+    - selection, for a client config of each alliance count: building the PathSelector,
+      one PathSelector.select (averaged over SELECT_DRAWS) and a one-off select_path.
+    Returns one row of STUDY_COLUMNS per (size, alliance count, stage), loading stages
+    having no alliance count.
+    """
+    geo_locator = SyntheticGeoLocator()
+    guard_params = Params(**GUARD_PARAMS)
+    exit_params = Params(**EXIT_PARAMS)
+    rows = []
+
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for n_relays in sizes:
+            path = os.path.join(tmp, f"consensus_{n_relays}.json")
+            write_consensus(path, n_relays, seed)
+            log.info("Generated a consensus of %d relays", n_relays)
+
+            def parse_json():
+                with open(path) as f:
+                    return parse_tor_nodes(json.load(f), geo_locator)
+
+            rows.append(_row(n_relays, None, "parse_tor_nodes", parse_json))
+            rows.append(
+                _row(
+                    n_relays,
+                    None,
+                    "load_relay_table",
+                    lambda: load_relay_table(path, geo_locator),
+                )
+            )
+
+            relays = load_relay_table(path, geo_locator)
+            for n_alliances in alliance_counts:
+                config = parse_input_config(
+                    generate_config(n_alliances, seed), geo_locator
+                )
+                rows.append(
+                    _row(
+                        n_relays,
+                        n_alliances,
+                        "PathSelector",
+                        lambda: PathSelector(relays, config, guard_params, exit_params),
+                    )
+                )
+
+                selector = PathSelector(relays, config, guard_params, exit_params)
+
+                def draw_paths():
+                    for _ in range(SELECT_DRAWS):
+                        selector.select()
+
+                rows.append(
+                    _row(
+                        n_relays,
+                        n_alliances,
+                        "PathSelector.select",
+                        draw_paths,
+                        SELECT_DRAWS,
+                    )
+                )
+                rows.append(
+                    _row(
+                        n_relays,
+                        n_alliances,
+                        "select_path",
+                        lambda: select_path(relays, config, guard_params, exit_params),
+                    )
+                )
+            os.remove(path)
+    return rows
+
+
+# region Aux functions
+def _row(
+    n_relays: int,
+    n_alliances: int | None,
+    stage: str,
+    run: Callable[[], object],
+    calls: int = 1,
+) -> dict:
+    seconds, peak_mb = measure_stage(run)
+    log.info("%s (%d relays): %.6f s", stage, n_relays, seconds / calls)
+    return {
+        "relays": n_relays,
+        "alliances": n_alliances,
+        "stage": stage,
+        "seconds": seconds / calls,
+        "peak_mb": peak_mb,
+    }
+
+
+# endregion
+
+
+def plot_study(rows: List[dict], path: str):
+    """Plots the time and the peak memory of each stage against the relay count (log-log)."""
+    try:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        log.error(
+            "ERROR: matplotlib is needed to plot the study (pip install matplotlib)"
+        )
+        return
+
+    fig, (time_axis, memory_axis) = plt.subplots(1, 2, figsize=(12, 5))
+    series = {}
+    for row in rows:
+        label = row["stage"] + (
+            f" ({row['alliances']} alliances)" if row["alliances"] is not None else ""
+        )
+        series.setdefault(label, []).append(row)
+    for label, points in series.items():
+        relays = [p["relays"] for p in points]
+        time_axis.plot(relays, [p["seconds"] for p in points], marker="o", label=label)
+        memory_axis.plot(
+            relays, [p["peak_mb"] for p in points], marker="o", label=label
+        )
+
+    for axis, ylabel in ((time_axis, "seconds per call"), (memory_axis, "peak MB")):
+        axis.set_xscale("log")
+        axis.set_yscale("log")
+        axis.set_xlabel("relays")
+        axis.set_ylabel(ylabel)
+        axis.grid(True, which="both", alpha=0.3)
+    time_axis.legend(fontsize="small")
+    fig.tight_layout()
+    fig.savefig(path)
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="Time and memory of loading and path selection against the relay count"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument(
+        "--alliances",
+        type=int,
+        nargs="+",
+        default=DEFAULT_ALLIANCES,
+        help="Alliance counts of the client configs",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="CSV file to write the results to")
+    parser.add_argument("--plot", help="Image file to plot the results to (matplotlib)")
+    parser.add_argument(
+        "--workdir", help="Where to write the generated consensuses (temporary dir)"
+    )
+    args = parser.parse_args(argv)
+
+    log.basicConfig(level=log.INFO, format="%(levelname)s - %(message)s")
+
+    rows = run_study(args.sizes, args.alliances, args.seed, args.workdir)
+
+    print(
+        f"{'relays':>9} | {'alliances':>9} | {'stage':>20} | {'s/call':>10} | {'peak MB':>8}"
+    )
+    for row in rows:
+        alliances = row["alliances"] if row["alliances"] is not None else "-"
+        print(
+            f"{row['relays']:>9} | {alliances:>9} | {row['stage']:>20} | "
+            f"{row['seconds']:>10.6f} | {row['peak_mb']:>8.1f}"
+        )
+    if args.out:
+        with open(args.out, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=STUDY_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    if args.plot:
+        plot_study(rows, args.plot)
+
+
+if __name__ == "__main__":
+    main()
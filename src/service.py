@@ -0,0 +1,288 @@
+import argparse
+import asyncio
+import ipaddress
+import json
+import logging as log
+import signal
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+from consensusDiff import ConsensusStore
+from consensusLoader import iter_relay_records
+from models import Params, TorNode, parse_input_config
+from taps import (
+    PathSelector,
+    GEOLITE_DB_PATH,
+    DEFAULT_NODES_DATA_PATH,
+    DEFAULT_CONFIG_PATH,
+    GUARD_PARAMS,
+    EXIT_PARAMS,
+)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+SELECTOR_CACHE_BYTES = 256 * 2**20  # Estimated memory of the PathSelectors kept (LRU)
+MAX_PATHS_PER_REQUEST = 10_000
+MAX_PORT = 65535
+
+
+class PathService:
+    """
+    Answers path selection requests against a consensus loaded once.
+
+    A request is a JSON object with the "Client" and "Destination" IPs, and optionally
+    "DestinationPort", "Alliances" (the alliances of the service config otherwise) and
+    "count" (paths to draw, 1 by default). A JSON array of requests is a batch, answered
+    with an array of responses in the same order.
+
+    The PathSelector of each distinct config is built on its first request and kept in an
+    LRU cache, so repeated requests only pay for the weighted draws. Selectors grow as they
+    build the exit pools of new guard countries: the least recently used ones are dropped
+    while the estimated memory of the cache (PathSelector.nbytes) is above `cache_bytes`.
+    Relays are read from a ConsensusStore: when a new consensus is published there, the
+    cached selectors are dropped and rebuilt against it on their next request.
+    """
+
+    def __init__(
+        self,
+        relays,
+        geo_locator,
+        alpha_guard: Params,
+        alpha_exit: Params,
+        default_alliances: List[dict] | None = None,
+        cache_bytes: int = SELECTOR_CACHE_BYTES,
+    ):
+        self.store = (
+            relays if isinstance(relays, ConsensusStore) else ConsensusStore(relays)
+        )
+        self.geo_locator = geo_locator
+        self.alpha_guard = alpha_guard
+        self.alpha_exit = alpha_exit
+        self.default_alliances = default_alliances or []
+        self.cache_bytes = cache_bytes
+        self._selectors: OrderedDict[tuple, PathSelector] = OrderedDict()
+        self._selector_bytes: Dict[tuple, int] = {}
+        self._cached_bytes = 0
+        self._version = self.store.version
+
+    def selector(self, config) -> PathSelector:
+        version, relays = self.store.snapshot()
+        if version != self._version:
+            self._selectors.clear()
+            self._selector_bytes.clear()
+            self._cached_bytes = 0
+            self._version = version
+
+        key = config.selection_key()
+        selector = self._selectors.get(key)
+        if selector is None:
+            selector = PathSelector(relays, config, self.alpha_guard, self.alpha_exit)
+            self._selectors[key] = selector
+        else:
+            self._selectors.move_to_end(key)
+        return selector
+
+    def _account(self, config, selector: PathSelector):
+        """
+        Updates the estimated memory of a selector after use, then drops the least recently
+        used selectors (never the one just used) until the cache fits in `cache_bytes`.
+        """
+        key = config.selection_key()
+        if self._selectors.get(key) is not selector:
+            return  # The consensus changed meanwhile
+        size = selector.nbytes()
+        self._cached_bytes += size - self._selector_bytes.get(key, 0)
+        self._selector_bytes[key] = size
+        while self._cached_bytes > self.cache_bytes and len(self._selectors) > 1:
+            evicted, _ = self._selectors.popitem(last=False)
+            self._cached_bytes -= self._selector_bytes.pop(evicted)
+
+    def reload(self, nodes_data_path: str):
+        """Moves the service to a new consensus file, by applying its diff to the current relays."""
+        try:
+            relays = self.store.update(
+                self.geo_locator, iter_relay_records(nodes_data_path)
+            )
+        except (OSError, ValueError, KeyError) as e:
+            log.error(f"Could not reload the consensus, keeping the current one: {e!r}")
+            return
+        log.info("Consensus updated: %d relays", len(relays))
+
+    def handle(self, request) -> dict | list:
+        """Answers one request, or every request of a batch."""
+        if isinstance(request, list):
+            return [self.handle(r) for r in request]
+        try:
+            config = parse_input_config(
+                {"Alliances": self.default_alliances, **request}, self.geo_locator
+            )
+            count = int(request.get("count", 1))
+            _validate_destination(config.destination, config.destination_port)
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            return {"error": f"Invalid request: {e!r}"}
+        if not 1 <= count <= MAX_PATHS_PER_REQUEST:
+            return {"error": f"count must be between 1 and {MAX_PATHS_PER_REQUEST}"}
+
+        try:
+            selector = self.selector(config)
+            paths = []
+            for _ in range(count):
+                path = selector.select()
+                if path is None:
+                    break
+                paths.append(
+                    {
+                        "guard": _node_json(path.guard_node),
+                        "middle": _node_json(path.middle_node),
+                        "exit": _node_json(path.exit_node),
+                    }
+                )
+            self._account(config, selector)
+        except Exception as e:  # One failed request must not drop the connection
+            log.error(f"ERROR: Path selection failed for {request!r}: {e!r}")
+            return {"error": f"Path selection failed: {e!r}"}
+        if len(paths) < count:
+            return {"error": "No valid path could be selected."}
+        return {"paths": paths}
+
+    def handle_line(self, line: bytes) -> bytes:
+        """Answers one newline-delimited JSON request with one line of JSON."""
+        start = time.perf_counter()
+        try:
+            response = self.handle(json.loads(line))
+        except json.JSONDecodeError as e:
+            response = {"error": f"Invalid JSON: {e}"}
+        log.debug("Request answered in %.0f us", (time.perf_counter() - start) * 1e6)
+        return json.dumps(response).encode() + b"\n"
+
+    async def serve_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        """Answers the requests of one client, one line each, until it disconnects."""
+        try:
+            while line := await reader.readline():
+                if line.strip():
+                    writer.write(self.handle_line(line))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(
+        self, unix_socket: str | None = None, host=DEFAULT_HOST, port=DEFAULT_PORT
+    ) -> asyncio.AbstractServer:
+        """Listens on a Unix socket when `unix_socket` is given, on host:port otherwise."""
+        if unix_socket:
+            return await asyncio.start_unix_server(self.serve_connection, unix_socket)
+        return await asyncio.start_server(self.serve_connection, host, port)
+
+
+# region Aux functions
+def _validate_destination(destination, destination_port):
+    """Raises ValueError unless the destination is an IP address and its port (if any) valid."""
+    ipaddress.ip_address(destination)
+    if destination_port is not None and (
+        type(destination_port) is not int or not 1 <= destination_port <= MAX_PORT
+    ):
+        raise ValueError(
+            f"DestinationPort must be an integer between 1 and {MAX_PORT}, "
+            f"not {destination_port!r}"
+        )
+
+
+def _node_json(node: TorNode) -> dict:
+    return {
+        "fingerprint": node.fingerprint,
+        "nickname": node.nickname,
+        "ip": node.ip,
+        "port": node.port,
+        "country": node.country,
+        "asn": node.asn,
+    }
+
+
+# endregion
+
+
+async def serve(
+    service: PathService,
+    unix_socket: str | None,
+    host: str,
+    port: int,
+    nodes_data_path: str | None = None,
+):
+    """Serves until cancelled. With `nodes_data_path`, SIGHUP reloads that consensus file."""
+    server = await service.start(unix_socket, host, port)
+    if nodes_data_path:
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(
+            signal.SIGHUP,
+            lambda: loop.run_in_executor(None, service.reload, nodes_data_path),
+        )
+    log.info("Serving path selection on %s", unix_socket or f"{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv: List[str] | None = None):
+    """Command-line entry point: loads the consensus once and serves requests until stopped."""
+    from GeoLocator import IPGeolocation
+    from snapshot import load_relay_table_cached
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--nodes",
+        dest="nodes_data_path",
+        default=DEFAULT_NODES_DATA_PATH,
+        help="Path to the Tor nodes consensus JSON file",
+    )
+    parser.add_argument(
+        "--config",
+        dest="config_path",
+        default=DEFAULT_CONFIG_PATH,
+        help="Config JSON file whose alliances are used by requests without their own",
+    )
+    parser.add_argument("--socket", help="Unix socket path to listen on")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--selector-cache-mb",
+        type=int,
+        default=SELECTOR_CACHE_BYTES // 2**20,
+        help="Estimated memory of the path selectors kept for repeated configs",
+    )
+    args = parser.parse_args(argv)
+
+    log.basicConfig(level=log.INFO, format="%(levelname)s - %(message)s")
+
+    geo_locator = IPGeolocation(GEOLITE_DB_PATH)
+    if not geo_locator.reader:
+        exit()
+    try:
+        with open(args.config_path, "r") as f:
+            default_alliances = json.load(f).get("Alliances", [])
+        relays = load_relay_table_cached(args.nodes_data_path, geo_locator)
+    except FileNotFoundError as e:
+        log.error(f"ERROR: Could not find a required file: {e.filename}")
+        exit()
+
+    service = PathService(
+        relays,
+        geo_locator,
+        Params(**GUARD_PARAMS),
+        Params(**EXIT_PARAMS),
+        default_alliances,
+        args.selector_cache_mb * 2**20,
+    )
+    try:
+        asyncio.run(
+            serve(service, args.socket, args.host, args.port, args.nodes_data_path)
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
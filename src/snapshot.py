@@ -0,0 +1,243 @@
+import hashlib
+import json
+import logging as log
+import mmap
+import os
+import struct
+from typing import Sequence, Tuple
+
+import numpy as np
+
+from models import ExitRule, _shared_exit_rules
+from relayTable import RelayTable
+from consensusLoader import load_relay_table, STDIN_PATH
+
+SNAPSHOT_MAGIC = b"TAPSSNAP"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_SUFFIX = ".snapshot"
+ALIGNMENT = 64  # Every column starts on a 64-byte boundary
+FAMILY_SEPARATOR = "\x1f"
+
+# magic, version, header length
+_PREAMBLE = struct.Struct("<8sIQ")
+
+
+class StringColumn(Sequence[str]):
+    """
+    A column of strings stored as one UTF-8 blob plus an offsets array.
+    Strings are only decoded when they are accessed.
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def encode(cls, values: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        encoded = [value.encode() for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return bytes(self.blob[self.offsets[i] : self.offsets[i + 1]]).decode()
+
+
+class FamilyColumn(Sequence[tuple]):
+    """The families of the relays, stored as a StringColumn of separator-joined fingerprints."""
+
+    def __init__(self, strings: StringColumn):
+        self.strings = strings
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        joined = self.strings[i]
+        return tuple(joined.split(FAMILY_SEPARATOR)) if joined else ()
+
+
+# region Aux functions
+def _aligned(size: int) -> int:
+    """Rounds `size` up to the next multiple of ALIGNMENT."""
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _policy_string(rules: Sequence[ExitRule]) -> str:
+    """Writes back a parsed exit policy in the consensus format."""
+    return ", ".join(f"{rule.action} {rule.address}:{rule.port}" for rule in rules)
+
+
+# endregion
+
+
+def default_snapshot_path(consensus_path: str) -> str:
+    return consensus_path + SNAPSHOT_SUFFIX
+
+
+def write_snapshot(
+    relays: RelayTable, path: str, consensus_sha256: str, geoip_build: str
+):
+    """
+    Writes a relay table to a binary snapshot:
+    a preamble (magic, version, header length), a JSON header, then every column as raw
+    little-endian data aligned to 64 bytes. The file is written next to `path` and moved
+    into place, so readers never see a partial snapshot.
+    """
+    cold = relays.cold_columns()
+    nickname_blob, nickname_offsets = StringColumn.encode(cold["nicknames"])
+    ip_blob, ip_offsets = StringColumn.encode(cold["ips"])
+    family_blob, family_offsets = StringColumn.encode(
+        [FAMILY_SEPARATOR.join(family) for family in cold["families"]]
+    )
+
+    arrays = {
+        "fingerprints": relays.fingerprints,
+        "bandwidth": relays.bandwidth,
+        "country_codes": relays.country_codes,
+        "asn_codes": relays.asn_codes,
+        "policy_codes": relays.policy_codes,
+        "ports": cold["ports"],
+        "average": cold["average"],
+        "burst": cold["burst"],
+        "nickname_blob": nickname_blob,
+        "nickname_offsets": nickname_offsets,
+        "ip_blob": ip_blob,
+        "ip_offsets": ip_offsets,
+        "family_blob": family_blob,
+        "family_offsets": family_offsets,
+    }
+
+    columns = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        array = array.astype(array.dtype.newbyteorder("<"), copy=False)
+        arrays[name] = array
+        columns[name] = {
+            "dtype": array.dtype.str,
+            "length": len(array),
+            "offset": offset,
+        }
+        offset += _aligned(array.nbytes)
+
+    header = json.dumps(
+        {
+            "consensus_sha256": consensus_sha256,
+            "geoip_build": geoip_build,
+            "relays": len(relays),
+            "countries": relays.countries,
+            "asns": relays.asns,
+            "policies": [_policy_string(rules) for rules in relays.policies],
+            "columns": columns,
+        }
+    ).encode()
+    data_start = _aligned(_PREAMBLE.size + len(header))
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + columns[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path: str) -> Tuple[dict, RelayTable]:
+    """
+    Maps a snapshot into memory and returns its header and relay table.
+    Columns are read-only views of the mapping, nothing is copied or decoded up front.
+    """
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(mapping) < _PREAMBLE.size:
+        raise ValueError(f"'{path}' is not a snapshot")
+    magic, version, header_length = _PREAMBLE.unpack_from(mapping)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError(f"'{path}' is not a version {SNAPSHOT_VERSION} snapshot")
+
+    header = json.loads(mapping[_PREAMBLE.size : _PREAMBLE.size + header_length])
+    data_start = _aligned(_PREAMBLE.size + header_length)
+
+    def column(name: str) -> np.ndarray:
+        info = header["columns"][name]
+        return np.frombuffer(
+            mapping,
+            dtype=np.dtype(info["dtype"]),
+            count=info["length"],
+            offset=data_start + info["offset"],
+        )
+
+    relays = RelayTable(
+        fingerprints=column("fingerprints"),
+        bandwidth=column("bandwidth"),
+        country_codes=column("country_codes"),
+        countries=header["countries"],
+        asn_codes=column("asn_codes"),
+        asns=header["asns"],
+        policy_codes=column("policy_codes"),
+        policies=[_shared_exit_rules(policy) for policy in header["policies"]],
+        nicknames=StringColumn(column("nickname_blob"), column("nickname_offsets")),
+        ips=StringColumn(column("ip_blob"), column("ip_offsets")),
+        ports=column("ports"),
+        average=column("average"),
+        burst=column("burst"),
+        families=FamilyColumn(
+            StringColumn(column("family_blob"), column("family_offsets"))
+        ),
+    )
+    return header, relays
+
+
+def load_relay_table_cached(
+    consensus_path: str, geo_locator, snapshot_path: str | None = None
+) -> RelayTable:
+    """
+    Loads a consensus through its binary snapshot.
+    The snapshot is keyed by the SHA-256 of the consensus file and the GeoIP database build;
+    when it is missing, unreadable or stale, the consensus is parsed and geolocated again and
+    the snapshot is rebuilt. A consensus read from stdin is never cached.
+    """
+    if consensus_path == STDIN_PATH:
+        return load_relay_table(consensus_path, geo_locator)
+
+    snapshot_path = snapshot_path or default_snapshot_path(consensus_path)
+    consensus_sha256 = file_sha256(consensus_path)
+    geoip_build = geo_locator.build_id()
+
+    try:
+        header, relays = read_snapshot(snapshot_path)
+        if (
+            header["consensus_sha256"] == consensus_sha256
+            and header["geoip_build"] == geoip_build
+        ):
+            return relays
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+    except OSError as e:  # e.g. a snapshot that exists but cannot be read
+        log.error(f"Could not read the snapshot, rebuilding it: {e!r}")
+
+    relays = load_relay_table(consensus_path, geo_locator)
+    try:
+        write_snapshot(relays, snapshot_path, consensus_sha256, geoip_build)
+    except OSError:
+        pass  # A read-only location only costs the next run a full load
+    return relays
@@ -0,0 +1,189 @@
+import argparse
+import csv
+import itertools
+import json
+import sys
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from analytic import evaluate_exact_many
+from evaluate import get_adversaries
+from models import InputConfig, Params, parse_input_config
+from relayTable import RelayTable
+from taps import (
+    PathSelector,
+    GEOLITE_DB_PATH,
+    DEFAULT_NODES_DATA_PATH,
+    DEFAULT_CONFIG_PATH,
+    GUARD_PARAMS,
+    EXIT_PARAMS,
+)
+from trustModel import ScoredRelays
+
+DEFAULT_THRESHOLDS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9)
+PARAM_FIELDS = tuple(GUARD_PARAMS)
+SWEEP_COLUMNS = (
+    ["consensus", "config"]
+    + [f"guard_{field}" for field in PARAM_FIELDS]
+    + [f"exit_{field}" for field in PARAM_FIELDS]
+    + [
+        "threshold",
+        "guard_pool",
+        "guard_in_adversary",
+        "middle_in_adversary",
+        "exit_in_adversary",
+        "correlation",
+        "valid",
+    ]
+)
+
+
+def param_grid(
+    base: Dict[str, float], values: Dict[str, Sequence[float]]
+) -> List[Params]:
+    """
+    Returns the Params of every combination of `values`, a list of values per field.
+    Fields without values keep the one of `base`.
+    """
+    fields = list(values)
+    return [
+        Params(**{**base, **dict(zip(fields, combination))})
+        for combination in itertools.product(*(values[field] for field in fields))
+    ]
+
+
+def sweep(
+    consensuses: Iterable[Tuple[str, RelayTable]],
+    configs: Dict[str, InputConfig],
+    guard_grid: Sequence[Params],
+    exit_grid: Sequence[Params],
+    thresholds: Sequence[float] = DEFAULT_THRESHOLDS,
+    filter_asn_country: bool = False,
+    with_middle: bool = False,
+) -> Iterator[dict]:
+    """
+    Evaluates every (consensus, config, guard params, exit params, threshold) point of the
+    grid exactly (see analytic.evaluate_exact) and yields one row of SWEEP_COLUMNS per point.
+
+    Consensuses are taken one at a time. For each of its configs, the relays are scored and
+    ranked once (ScoredRelays) and every point of the parameter grid only cuts the rankings.
+    The thresholds only change the adversaries, so the pools of a grid point are evaluated
+    against all of them in a single pass (analytic.evaluate_exact_many).
+    """
+    for consensus_name, relays in consensuses:
+        for config_name, config in configs.items():
+            scored_relays = ScoredRelays(relays, config)
+            adversary_sets = [
+                get_adversaries(config, threshold) for threshold in thresholds
+            ]
+            for alpha_guard, alpha_exit in itertools.product(guard_grid, exit_grid):
+                selector = PathSelector(
+                    relays,
+                    config,
+                    alpha_guard,
+                    alpha_exit,
+                    filter_asn_country,
+                    scored_relays=scored_relays,
+                )
+                point = {
+                    "consensus": consensus_name,
+                    "config": config_name,
+                    **{f"guard_{f}": getattr(alpha_guard, f) for f in PARAM_FIELDS},
+                    **{f"exit_{f}": getattr(alpha_exit, f) for f in PARAM_FIELDS},
+                    "guard_pool": len(selector.guard_sampler.nodes),
+                }
+                evaluations = evaluate_exact_many(selector, adversary_sets, with_middle)
+                for threshold, exact in zip(thresholds, evaluations):
+                    yield {
+                        **point,
+                        "threshold": threshold,
+                        "guard_in_adversary": exact.guard_in_adversary,
+                        "middle_in_adversary": exact.middle_in_adversary,
+                        "exit_in_adversary": exact.exit_in_adversary,
+                        "correlation": exact.correlation,
+                        "valid": exact.valid,
+                    }
+
+
+def write_results(rows: Iterable[dict], f) -> int:
+    """Writes the rows of a sweep as CSV, returns the number of rows written."""
+    writer = csv.DictWriter(f, fieldnames=SWEEP_COLUMNS)
+    writer.writeheader()
+    n_rows = 0
+    for row in rows:
+        writer.writerow(row)
+        n_rows += 1
+    return n_rows
+
+
+def main(argv: List[str] | None = None):
+    """Command-line entry point: sweeps a parameter grid and writes one CSV results table."""
+    from GeoLocator import IPGeolocation
+    from snapshot import load_relay_table_cached
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--nodes",
+        dest="nodes_data_paths",
+        nargs="+",
+        default=[DEFAULT_NODES_DATA_PATH],
+        help="Tor nodes consensus JSON files",
+    )
+    parser.add_argument(
+        "--configs",
+        dest="config_paths",
+        nargs="+",
+        default=[DEFAULT_CONFIG_PATH],
+        help="Client input config JSON files",
+    )
+    parser.add_argument(
+        "--grid",
+        dest="grid_path",
+        help='JSON file like {"guard": {"accept_upper": [0.3, 0.5]}, "exit": {...}, '
+        '"thresholds": [...]}, fields not listed keep their default value',
+    )
+    parser.add_argument(
+        "--out", dest="out_path", help="CSV file to write (stdout if unset)"
+    )
+    parser.add_argument("--filter-asn-country", action="store_true")
+    parser.add_argument(
+        "--with-middle",
+        action="store_true",
+        help="Also compute middle_in_adversary (one term per (guard, exit) pair)",
+    )
+    args = parser.parse_args(argv)
+
+    grid = {}
+    if args.grid_path:
+        with open(args.grid_path, "r") as f:
+            grid = json.load(f)
+
+    geo_locator = IPGeolocation(GEOLITE_DB_PATH)
+    if not geo_locator.reader:
+        exit()
+    configs = {}
+    for config_path in args.config_paths:
+        with open(config_path, "r") as f:
+            configs[config_path] = parse_input_config(json.load(f), geo_locator)
+
+    rows = sweep(
+        # Loaded one at a time, as the sweep reaches them
+        (
+            (path, load_relay_table_cached(path, geo_locator))
+            for path in args.nodes_data_paths
+        ),
+        configs,
+        param_grid(GUARD_PARAMS, grid.get("guard", {})),
+        param_grid(EXIT_PARAMS, grid.get("exit", {})),
+        grid.get("thresholds", DEFAULT_THRESHOLDS),
+        args.filter_asn_country,
+        args.with_middle,
+    )
+    if args.out_path:
+        with open(args.out_path, "w", newline="") as f:
+            write_results(rows, f)
+    else:
+        write_results(rows, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
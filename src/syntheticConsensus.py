@@ -0,0 +1,220 @@
+import argparse
+import json
+import random
+from itertools import accumulate
+from typing import Dict, Iterable, Iterator, List
+
+# Approximate share of the relays of the Tor network hosted in each country
+COUNTRY_WEIGHTS = {
+    "DE": 0.22, "US": 0.20, "FR": 0.08, "NL": 0.08, "SE": 0.03, "CH": 0.03,
+    "GB": 0.03, "CA": 0.03, "FI": 0.03, "PL": 0.02, "AT": 0.02, "RU": 0.02,
+    "RO": 0.02, "LU": 0.015, "NO": 0.015, "UA": 0.01, "CZ": 0.01, "ES": 0.01,
+    "IT": 0.01, "BG": 0.01, "JP": 0.01, "SG": 0.01, "BR": 0.01, "IS": 0.01,
+    "LT": 0.01, "HK": 0.005, "IN": 0.005, "AU": 0.005, "BE": 0.005, "DK": 0.005,
+    "IE": 0.005, "IR": 0.005, "CN": 0.005, "PT": 0.005, "KR": 0.005,
+}  # fmt: skip
+
+# Exit policies with their approximate share of the relays (most relays are not exits)
+REDUCED_EXIT_POLICY = (
+    "reject *:25, reject *:119, reject *:135-139, reject *:445, reject *:563, "
+    "reject *:1214, reject *:4661-4666, reject *:6346-6429, reject *:6699, "
+    "reject *:6881-6999, accept *:*"
+)
+EXIT_POLICY_WEIGHTS = {
+    "reject *:*": 0.72,
+    REDUCED_EXIT_POLICY: 0.14,
+    "accept *:80, accept *:443, reject *:*": 0.05,
+    "accept *:*": 0.04,
+    "reject 0.0.0.0/8:*, reject 169.254.0.0/16:*, reject *:25, accept *:*": 0.03,
+    "accept *:443, accept *:993, accept *:995, reject *:*": 0.02,
+}
+
+ASN_ZIPF_EXPONENT = 1.1  # A few hosting providers hold most of the relays of a country
+RELAYS_PER_ASN = 20  # Size of the ASN pool: one ASN per 20 relays (at least 100)
+BANDWIDTH_PARETO_ALPHA = 1.2  # Tail of the measured bandwidth
+BANDWIDTH_SCALE = 200  # Measured bandwidth of the smallest relays
+UNMEASURED_FRACTION = 0.02  # Relays without a measured bandwidth yet
+FAMILY_FRACTION = 0.3  # Share of the operators that run a family of relays
+MAX_FAMILY_SIZE = 20
+FAMILY_SIZE_RATE = 0.3  # Family sizes are 1 + floor(exponential(rate)), ~4 on average
+RESERVED_FIRST_OCTETS = {10, 127, 192}  # Private networks ("LN" for IPGeolocation)
+SYNTHETIC_BUILD_ID = "synthetic-v1"
+
+
+# region Aux functions
+def _country_octets() -> Dict[str, List[int]]:
+    """Deals the public first octets of IPv4 addresses to the countries, round-robin."""
+    octets = [o for o in range(1, 224) if o not in RESERVED_FIRST_OCTETS]
+    countries = list(COUNTRY_WEIGHTS)
+    return {country: octets[i :: len(countries)] for i, country in enumerate(countries)}
+
+
+COUNTRY_OCTETS = _country_octets()
+OCTET_COUNTRIES = {
+    octet: country for country, octets in COUNTRY_OCTETS.items() for octet in octets
+}
+
+
+def _asn_pools(n_relays: int, rng: random.Random) -> Dict[str, tuple]:
+    """Returns the (ASNs, cumulative Zipf weights) of each country, sized by its share."""
+    n_asns = max(100, n_relays // RELAYS_PER_ASN)
+    numbers = rng.sample(range(1, 400_000), n_asns + len(COUNTRY_WEIGHTS) * 2)
+    pools = {}
+    for country, weight in COUNTRY_WEIGHTS.items():
+        size = max(2, round(weight * n_asns))
+        asns = [str(numbers.pop()) for _ in range(min(size, len(numbers)))]
+        weights = [1 / (rank + 1) ** ASN_ZIPF_EXPONENT for rank in range(len(asns))]
+        pools[country] = (asns, list(accumulate(weights)))
+    return pools
+
+
+def _bandwidth(rng: random.Random) -> dict:
+    measured = (
+        0
+        if rng.random() < UNMEASURED_FRACTION
+        else int(rng.paretovariate(BANDWIDTH_PARETO_ALPHA) * BANDWIDTH_SCALE)
+    )
+    average = int(max(measured, BANDWIDTH_SCALE) * rng.uniform(1.0, 4.0))
+    return {
+        "measured": measured,
+        "average": average,
+        "burst": int(average * rng.uniform(1.0, 2.0)),
+    }
+
+
+def _ip(country: str, rng: random.Random) -> str:
+    return (
+        f"{rng.choice(COUNTRY_OCTETS[country])}.{rng.randint(0, 255)}."
+        f"{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+    )
+
+
+# endregion
+
+
+class SyntheticGeoLocator:
+    """
+    Stands in for IPGeolocation on synthetic consensuses: the country of an IP is given
+    by its first octet, as dealt by generate_relays.
+    """
+
+    reader = True
+
+    def get_country(self, ip_address: str) -> str:
+        if ip_address.startswith(("127.", "192.", "10.")):
+            return "LN"
+        octet, _, _ = ip_address.partition(".")
+        return OCTET_COUNTRIES.get(int(octet), "XX") if octet.isdigit() else "XX"
+
+    def get_countries(self, ip_addresses: Iterable[str]) -> List[str]:
+        return [self.get_country(ip) for ip in ip_addresses]
+
+    def build_id(self) -> str:
+        return SYNTHETIC_BUILD_ID
+
+
+def generate_relays(n_relays: int, seed: int = 0) -> Iterator[dict]:
+    """
+    Yields `n_relays` relay records in the consensus JSON format, the same ones for the
+    same seed. Relays are drawn operator by operator:
+    - countries follow COUNTRY_WEIGHTS, and ASNs a Zipf law within each country;
+    - measured bandwidths are Pareto distributed (heavy-tailed), a few are unmeasured;
+    - exit policies follow EXIT_POLICY_WEIGHTS;
+    - FAMILY_FRACTION of the operators run a family of relays, which share their country,
+      ASN and exit policy, and list each other in `family`.
+    """
+    rng = random.Random(seed)
+    countries = list(COUNTRY_WEIGHTS)
+    country_weights = list(accumulate(COUNTRY_WEIGHTS.values()))
+    policies = list(EXIT_POLICY_WEIGHTS)
+    policy_weights = list(accumulate(EXIT_POLICY_WEIGHTS.values()))
+    asn_pools = _asn_pools(n_relays, rng)
+
+    i = 0
+    while i < n_relays:
+        size = 1
+        if rng.random() < FAMILY_FRACTION:
+            size = min(
+                1 + int(rng.expovariate(FAMILY_SIZE_RATE)),
+                MAX_FAMILY_SIZE,
+                n_relays - i,
+            )
+        country = rng.choices(countries, cum_weights=country_weights)[0]
+        asns, asn_weights = asn_pools[country]
+        asn = rng.choices(asns, cum_weights=asn_weights)[0]
+        policy = rng.choices(policies, cum_weights=policy_weights)[0]
+        fingerprints = [f"{rng.getrandbits(160):040X}" for _ in range(size)]
+
+        for fingerprint in fingerprints:
+            yield {
+                "fingerprint": fingerprint,
+                "nickname": f"relay{i}",
+                "ip": _ip(country, rng),
+                "port": 9001 if rng.random() < 0.8 else 443,
+                "bandwidth": _bandwidth(rng),
+                "family": (
+                    [f"${f}" for f in fingerprints if f != fingerprint]
+                    if size > 1
+                    else []
+                ),
+                "asn": asn,
+                "exit": policy,
+            }
+            i += 1
+
+
+def write_consensus(path: str, n_relays: int, seed: int = 0) -> int:
+    """Writes a consensus JSON file of `n_relays` generated relays, one relay at a time."""
+    with open(path, "w") as f:
+        f.write("[\n")
+        for i, record in enumerate(generate_relays(n_relays, seed)):
+            if i:
+                f.write(",\n")
+            json.dump(record, f)
+        f.write("\n]\n")
+    return n_relays
+
+
+def generate_config(n_alliances: int, seed: int = 0) -> dict:
+    """
+    Returns a client input config with `n_alliances` alliances of 1 to 5 countries, with
+    trusts between 0.1 and 0.99. Client and destination are in the two biggest countries.
+    """
+    rng = random.Random(seed)
+    countries = list(COUNTRY_WEIGHTS)
+    return {
+        "Alliances": [
+            {
+                "countries": rng.sample(countries, rng.randint(1, 5)),
+                "trust": round(rng.uniform(0.1, 0.99), 2),
+            }
+            for _ in range(n_alliances)
+        ],
+        "Client": f"{COUNTRY_OCTETS[countries[0]][0]}.1.2.3",
+        "Destination": f"{COUNTRY_OCTETS[countries[1]][0]}.4.5.6",
+    }
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(
+        description="Writes a seeded synthetic consensus (and client config)"
+    )
+    parser.add_argument("--relays", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", required=True, help="Consensus JSON file to write")
+    parser.add_argument(
+        "--config-out", help="Also write a client config JSON file there"
+    )
+    parser.add_argument(
+        "--alliances", type=int, default=3, help="Alliances of the client config"
+    )
+    args = parser.parse_args(argv)
+
+    write_consensus(args.out, args.relays, args.seed)
+    if args.config_out:
+        with open(args.config_out, "w") as f:
+            json.dump(generate_config(args.alliances, args.seed), f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,40 @@
+from __future__ import annotations
+
 import json
-import random
-from typing import List, Dict
+from typing import List, Dict, TYPE_CHECKING
 from models import (
     TorNode,
     InputConfig,
-    Alliance,
-    Bandwidth,
-    ExitRule,
     Params,
     Result,
     parse_input_config,
-    parse_tor_nodes,
 )
-from GeoLocator import IPGeolocation
+from sampler import WeightedSampler
+from lruCache import LRUCache
+import instrumentation
+from instrumentation import stage_start, stage_end, record_size
 import logging as log
 from auxFunctions import (
     __is_node_safe,
     __is_node_acceptable,
+    __are_nodes_safe,
+    __are_nodes_acceptable,
 )
 import argparse
+import sys
 
-# region Configuration
-log.basicConfig(
-    level=log.ERROR,
-    format="%(levelname)s - %(message)s",
-)
+# numpy, geoip2 and the relay table are imported where they are used, so that importing this
+# module stays cheap and has no side effects (see main for the command-line interface)
+if TYPE_CHECKING:
+    import numpy as np
+    from relayTable import RelayTable
+    from trustModel import ScoredRelays
 
+# region Configuration
 GEOLITE_DB_PATH = "../GeoLite2-Country_20250610/GeoLite2-Country.mmdb"
 DEFAULT_NODES_DATA_PATH = "../inputs/tor_consensus.json"
 DEFAULT_CONFIG_PATH = "../inputs/input1.json"
 
-# Parse command-line arguments
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    "--nodes",
-    dest="nodes_data_path",
-    default=DEFAULT_NODES_DATA_PATH,
-    help="Path to the Tor nodes consensus JSON file",
-)
-parser.add_argument(
-    "--config",
-    dest="config_path",
-    default=DEFAULT_CONFIG_PATH,
-    help="Path to the client input config JSON file",
-)
-args = parser.parse_args()
-
-NODES_DATA_PATH = args.nodes_data_path
-CONFIG_PATH = args.config_path
-
 GUARD_PARAMS = {
     "safe_upper": 0.95,
     "safe_lower": 2.0,
@@ -70,25 +56,28 @@ DEFAULT_TRUST_SCORE_GUARD = (
 DEFAULT_TRUST_SCORE_EXIT = (
     1  # Default trust score for exit nodes countries not in any alliance
 )
+
+EXIT_POOL_CACHE_SIZE = 256  # Max secure exit pools kept per PathSelector (LRU)
+MAX_MIDDLE_REDRAWS = 64  # Rejection rounds before falling back to an exact middle draw
 # endregion
 
 
 # region Aux functions
-def _filter_exit_nodes(all_nodes: List[TorNode], destination_ip: str) -> List[TorNode]:
+def _filter_exit_nodes(
+    all_nodes: List[TorNode], destination_ip: str, destination_port: int | None = None
+) -> List[TorNode]:
     """Returns a list of nodes that can be used as exits.
-    Filters nodes based on if they have exit rules that allow the destination IP or if they accept all (*).
+    Filters nodes based on if their exit policy allows the destination, with Tor's first-match
+    semantics over address/CIDR and port ranges (any port when `destination_port` is None).
     """
-    valid_exits = []
-    for node in all_nodes:
-        is_valid = any(
-            (rule.address == "*" or rule.address == destination_ip)
-            and rule.action == "accept"
-            for rule in node.exit
-        )
-        if is_valid:
-            valid_exits.append(node)
+    from exitPolicy import compile_exit_policy, parse_destination, policy_accepts
 
-    return valid_exits
+    version, ip = parse_destination(destination_ip)
+    return [
+        node
+        for node in all_nodes
+        if policy_accepts(compile_exit_policy(node.exit), ip, destination_port, version)
+    ]
 
 
 def _get_country_trust_map(config: InputConfig) -> Dict[str, float]:
@@ -108,21 +97,11 @@ def _get_country_trust_map(config: InputConfig) -> Dict[str, float]:
 
 
 def _bandwidth_weighted_choice(nodes: List[TorNode]) -> TorNode | None:
-    """Performs a weighted random selection based on measured bandwidth."""
-    if not nodes:
-        return None
-
-    total_bandwidth = sum(node.bandwidth.measured for node in nodes)
-
-    selection_point = random.uniform(0, total_bandwidth)
-
-    # Here the weight is progressively increased to increase the chance of selecting some node and don't end with no node choosen,
-    # otherwise it would need to do a loop and this would be worst in terms of performance.
-    current_weight = 0
-    for node in nodes:
-        current_weight += node.bandwidth.measured
-        if current_weight >= selection_point:
-            return node
+    """
+    Performs a weighted random selection based on measured bandwidth.
+    This builds a one-off sampler; to draw many times from the same pool keep a WeightedSampler instead.
+    """
+    return WeightedSampler(nodes).choice()
 
 
 def _find_secure_relays(
@@ -138,9 +117,12 @@ def _find_secure_relays(
         return []
 
     # Sort nodes by their security score in descending order
+    start = stage_start()
     sorted_nodes = sorted(
         all_nodes, key=lambda n: scores.get(n.fingerprint, 0), reverse=True
     )
+    stage_end("sort", start)
+    start = stage_start()
 
     # Find the maximum score
     s_star = scores.get(sorted_nodes[0].fingerprint, 0)
@@ -170,9 +152,58 @@ def _find_secure_relays(
             if current_bandwidth >= bandwidth_threshold:
                 break
 
+    stage_end("secure_cut", start)
     return secure_set
 
 
+def _find_secure_indices(
+    candidates: np.ndarray,
+    scores: np.ndarray,
+    bandwidth: np.ndarray,
+    alpha_params: Params,
+    total_bandwidth: int,
+    order: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Column version of _find_secure_relays.
+    `candidates` are relay indices, `scores` and `bandwidth` are aligned with them.
+    `order` is the stable descending order of `scores` when it is already known.
+    Returns the indices of the secure relays, in the same order _find_secure_relays would.
+    """
+    import numpy as np
+
+    if len(candidates) == 0:
+        return candidates
+
+    # Stable sort by descending score, like sorted(..., reverse=True)
+    if order is None:
+        start = stage_start()
+        order = np.argsort(-scores, kind="stable")
+        stage_end("sort", start)
+    start = stage_start()
+    sorted_scores = scores[order]
+    s_star = sorted_scores[0]
+
+    safe = __are_nodes_safe(sorted_scores, s_star, alpha_params)
+    acceptable = ~safe & __are_nodes_acceptable(sorted_scores, s_star, alpha_params)
+    secure = order[safe]
+    acceptable = order[acceptable]
+
+    current_bandwidth = bandwidth[secure].sum()
+    bandwidth_threshold = total_bandwidth * alpha_params.bandwidth_frac
+
+    # Add acceptable nodes one by one until bandwidth fraction is met
+    if current_bandwidth < bandwidth_threshold and len(acceptable):
+        reached = np.flatnonzero(
+            current_bandwidth + np.cumsum(bandwidth[acceptable]) >= bandwidth_threshold
+        )
+        n_acceptable = reached[0] + 1 if len(reached) else len(acceptable)
+        secure = np.concatenate((secure, acceptable[:n_acceptable]))
+
+    stage_end("secure_cut", start)
+    return candidates[secure]
+
+
 # endregion
 
 
@@ -183,13 +214,11 @@ def guard_security(
     """
     Calculates security based on the trust scores of the involved countries.
     """
+    security_score = 1.0 * trust_map.get(client_country, DEFAULT_TRUST_SCORE_GUARD)
 
-    involved_countries = {client_country, guard_country}
-
-    security_score = 1.0
-    for country in involved_countries:
-        trust_score = trust_map.get(country, DEFAULT_TRUST_SCORE_GUARD)
-        security_score *= trust_score
+    # A guard in the client's country involves no other country
+    if guard_country != client_country:
+        security_score *= trust_map.get(guard_country, DEFAULT_TRUST_SCORE_GUARD)
 
     return security_score
 
@@ -204,83 +233,115 @@ def exit_security(
     """
     Calculates security based on avoiding untrusted adversaries on both ends.
     """
-    entry_countries = {client_country, guard_country}
-    exit_countries = {dest_country, exit_country}
-
-    correlating_countries = entry_countries.intersection(exit_countries)
-
-    # If there are no correlating countries => Nice
-    if not correlating_countries:
-        return 1.0
-
-    # Else the risk is determined by the most untrustworthy adversary in the intersection.
+    # The correlating countries are the ones on both ends: {client, guard} & {dest, exit}.
+    # If there are none => Nice, else the risk is determined by the most untrustworthy one.
     max_compromise_prob = 0.0
-    for country in correlating_countries:
-        trust_score = trust_map.get(country, DEFAULT_TRUST_SCORE_EXIT)
-        compromise_prob = 1.0 - trust_score
-        if compromise_prob > max_compromise_prob:
-            max_compromise_prob = compromise_prob
+    for country in (client_country, guard_country):
+        if country == dest_country or country == exit_country:
+            trust_score = trust_map.get(country, DEFAULT_TRUST_SCORE_EXIT)
+            compromise_prob = 1.0 - trust_score
+            if compromise_prob > max_compromise_prob:
+                max_compromise_prob = compromise_prob
 
     security_score = 1.0 - max_compromise_prob
     return security_score
 
 
-def select_guard_node(
+def _find_secure_guards(
     nodes: List[TorNode],
     config: InputConfig,
     alpha_guard: Params,
     trust_map: Dict[str, float],
-) -> TorNode | None:
-    log.info("Selecting Guard Node...")
+) -> List[TorNode]:
+    """Returns the secure guard pool for the client."""
     total_guard_bandwidth = sum(n.bandwidth.measured for n in nodes)
 
+    start = stage_start()
     guard_scores = {
         node.fingerprint: guard_security(config.client_country, node.country, trust_map)
         for node in nodes
     }
+    stage_end("guard_scoring", start)
 
-    secure_guards = _find_secure_relays(
-        nodes, guard_scores, alpha_guard, total_guard_bandwidth
-    )
-    log.info(f"Filtered down to {len(secure_guards)} secure guards.")
-
-    return _bandwidth_weighted_choice(secure_guards)
+    return _find_secure_relays(nodes, guard_scores, alpha_guard, total_guard_bandwidth)
 
 
-def select_exit_node(
-    nodes: List[TorNode],
+def _find_secure_exits(
+    filtered_exits: List[TorNode],
     config: InputConfig,
     alpha_exit: Params,
     trust_map: Dict[str, float],
-    chosen_guard: TorNode,
-    filter_asn_country: bool = False,
-) -> TorNode | None:
-    log.info("Selecting Exit Node...")
-
-    filtered_exits = _filter_exit_nodes(nodes, config.destination)
-
-    if filter_asn_country:
-        filtered_exits = [
-            node for node in filtered_exits if node.asn != chosen_guard.asn
-        ]
+    guard_country: str,
+    guard_asn: str | None = None,
+) -> List[TorNode]:
+    """
+    Returns the secure exit pool for a guard in `guard_country`.
+    The pool only depends on the chosen guard through its country, and through its ASN
+    when `guard_asn` is given (exits in the same ASN are filtered out).
+    """
+    if guard_asn is not None:
+        filtered_exits = [node for node in filtered_exits if node.asn != guard_asn]
 
     total_exit_bandwidth = sum(n.bandwidth.measured for n in filtered_exits)
 
+    start = stage_start()
     exit_scores = {
         node.fingerprint: exit_security(
             config.client_country,
             config.destination_country,
-            chosen_guard.country,
+            guard_country,
             node.country,
             trust_map,
         )
         for node in filtered_exits
     }
+    stage_end("exit_scoring", start)
 
-    secure_exits = _find_secure_relays(
+    return _find_secure_relays(
         filtered_exits, exit_scores, alpha_exit, total_exit_bandwidth
     )
-    log.info(f"Filtered down to {len(secure_exits)} secure exits.")
+
+
+def select_guard_node(
+    nodes: List[TorNode],
+    config: InputConfig,
+    alpha_guard: Params,
+    trust_map: Dict[str, float],
+) -> TorNode | None:
+    log.info("Selecting Guard Node...")
+    secure_guards = _find_secure_guards(nodes, config, alpha_guard, trust_map)
+    log.info("Filtered down to %d secure guards.", len(secure_guards))
+    record_size("secure_guards", len(secure_guards))
+
+    return _bandwidth_weighted_choice(secure_guards)
+
+
+def select_exit_node(
+    nodes: List[TorNode],
+    config: InputConfig,
+    alpha_exit: Params,
+    trust_map: Dict[str, float],
+    chosen_guard: TorNode,
+    filter_asn_country: bool = False,
+) -> TorNode | None:
+    log.info("Selecting Exit Node...")
+
+    start = stage_start()
+    filtered_exits = _filter_exit_nodes(
+        nodes, config.destination, config.destination_port
+    )
+    stage_end("exit_filtering", start)
+    record_size("filtered_exits", len(filtered_exits))
+    secure_exits = _find_secure_exits(
+        filtered_exits,
+        config,
+        alpha_exit,
+        trust_map,
+        chosen_guard.country,
+        chosen_guard.asn if filter_asn_country else None,
+    )
+    log.info("Filtered down to %d secure exits.", len(secure_exits))
+    record_size("secure_exits", len(secure_exits))
 
     return _bandwidth_weighted_choice(secure_exits)
 
@@ -291,20 +352,220 @@ def select_middle_node(
     chosen_exit: TorNode,
 ) -> TorNode | None:
     log.info("Selecting Middle Node...")
-    middle_candidates = [
-        node
-        for node in nodes
-        if node.fingerprint not in {chosen_guard.fingerprint, chosen_exit.fingerprint}
-    ]
+    start = stage_start()
+    excluded = {chosen_guard.fingerprint, chosen_exit.fingerprint}
+    middle_candidates = [node for node in nodes if node.fingerprint not in excluded]
+    record_size("middle_candidates", len(middle_candidates))
 
-    return _bandwidth_weighted_choice(middle_candidates)
+    chosen_middle = _bandwidth_weighted_choice(middle_candidates)
+    stage_end("middle_sampling", start)
+    return chosen_middle
 
 
 # endregion
 
 
+class PathSelector:
+    """
+    Path selector precompiled for a fixed consensus, client config and parameters.
+
+    Everything that does not depend on the drawn relays (trust model, secure guard pool,
+    exit candidates and the secure exit pool of each guard country) is computed once,
+    together with their sampling tables, so each call to `select` only pays for the weighted draws.
+    Secure exit pools are kept in an LRU cache of `exit_cache_size` entries, and middles
+    are drawn from the sampler over the whole consensus that the RelayTable builds once.
+
+    Scores are looked up in the country score tables of a TrustModel compiled from the config,
+    and the candidates of each pool are ranked by a ScoredRelays. Rankings do not depend on
+    the parameters: selectors of the same relays and config can share one `scored_relays`,
+    and then only cut the rankings with their own parameters.
+    Scoring and sampling run over the columns of a RelayTable and work with relay indices;
+    TorNode objects are only looked up for the relays of the returned paths.
+    """
+
+    def __init__(
+        self,
+        nodes: List[TorNode] | RelayTable,
+        config: InputConfig,
+        alpha_guard: Params,
+        alpha_exit: Params,
+        filter_asn_country: bool = False,
+        exit_cache_size: int = EXIT_POOL_CACHE_SIZE,
+        scored_relays: ScoredRelays | None = None,
+    ):
+        from relayTable import RelayTable
+        from trustModel import ScoredRelays
+
+        if scored_relays is None:
+            relays = (
+                nodes if isinstance(nodes, RelayTable) else RelayTable.from_nodes(nodes)
+            )
+            scored_relays = ScoredRelays(relays, config, exit_cache_size)
+        self.relays = scored_relays.relays
+        self.config = config
+        self.alpha_guard = alpha_guard
+        self.alpha_exit = alpha_exit
+        self.filter_asn_country = filter_asn_country
+
+        self.scored_relays = scored_relays
+        self.trust_model = scored_relays.trust_model
+        self.trust_map = self.trust_model.trust_map
+        self.guard_sampler = self._build_guard_sampler()
+        self.exit_candidates = scored_relays.exit_candidates
+        self._exit_samplers: LRUCache[WeightedSampler] = LRUCache(exit_cache_size)
+        self.middle_sampler = self.relays.middle_sampler
+
+    @property
+    def guard_pool(self) -> List[TorNode]:
+        return [self.relays.node(i) for i in self.guard_sampler.nodes]
+
+    def _build_guard_sampler(self) -> WeightedSampler:
+        ranking = self.scored_relays.guard_ranking
+        secure_guards = _find_secure_indices(
+            ranking.candidates,
+            ranking.scores,
+            ranking.bandwidth,
+            self.alpha_guard,
+            ranking.bandwidth.sum(),
+            ranking.order,
+        )
+        record_size("secure_guards", len(secure_guards))
+        return WeightedSampler(
+            secure_guards.tolist(), self.relays.bandwidth[secure_guards].tolist()
+        )
+
+    def exit_key(self, chosen_guard: int) -> tuple:
+        """
+        Returns everything the secure exit pool depends on for the chosen guard:
+        (guard_country, destination, filter_asn_country, guard_asn or None).
+        """
+        return (
+            self.relays.country(chosen_guard),
+            self.config.destination,
+            self.filter_asn_country,
+            self.relays.asn(chosen_guard) if self.filter_asn_country else None,
+        )
+
+    def _build_exit_sampler(
+        self,
+        guard_country: str,
+        destination: str,
+        filter_asn_country: bool,
+        guard_asn: str | None,
+    ) -> WeightedSampler:
+        # The destination of the key is always the one of the config, ranked by scored_relays
+        ranking = self.scored_relays.exit_ranking(
+            guard_country, guard_asn if filter_asn_country else None
+        )
+        secure_exits = _find_secure_indices(
+            ranking.candidates,
+            ranking.scores,
+            ranking.bandwidth,
+            self.alpha_exit,
+            ranking.bandwidth.sum(),
+            ranking.order,
+        )
+        record_size("secure_exits", len(secure_exits))
+        return WeightedSampler(
+            secure_exits.tolist(), self.relays.bandwidth[secure_exits].tolist()
+        )
+
+    def exit_sampler(self, chosen_guard: int) -> WeightedSampler:
+        """Returns the sampler over the secure exit pool of the chosen guard (cached)."""
+        key = self.exit_key(chosen_guard)
+        sampler = self._exit_samplers.get(key)
+        if sampler is None:
+            sampler = self._exit_samplers.put(key, self._build_exit_sampler(*key))
+        return sampler
+
+    def nbytes(self) -> int:
+        """
+        Estimated memory of the selector: its pools and their sampling tables, and its
+        ScoredRelays. The relays and their middle sampler are shared, so not counted.
+        """
+        return (
+            self.scored_relays.nbytes()
+            + self.guard_sampler.nbytes()
+            + sum(sampler.nbytes() for sampler in self._exit_samplers.values())
+        )
+
+    def select_middle(self, chosen_guard: int, chosen_exit: int) -> int | None:
+        """
+        Draws a middle relay from the whole consensus, redrawing while it hits the guard or the exit.
+        Rejection gives exactly the distribution of select_middle_node without building a candidate list.
+        """
+        if not self.middle_sampler.nodes:
+            return None
+
+        fingerprints = self.relays.fingerprints
+        guard_fingerprint = fingerprints[chosen_guard]
+        exit_fingerprint = fingerprints[chosen_exit]
+        for _ in range(MAX_MIDDLE_REDRAWS):
+            i = self.middle_sampler.choice()
+            if (
+                fingerprints[i] != guard_fingerprint
+                and fingerprints[i] != exit_fingerprint
+            ):
+                return i
+
+        # Guard and exit hold (almost) all the bandwidth, fall back to the exact draw
+        import numpy as np
+
+        middle_candidates = np.flatnonzero(
+            (fingerprints != guard_fingerprint) & (fingerprints != exit_fingerprint)
+        )
+        return WeightedSampler(
+            middle_candidates.tolist(),
+            self.relays.bandwidth[middle_candidates].tolist(),
+        ).choice()
+
+    def select(self) -> Result | None:
+        """Draws one Guard-Middle-Exit path."""
+        profiled = instrumentation.active_profile is not None
+
+        # Step 1: Select Guard Node
+        if profiled:
+            start = stage_start()
+        chosen_guard = self.guard_sampler.choice()
+        if profiled:
+            stage_end("guard_sampling", start)
+        if chosen_guard is None:
+            log.error("Error finding Guard node. Aborting path selection.")
+            return None
+
+        # Step 2: Select Exit Node (building its secure exit pool on a cache miss)
+        if profiled:
+            start = stage_start()
+        chosen_exit = self.exit_sampler(chosen_guard).choice()
+        if profiled:
+            stage_end("exit_sampling", start)
+        if chosen_exit is None:
+            log.error("Error finding Exit node. Aborting path selection.")
+            return None
+
+        # Step 3: Select Middle Node
+        if profiled:
+            start = stage_start()
+        chosen_middle = self.select_middle(chosen_guard, chosen_exit)
+        if profiled:
+            stage_end("middle_sampling", start)
+            record_size(
+                "middle_candidates",
+                len(self.relays) - 1 - (chosen_guard != chosen_exit),
+            )
+        if chosen_middle is None:
+            log.error("Error finding Middle node. Aborting path selection.")
+            return None
+
+        return Result(
+            guard_node=self.relays.node(chosen_guard),
+            middle_node=self.relays.node(chosen_middle),
+            exit_node=self.relays.node(chosen_exit),
+        )
+
+
 def select_path(
-    nodes: list[TorNode],
+    nodes: list[TorNode] | RelayTable,
     config: InputConfig,
     alpha_guard: Params,
     alpha_exit: Params,
@@ -312,80 +573,81 @@ def select_path(
 ) -> Result | None:
     """
     Main function to select a Guard-Middle-Exit path.
+    To draw many paths for the same inputs, build a PathSelector once and call `select` on it.
     """
-
-    trust_map = _get_country_trust_map(config)
-
-    # Step 1: Select Guard Node
-    chosen_guard = select_guard_node(
-        nodes,
-        config,
-        alpha_guard,
-        trust_map,
+    start = stage_start()
+    result = PathSelector(
+        nodes, config, alpha_guard, alpha_exit, filter_asn_country
+    ).select()
+    stage_end("select_path", start)
+    return result
+
+
+def _parse_args(argv: List[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--nodes",
+        dest="nodes_data_path",
+        default=DEFAULT_NODES_DATA_PATH,
+        help="Path to the Tor nodes consensus JSON file ('-' to read it from stdin)",
     )
-    if not chosen_guard:
-        log.error("Error finding Guard node. Aborting path selection.")
-        return None
-
-    # Step 2: Select Exit Node
-    chosen_exit = select_exit_node(
-        nodes,
-        config,
-        alpha_exit,
-        trust_map,
-        chosen_guard,
-        filter_asn_country,
+    parser.add_argument(
+        "--config",
+        dest="config_path",
+        default=DEFAULT_CONFIG_PATH,
+        help="Path to the client input config JSON file",
     )
-    if not chosen_exit:
-        log.error("Error finding Exit node. Aborting path selection.")
-        return None
-
-    # Step 3: Select Middle Node
-    chosen_middle = select_middle_node(
-        nodes,
-        chosen_guard,
-        chosen_exit,
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time of each stage and the pool sizes of the selection to stderr",
     )
-    if not chosen_middle:
-        log.error("Error finding Middle node. Aborting path selection.")
-        return None
-
-    return Result(
-        guard_node=chosen_guard,
-        middle_node=chosen_middle,
-        exit_node=chosen_exit,
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] | None = None):
+    """Command-line entry point: selects and prints one path."""
+    from GeoLocator import IPGeolocation
+    from snapshot import load_relay_table_cached
+
+    log.basicConfig(
+        level=log.ERROR,
+        format="%(levelname)s - %(message)s",
     )
+    args = _parse_args(argv)
+    if args.profile:
+        instrumentation.enable()
 
+    geo_locator = IPGeolocation(GEOLITE_DB_PATH)
+    if not geo_locator.reader:
+        exit()
 
-if __name__ == "__main__":
     try:
-        with open(NODES_DATA_PATH, "r") as f:
-            all_nodes_data = json.load(f)
-        with open(CONFIG_PATH, "r") as f:
+        with open(args.config_path, "r") as f:
             input_config_data = json.load(f)
+        # Relays come from the consensus snapshot, rebuilt by streaming the file when it is stale
+        start = stage_start()
+        relays = load_relay_table_cached(args.nodes_data_path, geo_locator)
+        stage_end("consensus_load", start)
 
     except FileNotFoundError as e:
         log.error(f"ERROR: Could not find a required file: {e.filename}")
         exit()
 
-    geo_locator = IPGeolocation(GEOLITE_DB_PATH)
-    if not geo_locator.reader:
-        exit()
-
-    GUARD_PARAMS = Params(**GUARD_PARAMS)
-    EXIT_PARAMS = Params(**EXIT_PARAMS)
+    guard_params = Params(**GUARD_PARAMS)
+    exit_params = Params(**EXIT_PARAMS)
 
     input_config = parse_input_config(input_config_data, geo_locator)
-    all_nodes_data = parse_tor_nodes(all_nodes_data, geo_locator)
 
     selected_path = select_path(
-        all_nodes_data,
+        relays,
         input_config,
-        GUARD_PARAMS,
-        EXIT_PARAMS,
+        guard_params,
+        exit_params,
         filter_asn_country=False,
     )
-
+    if args.profile:
+        print(instrumentation.disable().report(), file=sys.stderr)
     if selected_path:
         ("\nFinal Selected Path:")
         print(
@@ -400,3 +662,7 @@ if __name__ == "__main__":
     else:
         log.error("No valid path could be selected.")
         exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+from dataclasses import dataclass
+from typing import Dict, Sequence
+
+import numpy as np
+
+from instrumentation import stage_start, stage_end, record_size
+from lruCache import LRUCache
+from models import InputConfig
+from taps import (
+    _get_country_trust_map,
+    DEFAULT_TRUST_SCORE_GUARD,
+    DEFAULT_TRUST_SCORE_EXIT,
+    EXIT_POOL_CACHE_SIZE,
+)
+
+
+class TrustModel:
+    """
+    A client config compiled against the interned countries of a relay table.
+
+    Attributes:
+        trust_map (Dict[str, float]): The trust of every country of an alliance.
+        guard_trust (np.ndarray): Trust of each country id, with the guard default applied.
+        exit_trust (np.ndarray): Trust of each country id, with the exit default applied.
+        guard_scores (np.ndarray): guard_security of a guard in each country id.
+        exit_scores (np.ndarray): exit_security of an exit in country id `e` for a guard
+            in country id `g`, at [g, e].
+
+    Scores are computed with the same floating point operations as guard_security and
+    exit_security, so they are equal to them, not just close.
+    """
+
+    def __init__(self, config: InputConfig, countries: Sequence[str]):
+        self.trust_map = _get_country_trust_map(config)
+        country_ids: Dict[str, int] = {
+            country: i for i, country in enumerate(countries)
+        }
+        self.guard_trust = np.array(
+            [self.trust_map.get(c, DEFAULT_TRUST_SCORE_GUARD) for c in countries],
+            dtype=np.float64,
+        )
+        self.exit_trust = np.array(
+            [self.trust_map.get(c, DEFAULT_TRUST_SCORE_EXIT) for c in countries],
+            dtype=np.float64,
+        )
+
+        ids = np.arange(len(countries))
+        client_id = country_ids.get(config.client_country, -1)
+        destination_id = country_ids.get(config.destination_country, -1)
+
+        # Guards: the trust of the client times the trust of the guard, counted once if equal
+        client_trust = self.trust_map.get(
+            config.client_country, DEFAULT_TRUST_SCORE_GUARD
+        )
+        self.guard_scores = np.where(
+            ids == client_id, 1.0 * client_trust, 1.0 * client_trust * self.guard_trust
+        )
+
+        # Exits: 1 - the highest compromise probability among the countries seen on both
+        # ends, i.e. {client, guard} & {destination, exit}
+        client_compromise = 1.0 - self.trust_map.get(
+            config.client_country, DEFAULT_TRUST_SCORE_EXIT
+        )
+        exit_compromise = 1.0 - self.exit_trust
+        client_on_both = (config.client_country == config.destination_country) | (
+            ids[None, :] == client_id
+        )
+        guard_on_both = (ids[:, None] == destination_id) | (
+            ids[:, None] == ids[None, :]
+        )
+
+        max_compromise = np.zeros((len(countries), len(countries)))
+        max_compromise = np.where(
+            client_on_both,
+            np.maximum(max_compromise, client_compromise),
+            max_compromise,
+        )
+        max_compromise = np.where(
+            guard_on_both,
+            np.maximum(max_compromise, exit_compromise[:, None]),
+            max_compromise,
+        )
+        self.exit_scores = 1.0 - max_compromise
+
+
+@dataclass(frozen=True)
+class Ranking:
+    """
+    Candidate relays of a pool, scored and ordered once, so that the pool can be cut for
+    any Params without scoring and sorting them again.
+
+    Attributes:
+        candidates (np.ndarray): Indices of the candidate relays.
+        scores (np.ndarray): Security score of each candidate.
+        bandwidth (np.ndarray): Measured bandwidth of each candidate.
+        order (np.ndarray): Positions of the candidates by descending score (stable sort).
+    """
+
+    candidates: np.ndarray
+    scores: np.ndarray
+    bandwidth: np.ndarray
+    order: np.ndarray
+
+    @classmethod
+    def build(cls, candidates: np.ndarray, scores: np.ndarray, bandwidth: np.ndarray):
+        start = stage_start()
+        order = np.argsort(-scores, kind="stable")
+        stage_end("sort", start)
+        return cls(candidates, scores, bandwidth, order)
+
+    def nbytes(self) -> int:
+        return (
+            self.candidates.nbytes
+            + self.scores.nbytes
+            + self.bandwidth.nbytes
+            + self.order.nbytes
+        )
+
+
+class ScoredRelays:
+    """
+    The guard and exit rankings of a client config over a relay table.
+    None of them depends on the Params of path selection: PathSelectors built for the same
+    relays and config, with different Params, can share one ScoredRelays.
+    Exit rankings are kept in an LRU cache of `exit_cache_size` entries.
+    """
+
+    def __init__(
+        self, relays, config: InputConfig, exit_cache_size: int = EXIT_POOL_CACHE_SIZE
+    ):
+        self.relays = relays
+        self.config = config
+        start = stage_start()
+        self.trust_model = TrustModel(config, relays.countries)
+        stage_end("trust_model", start)
+
+        start = stage_start()
+        self.exit_candidates = np.flatnonzero(
+            relays.exit_mask(config.destination, config.destination_port)
+        )
+        stage_end("exit_filtering", start)
+        record_size("filtered_exits", len(self.exit_candidates))
+
+        start = stage_start()
+        guard_scores = self.trust_model.guard_scores[relays.country_codes]
+        stage_end("guard_scoring", start)
+        self.guard_ranking = Ranking.build(
+            np.arange(len(relays)), guard_scores, relays.bandwidth
+        )
+        self._exit_rankings: LRUCache[Ranking] = LRUCache(exit_cache_size)
+
+    def exit_ranking(self, guard_country: str, guard_asn: str | None) -> Ranking:
+        """Returns the ranking of the exit candidates for a guard in `guard_country` (cached)."""
+        key = (guard_country, guard_asn)
+        ranking = self._exit_rankings.get(key)
+        if ranking is None:
+            ranking = self._exit_rankings.put(key, self._build_exit_ranking(*key))
+        return ranking
+
+    def nbytes(self) -> int:
+        """Estimated memory of the trust model and of the rankings built so far."""
+        return (
+            self.trust_model.exit_scores.nbytes
+            + self.exit_candidates.nbytes
+            + self.guard_ranking.nbytes()
+            + sum(ranking.nbytes() for ranking in self._exit_rankings.values())
+        )
+
+    def _build_exit_ranking(self, guard_country: str, guard_asn: str | None) -> Ranking:
+        """Ranks the exit candidates for a guard in `guard_country`, and not in `guard_asn` if given."""
+        relays = self.relays
+        exit_candidates = self.exit_candidates
+        if guard_asn is not None:
+            exit_candidates = exit_candidates[
+                relays.asn_codes[exit_candidates] != relays.asn_ids[guard_asn]
+            ]
+
+        start = stage_start()
+        scores_by_country = self.trust_model.exit_scores[
+            relays.country_ids[guard_country]
+        ]
+        exit_scores = scores_by_country[relays.country_codes[exit_candidates]]
+        stage_end("exit_scoring", start)
+        return Ranking.build(
+            exit_candidates, exit_scores, relays.bandwidth[exit_candidates]
+        )
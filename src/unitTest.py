@@ -90,21 +90,13 @@ PARAM_LIST = [
     PARAM_LIST * 10,
 )
 def test_guard_node_not_adversary(
-    config_path, nodes_path, adversary_threshold, empty_space
+    config_path, nodes_path, adversary_threshold, empty_space, datasets
 ):
-    from models import parse_input_config, parse_tor_nodes
     from taps import select_path, _get_country_trust_map
-    from GeoLocator import IPGeolocation
     from models import Params
 
-    with open(config_path) as f:
-        input_config_data = json.load(f)
-    with open(nodes_path) as f:
-        all_nodes_data = json.load(f)
-
-    geo_locator = IPGeolocation(GEOLITE_DB_PATH)
-    input_config = parse_input_config(input_config_data, geo_locator)
-    all_nodes = parse_tor_nodes(all_nodes_data, geo_locator)
+    input_config = datasets.input_config(config_path, GEOLITE_DB_PATH)
+    all_nodes = datasets.relays(nodes_path, GEOLITE_DB_PATH)
 
     guard_params = Params(**GUARD_PARAMS)
     exit_params = Params(**EXIT_PARAMS)
@@ -127,21 +119,13 @@ def test_guard_node_not_adversary(
     PARAM_LIST * 10,
 )
 def test_exit_node_not_adversary(
-    config_path, nodes_path, adversary_threshold, empty_space
+    config_path, nodes_path, adversary_threshold, empty_space, datasets
 ):
-    from models import parse_input_config, parse_tor_nodes
     from taps import select_path, _get_country_trust_map
-    from GeoLocator import IPGeolocation
     from models import Params
 
-    with open(config_path) as f:
-        input_config_data = json.load(f)
-    with open(nodes_path) as f:
-        all_nodes_data = json.load(f)
-
-    geo_locator = IPGeolocation(GEOLITE_DB_PATH)
-    input_config = parse_input_config(input_config_data, geo_locator)
-    all_nodes = parse_tor_nodes(all_nodes_data, geo_locator)
+    input_config = datasets.input_config(config_path, GEOLITE_DB_PATH)
+    all_nodes = datasets.relays(nodes_path, GEOLITE_DB_PATH)
 
     guard_params = Params(**GUARD_PARAMS)
     exit_params = Params(**EXIT_PARAMS)
@@ -163,20 +147,14 @@ def test_exit_node_not_adversary(
     "config_path,nodes_path,adversary_threshold,empty_space",
     PARAM_LIST * 10,
 )
-def test_guard_and_exit_asn(config_path, nodes_path, adversary_threshold, empty_space):
-    from models import parse_input_config, parse_tor_nodes
+def test_guard_and_exit_asn(
+    config_path, nodes_path, adversary_threshold, empty_space, datasets
+):
     from taps import select_path, _get_country_trust_map
-    from GeoLocator import IPGeolocation
     from models import Params
 
-    with open(config_path) as f:
-        input_config_data = json.load(f)
-    with open(nodes_path) as f:
-        all_nodes_data = json.load(f)
-
-    geo_locator = IPGeolocation(GEOLITE_DB_PATH)
-    input_config = parse_input_config(input_config_data, geo_locator)
-    all_nodes = parse_tor_nodes(all_nodes_data, geo_locator)
+    input_config = datasets.input_config(config_path, GEOLITE_DB_PATH)
+    all_nodes = datasets.relays(nodes_path, GEOLITE_DB_PATH)
 
     guard_params = Params(**GUARD_PARAMS)
     exit_params = Params(**EXIT_PARAMS)
@@ -194,21 +172,13 @@ def test_guard_and_exit_asn(config_path, nodes_path, adversary_threshold, empty_
     PARAM_LIST * 10,
 )
 def test_guard_and_exit_country(
-    config_path, nodes_path, adversary_threshold, empty_space
+    config_path, nodes_path, adversary_threshold, empty_space, datasets
 ):
-    from models import parse_input_config, parse_tor_nodes
     from taps import select_path, _get_country_trust_map
-    from GeoLocator import IPGeolocation
     from models import Params
 
-    with open(config_path) as f:
-        input_config_data = json.load(f)
-    with open(nodes_path) as f:
-        all_nodes_data = json.load(f)
-
-    geo_locator = IPGeolocation(GEOLITE_DB_PATH)
-    input_config = parse_input_config(input_config_data, geo_locator)
-    all_nodes = parse_tor_nodes(all_nodes_data, geo_locator)
+    input_config = datasets.input_config(config_path, GEOLITE_DB_PATH)
+    all_nodes = datasets.relays(nodes_path, GEOLITE_DB_PATH)
 
     guard_params = Params(**GUARD_PARAMS)
     exit_params = Params(**EXIT_PARAMS)
@@ -227,20 +197,12 @@ def test_guard_and_exit_country(
     "config_path,nodes_path,adversary_threshold,empty_space",
     PARAM_LIST * 5,
 )
-def test_all(config_path, nodes_path, adversary_threshold, empty_space):
-    from models import parse_input_config, parse_tor_nodes
+def test_all(config_path, nodes_path, adversary_threshold, empty_space, datasets):
     from taps import select_path, _get_country_trust_map
-    from GeoLocator import IPGeolocation
     from models import Params
 
-    with open(config_path) as f:
-        input_config_data = json.load(f)
-    with open(nodes_path) as f:
-        all_nodes_data = json.load(f)
-
-    geo_locator = IPGeolocation(GEOLITE_DB_PATH)
-    input_config = parse_input_config(input_config_data, geo_locator)
-    all_nodes = parse_tor_nodes(all_nodes_data, geo_locator)
+    input_config = datasets.input_config(config_path, GEOLITE_DB_PATH)
+    all_nodes = datasets.relays(nodes_path, GEOLITE_DB_PATH)
 
     guard_params = Params(**GUARD_PARAMS)
     exit_params = Params(**EXIT_PARAMS)
@@ -293,21 +255,13 @@ PARAM_LIST_2 = [
     PARAM_LIST_2,
 )
 def test_path_selection_failure_rate(
-    config_path, nodes_path, adversary_threshold, empty_space
+    config_path, nodes_path, adversary_threshold, empty_space, datasets
 ):
-    from models import parse_input_config, parse_tor_nodes
-    from taps import select_path, _get_country_trust_map
-    from GeoLocator import IPGeolocation
+    from taps import PathSelector, _get_country_trust_map
     from models import Params
 
-    with open(config_path) as f:
-        input_config_data = json.load(f)
-    with open(nodes_path) as f:
-        all_nodes_data = json.load(f)
-
-    geo_locator = IPGeolocation(GEOLITE_DB_PATH)
-    input_config = parse_input_config(input_config_data, geo_locator)
-    all_nodes = parse_tor_nodes(all_nodes_data, geo_locator)
+    input_config = datasets.input_config(config_path, GEOLITE_DB_PATH)
+    all_nodes = datasets.relays(nodes_path, GEOLITE_DB_PATH)
 
     guard_params = Params(**GUARD_PARAMS)
     exit_params = Params(**EXIT_PARAMS)
@@ -323,8 +277,9 @@ def test_path_selection_failure_rate(
     asn_failures = 0
     country_failures = 0
 
+    selector = PathSelector(all_nodes, input_config, guard_params, exit_params)
     for _ in range(N_RUNS):
-        result = select_path(all_nodes, input_config, guard_params, exit_params)
+        result = selector.select()
         guard_node = result.guard_node
         exit_node = result.exit_node
 
@@ -371,3 +326,1018 @@ def test_path_selection_failure_rate(
     assert (
         country_failure_rate < MAX_FAILURE_RATE
     ), f"Country failure rate {country_failure_rate:.2%} exceeds allowed {MAX_FAILURE_RATE:.2%}"
+
+
+MAX_BYTES_PER_NODE = (
+    1_000  # Slotted models with shared exit policies take ~850 B/node at 10k relays
+)
+
+
+def test_parse_tor_nodes_footprint():
+    from memoryReport import measure_footprint
+
+    report = measure_footprint(10_000)
+
+    print(
+        f"\nparse_tor_nodes footprint: {report['nodes_bytes'] / 1e6:.1f} MB "
+        f"({report['bytes_per_node']:.0f} B/node), RelayTable: {report['table_bytes'] / 1e6:.1f} MB"
+    )
+    assert (
+        report["bytes_per_node"] < MAX_BYTES_PER_NODE
+    ), f"parse_tor_nodes uses {report['bytes_per_node']:.0f} B/node, allowed {MAX_BYTES_PER_NODE}"
+
+
+def test_relays_without_country_are_kept():
+    from consensusLoader import build_relay_table
+    from models import parse_tor_nodes
+    from relayTable import RelayTable
+    from syntheticConsensus import SyntheticGeoLocator, generate_relays
+
+    class GeoLocator(SyntheticGeoLocator):
+        def get_country(self, ip_address):  # GeoIP networks without a country record
+            return None if ip_address.endswith("7") else super().get_country(ip_address)
+
+    geo_locator = GeoLocator()
+    records = list(generate_relays(200))
+    nodes = parse_tor_nodes(records, geo_locator)
+    streamed = build_relay_table(
+        zip(records, geo_locator.get_countries(r["ip"] for r in records))
+    )
+
+    assert any(node.country is None for node in nodes)
+    assert [streamed.country(i) for i in range(len(streamed))] == [
+        node.country for node in nodes
+    ]
+    assert None in RelayTable.from_nodes(nodes).countries
+
+
+def test_relay_table_node_round_trips():
+    import dataclasses
+    from consensusDiff import apply_consensus_diff
+    from consensusLoader import build_relay_table, geolocate
+    from models import parse_tor_nodes
+    from relayTable import RelayTable
+    from syntheticConsensus import SyntheticGeoLocator, generate_relays
+
+    geo_locator = SyntheticGeoLocator()
+    records = list(generate_relays(500))
+    nodes = parse_tor_nodes(records, geo_locator)
+
+    from_nodes = RelayTable.from_nodes(nodes)
+    streamed = build_relay_table(geolocate(records, geo_locator))
+    for relays in (from_nodes, streamed):
+        assert len(relays) == len(nodes)
+        for i, node in enumerate(nodes):
+            assert relays.node(i) == node
+            assert relays.row(node.fingerprint) == i
+            assert relays.country(i) == node.country and relays.asn(i) == node.asn
+
+    assert all(from_nodes.node(i) is node for i, node in enumerate(nodes))
+    assert streamed.node(3) is streamed.node(3)  # Built once, then reused
+
+    too_long = dataclasses.replace(nodes[0], fingerprint=nodes[0].fingerprint + "00")
+    with pytest.raises(ValueError, match="Invalid fingerprint"):
+        RelayTable.from_nodes([too_long, nodes[0]])  # Would be the same key in row()
+    with pytest.raises(ValueError, match="Invalid fingerprint"):
+        apply_consensus_diff(
+            from_nodes, geo_locator, added=[{**records[0], "fingerprint": "F" * 41}]
+        )
+
+
+STUB_GEOIP_NETWORKS = [
+    ("1.0.0.0/24", "US"),
+    ("1.0.2.0/23", "DE"),  # 1.0.1.0/24 is a gap
+    ("8.8.8.0/24", None),  # A network without a country
+    ("185.199.108.0/22", "US"),
+    ("2001:db8::/32", "FR"),  # IPv6 is only in the reader, not in the prefix table
+]
+STUB_GEOIP_IPS = [
+    "1.0.0.5",
+    "1.0.1.9",
+    "1.0.3.255",
+    "0.0.0.1",
+    "255.255.255.255",
+    "8.8.8.8",
+    "185.199.111.153",
+    "10.1.2.3",
+    "192.168.1.1",
+    "127.0.0.1",
+    "2001:db8::1",
+    "2001:dead::1",
+    "not-an-ip",
+    "1.0.0.5",
+]
+
+
+def _stub_prefix_table():
+    import ipaddress
+    import numpy as np
+
+    networks = [
+        (ipaddress.ip_network(network), country)
+        for network, country in STUB_GEOIP_NETWORKS
+        if ipaddress.ip_network(network).version == 4
+    ]
+    return (
+        np.array([int(n.network_address) for n, _ in networks], dtype=np.uint32),
+        np.array([int(n.broadcast_address) for n, _ in networks], dtype=np.uint32),
+        [country for _, country in networks],
+    )
+
+
+def test_get_countries_matches_get_country(tmp_path, stub_geoip_reader):
+    from GeoLocator import IPGeolocation
+
+    stub_geoip_reader(STUB_GEOIP_NETWORKS)
+    db_path = str(tmp_path / "stub.mmdb")
+    expected = [IPGeolocation(db_path).get_country(ip) for ip in STUB_GEOIP_IPS]
+    assert expected[1:5] == ["XX", "DE", "XX", "XX"]  # Gaps are unknown
+    assert expected[5] is None and expected[7:10] == ["LN", "LN", "LN"]
+    assert expected[10:13] == ["FR", "XX", "XX"]
+
+    geo_locator = IPGeolocation(db_path)
+    geo_locator._prefix_table = _stub_prefix_table()
+    assert geo_locator.get_countries(STUB_GEOIP_IPS) == expected
+    assert geo_locator.get_countries(reversed(STUB_GEOIP_IPS)) == expected[::-1]
+
+
+def test_prefix_table_is_cached_per_database_build(
+    tmp_path, monkeypatch, stub_geoip_reader
+):
+    from GeoLocator import IPGeolocation, PREFIX_TABLE_SUFFIX
+
+    extractions = []
+
+    def extract_prefix_table(self):  # The walk over the whole database
+        extractions.append(self.build_id())
+        self._prefix_table = _stub_prefix_table()
+
+    monkeypatch.setattr(IPGeolocation, "_extract_prefix_table", extract_prefix_table)
+    db_path = str(tmp_path / "stub.mmdb")
+
+    def get_countries(build_epoch):
+        stub_geoip_reader(STUB_GEOIP_NETWORKS, build_epoch)
+        return IPGeolocation(db_path).get_countries(STUB_GEOIP_IPS)
+
+    expected = get_countries(1)
+    assert (tmp_path / ("stub.mmdb" + PREFIX_TABLE_SUFFIX)).exists()
+    assert get_countries(1) == expected  # Read back from the cache file
+    assert extractions == ["Stub-Country-1"]
+    assert get_countries(2) == expected  # A new build is extracted again
+    assert get_countries(2) == expected
+    assert extractions == ["Stub-Country-1", "Stub-Country-2"]
+
+
+def test_country_cache_is_safe_to_share_with_a_reload_thread(
+    tmp_path, monkeypatch, stub_geoip_reader
+):
+    import threading
+    import GeoLocator
+
+    stub_geoip_reader(STUB_GEOIP_NETWORKS)
+    monkeypatch.setattr(GeoLocator, "COUNTRY_CACHE_SIZE", 64)
+    geo_locator = GeoLocator.IPGeolocation(str(tmp_path / "stub.mmdb"))
+    geo_locator._prefix_table = _stub_prefix_table()
+    done = threading.Event()
+
+    def reload():  # Fills and evicts the cache, like a SIGHUP reload in service.py
+        for i in range(200):
+            geo_locator.get_countries(f"1.0.{i % 4}.{j}" for j in range(256))
+        done.set()
+
+    reloader = threading.Thread(target=reload)
+    reloader.start()
+    answers = []
+    while not done.is_set():
+        answers.append(geo_locator.get_country("185.199.111.153"))
+    reloader.join()
+    assert answers and set(answers) == {"US"}
+
+
+def test_parallel_parse_matches_serial_parse(tmp_path, monkeypatch, stub_geoip_reader):
+    import GeoLocator
+    from models import parse_tor_nodes
+    from syntheticConsensus import generate_relays
+
+    stub_geoip_reader(
+        [("0.0.0.0/2", "DE"), ("64.0.0.0/3", "US"), ("128.0.0.0/4", None)]
+    )
+    records = list(generate_relays(500))
+    records[0] = {**records[0], "ip": "2001:db8::1"}
+    records[1] = {**records[1], "ip": "not-an-ip"}
+    records[2] = {**records[2], "ip": "10.0.0.1"}
+    db_path = str(tmp_path / "stub.mmdb")
+
+    monkeypatch.setattr(GeoLocator, "COUNTRY_CACHE_SIZE", 100)
+    assert len({record["ip"] for record in records}) > GeoLocator.COUNTRY_CACHE_SIZE
+
+    serial = parse_tor_nodes(records, GeoLocator.IPGeolocation(db_path))
+
+    parent_lookups = []  # Lookups made by the workers stay in their own (forked) list
+    lookup_country = GeoLocator.IPGeolocation._lookup_country
+
+    def counted_lookup_country(self, ip_address):
+        parent_lookups.append(ip_address)
+        return lookup_country(self, ip_address)
+
+    monkeypatch.setattr(
+        GeoLocator.IPGeolocation, "_lookup_country", counted_lookup_country
+    )
+    parallel = parse_tor_nodes(records, GeoLocator.IPGeolocation(db_path), workers=2)
+    assert parallel == serial
+    assert parent_lookups == []
+    assert {node.country for node in serial} >= {"DE", "US", None, "LN", "XX"}
+
+
+def test_snapshot_round_trips_and_is_rebuilt_when_stale(tmp_path, monkeypatch):
+    import snapshot
+    from models import parse_tor_nodes
+    from syntheticConsensus import SyntheticGeoLocator, generate_relays, write_consensus
+
+    class RebuiltGeoLocator(SyntheticGeoLocator):
+        def build_id(self) -> str:
+            return "synthetic-v2"
+
+    loads = []
+    load_relay_table = snapshot.load_relay_table
+
+    def counted_load_relay_table(*args):  # Only called when the snapshot is rebuilt
+        loads.append(args)
+        return load_relay_table(*args)
+
+    monkeypatch.setattr(snapshot, "load_relay_table", counted_load_relay_table)
+
+    consensus_path = str(tmp_path / "consensus.json")
+    snapshot_path = snapshot.default_snapshot_path(consensus_path)
+    geo_locator = SyntheticGeoLocator()
+
+    def load(geo_locator):
+        relays = snapshot.load_relay_table_cached(consensus_path, geo_locator)
+        header, _ = snapshot.read_snapshot(snapshot_path)
+        assert header["consensus_sha256"] == snapshot.file_sha256(consensus_path)
+        assert header["geoip_build"] == geo_locator.build_id()
+        return relays
+
+    write_consensus(consensus_path, 300, seed=1)
+    load(geo_locator)
+    assert len(loads) == 1
+    relays = load(geo_locator)  # Read back from the snapshot
+    assert len(loads) == 1
+    nodes = parse_tor_nodes(list(generate_relays(300, seed=1)), geo_locator)
+    assert [relays.node(i) for i in range(len(relays))] == nodes
+    with pytest.raises(ValueError):
+        relays.bandwidth[0] = 0  # Columns are views of the read-only mapping
+
+    write_consensus(consensus_path, 320, seed=2)  # The consensus changed
+    assert len(load(geo_locator)) == 320
+    assert len(loads) == 2
+
+    load(RebuiltGeoLocator())  # The GeoIP database changed
+    assert len(loads) == 3
+    load(RebuiltGeoLocator())
+    assert len(loads) == 3
+
+    def unreadable_snapshot(path):
+        raise PermissionError(13, "Permission denied", path)
+
+    monkeypatch.setattr(snapshot, "read_snapshot", unreadable_snapshot)
+    relays = snapshot.load_relay_table_cached(consensus_path, RebuiltGeoLocator())
+    assert len(relays) == 320 and len(loads) == 4  # Rebuilt instead of failing
+
+
+@pytest.mark.parametrize(
+    "exit_str,destination_ip,destination_port,expected",
+    [
+        ("accept *:*", "185.199.111.153", None, True),
+        ("reject *:*", "185.199.111.153", None, False),
+        ("reject *:25, accept *:*", "185.199.111.153", 25, False),
+        ("reject *:25, accept *:*", "185.199.111.153", None, True),
+        ("accept 185.199.108.0/22:443, reject *:*", "185.199.111.153", 443, True),
+        ("accept 185.199.108.0/22:443, reject *:*", "185.199.111.153", 80, False),
+        ("reject 185.199.0.0/16:*, accept *:*", "185.199.111.153", None, False),
+        ("reject *:1-442, reject *:444-65535, accept *:*", "1.1.1.1", None, True),
+        ("accept *:*", "2606:50c0:8000::153", 443, True),
+        ("reject *4:*, accept *:*", "2606:50c0:8000::153", None, True),
+        ("accept 185.199.108.0/22:*, reject *:*", "2606:50c0:8000::153", None, False),
+        ("reject [2606:50c0::]/32:*, accept *:*", "2606:50c0:8000::153", 443, False),
+        ("accept6 *:443, reject *:*", "2606:50c0:8000::153", 443, True),
+        ("accept6 *:443, reject *:*", "185.199.111.153", 443, False),
+        ("accept *:*", "not-an-ip", 443, True),
+        ("accept *4:*, accept *6:*, reject *:*", "not-an-ip", None, False),
+    ],
+)
+def test_exit_policy_first_match(exit_str, destination_ip, destination_port, expected):
+    from models import TorNode, Bandwidth, parse_exit_rules
+    from relayTable import RelayTable
+    from exitPolicy import compile_exit_policy, parse_destination, policy_accepts
+
+    rules = tuple(parse_exit_rules(exit_str))
+    version, ip = parse_destination(destination_ip)
+    accepts = policy_accepts(compile_exit_policy(rules), ip, destination_port, version)
+    assert accepts == expected, f"'{exit_str}' to {destination_ip}:{destination_port}"
+
+    node = TorNode(
+        fingerprint="0" * 40,
+        nickname="relay",
+        ip="1.1.1.1",
+        port=9001,
+        bandwidth=Bandwidth(measured=1, average=1, burst=1),
+        family=(),
+        asn="1",
+        exit=rules,
+    )
+    index = RelayTable.from_nodes([node]).exit_index
+    assert index.relays(destination_ip, destination_port).tolist() == (
+        [0] if expected else []
+    )
+
+
+TAPS_IMPORT_BUDGET_US = 100_000  # Cumulative `-X importtime` of taps, ~45 ms measured
+HEAVY_MODULES = ("numpy", "geoip2", "maxminddb")
+
+
+def test_taps_import_time():
+    import os
+    import subprocess
+    import sys
+
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import sys, taps; print([m for m in {HEAVY_MODULES!r} if m in sys.modules])",
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    taps_line = next(
+        line for line in result.stderr.splitlines() if line.endswith("| taps")
+    )
+    cumulative_us = int(taps_line.split("|")[1])
+
+    print(f"\nimport taps: {cumulative_us / 1000:.1f} ms")
+    assert result.stdout.strip() == "[]", f"taps imports {result.stdout.strip()}"
+    assert (
+        cumulative_us < TAPS_IMPORT_BUDGET_US
+    ), f"Importing taps takes {cumulative_us} us, allowed {TAPS_IMPORT_BUDGET_US}"
+
+
+def test_service_answers_over_unix_socket(tmp_path, synthetic_selection):
+    import asyncio
+    from service import PathService
+
+    synthetic = synthetic_selection()
+    service = PathService(
+        synthetic.relays,
+        synthetic.geo_locator,
+        synthetic.alpha_guard,
+        synthetic.alpha_exit,
+        synthetic.alliances,
+    )
+    request = {"Client": "193.136.122.65", "Destination": "185.199.111.153"}
+    socket_path = str(tmp_path / "taps.sock")
+
+    async def exchange(lines):
+        server = await service.start(socket_path)
+        async with server:
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            responses = []
+            for line in lines:
+                writer.write(line.encode() + b"\n")
+                await writer.drain()
+                responses.append(json.loads(await reader.readline()))
+            writer.close()
+        return responses
+
+    single, batch, invalid, ipv6, *rejected = asyncio.run(
+        exchange(
+            [
+                json.dumps(request),
+                json.dumps([{**request, "count": 3}, {"Client": "1.1.1.1"}]),
+                "{not json",
+                json.dumps({**request, "Destination": "2606:50c0:8000::153"}),
+                json.dumps({**request, "Destination": "not-an-ip"}),
+                json.dumps({**request, "DestinationPort": "443"}),
+                json.dumps({**request, "DestinationPort": 70000}),
+                json.dumps(request),  # The connection is still up after the errors
+            ]
+        )
+    )
+
+    assert len(single["paths"]) == 1
+    assert len(batch[0]["paths"]) == 3
+    assert "error" in batch[1] and "error" in invalid
+    assert len(ipv6["paths"]) == 1
+    assert all("error" in response for response in rejected[:-1])
+    assert len(rejected[-1]["paths"]) == 1
+    for path in single["paths"] + batch[0]["paths"]:
+        # Like select_path, the service only keeps the middle apart from the guard and exit
+        middle = path["middle"]["fingerprint"]
+        assert middle not in (path["guard"]["fingerprint"], path["exit"]["fingerprint"])
+    assert (
+        len(service._selectors) == 2
+    ), "Equivalent requests should share a PathSelector"
+
+
+def test_apply_consensus_diff_matches_full_rebuild():
+    import copy
+    from syntheticConsensus import generate_relays, SyntheticGeoLocator
+    from models import parse_tor_nodes
+    from relayTable import RelayTable
+    from consensusDiff import ConsensusStore
+    from sampler import WeightedSampler
+
+    geo_locator = SyntheticGeoLocator()
+    old_records = list(generate_relays(1_000, seed=1))
+    new_records = [
+        copy.deepcopy(record) for record in old_records[:500] + old_records[510:]
+    ]
+    new_records[600]["bandwidth"]["measured"] += 1
+    new_records[601]["ip"] = "8.8.8.8"
+    new_records[602]["exit"] = "accept *:22, reject *:*"
+    new_records += list(generate_relays(10, seed=2))
+
+    old_relays = RelayTable.from_nodes(parse_tor_nodes(old_records, geo_locator))
+    old_middle_sampler = old_relays.middle_sampler
+    store = ConsensusStore(old_relays)
+    patched = store.update(geo_locator, new_records)
+    rebuilt = RelayTable.from_nodes(parse_tor_nodes(new_records, geo_locator))
+
+    def rows(relays):
+        return sorted(
+            (node.fingerprint, node.ip, node.bandwidth, node.exit, node.country)
+            for node in map(relays.node, range(len(relays)))
+        )
+
+    assert store.relays is patched and store.version == 1
+    assert len(old_relays) == 1_000, "The previous table must be left untouched"
+    assert rows(patched) == rows(rebuilt)
+    for port in (None, 22, 443):
+        assert sorted(
+            patched.fingerprints[patched.exit_mask("185.199.111.153", port)].tolist()
+        ) == sorted(
+            rebuilt.fingerprints[rebuilt.exit_mask("185.199.111.153", port)].tolist()
+        )
+
+    # The middle sampler is patched from the one of the previous table
+    assert patched._middle_sampler is not None
+    assert patched.middle_sampler.cumulative == (
+        WeightedSampler(range(len(patched)), patched.bandwidth.tolist()).cumulative
+    )
+    assert list(patched.middle_sampler.nodes) == list(range(len(patched)))
+    assert old_relays.middle_sampler is old_middle_sampler
+    assert len(old_middle_sampler.cumulative) == 1_000
+
+
+def test_select_paths_for_configs_groups_equivalent_configs(
+    tmp_path, monkeypatch, synthetic_selection
+):
+    import batch
+
+    synthetic = synthetic_selection()
+    configs_path = tmp_path / "clients.jsonl"
+    configs_path.write_text(
+        "\n".join(
+            json.dumps({"Client": f"{i}.1.1.1", "Destination": "185.199.111.153"})
+            for i in range(1, 41)
+        )
+    )
+    configs = batch.read_input_configs(
+        str(configs_path), synthetic.geo_locator, synthetic.alliances
+    )
+
+    built = []
+
+    class CountingPathSelector(batch.PathSelector):
+        def __init__(self, *args, **kwargs):
+            built.append(args[1])
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(batch, "PathSelector", CountingPathSelector)
+
+    batches = batch.select_paths_for_configs(
+        synthetic.relays,
+        configs,
+        synthetic.alpha_guard,
+        synthetic.alpha_exit,
+        n=3,
+        seed=1,
+    )
+
+    n_groups = len({config.selection_key() for config in configs})
+    assert 1 < n_groups < len(configs), "The clients should share some client countries"
+    assert len(built) == n_groups, "Pools should be built once per group"
+    assert len(batches) == len(configs)
+    assert all(len(paths) == 3 and paths.valid.all() for paths in batches)
+
+
+@pytest.mark.parametrize("config_path", ["../inputs/input1.json", CONFIG_PATH])
+def test_trust_model_matches_security_functions(config_path):
+    from syntheticConsensus import SyntheticGeoLocator
+    from models import parse_input_config
+    from taps import guard_security, exit_security
+    from trustModel import TrustModel
+
+    with open(config_path) as f:
+        input_config = parse_input_config(json.load(f), SyntheticGeoLocator())
+    countries = sorted(
+        {
+            country
+            for alliance in input_config.alliances
+            for country in alliance.countries
+        }
+        | {input_config.client_country, input_config.destination_country, "XX"}
+    )
+    trust_model = TrustModel(input_config, countries)
+    trust_map = trust_model.trust_map
+
+    for g, guard_country in enumerate(countries):
+        assert trust_model.guard_scores[g] == guard_security(
+            input_config.client_country, guard_country, trust_map
+        )
+        for e, exit_country in enumerate(countries):
+            assert trust_model.exit_scores[g, e] == exit_security(
+                input_config.client_country,
+                input_config.destination_country,
+                guard_country,
+                exit_country,
+                trust_map,
+            )
+
+
+def test_simulation_is_reproducible_across_worker_counts(synthetic_selection):
+    import numpy as np
+    from monteCarlo import simulate
+
+    selector = synthetic_selection().selector()
+
+    runs = [
+        simulate(selector, 5_000, seed=42, workers=workers, chunk_size=1_000)
+        for workers in (1, 3)
+    ]
+    other_seed = simulate(selector, 5_000, seed=43, workers=1, chunk_size=1_000)
+
+    for column in ("guards", "middles", "exits"):
+        assert np.array_equal(getattr(runs[0], column), getattr(runs[1], column))
+    assert not np.array_equal(runs[0].guards, other_seed.guards)
+
+
+def test_metrics_share_one_stream_of_paths(synthetic_selection):
+    from metrics import (
+        AdversaryAvoidance,
+        CorrelationVulnerability,
+        LoadDistribution,
+        Metric,
+        run_metrics,
+    )
+    from monteCarlo import simulate
+    from evaluate import get_adversaries
+
+    with pytest.raises(TypeError):
+        Metric(10)  # Abstract
+
+    synthetic = synthetic_selection()
+    input_config = synthetic.config
+    selector = synthetic.selector()
+    adversaries = get_adversaries(input_config, 0.95)
+
+    adversary, correlation, load = run_metrics(
+        selector,
+        [
+            AdversaryAvoidance(adversaries, 1_000, 0.95),
+            CorrelationVulnerability(input_config, 1_000),
+            LoadDistribution(3_000),
+        ],
+        seed=7,
+        workers=2,
+        chunk_size=700,  # Metrics are fed chunk by chunk, 1_000 falls inside a chunk
+    )
+
+    # The same seed replays the stream: metrics must match a path by path count
+    paths = simulate(selector, 3_000, seed=7, workers=1, chunk_size=700).results()
+    client, destination = input_config.client_country, input_config.destination_country
+    assert adversary.exit_hits == sum(
+        path.exit_node.country in adversaries for path in paths[:1_000] if path
+    )
+    assert correlation.vulnerable == sum(
+        bool({client, path.guard_node.country} & {path.exit_node.country, destination})
+        for path in paths[:1_000]
+        if path
+    )
+    assert sum(load.guard_counts.values()) == sum(1 for path in paths if path)
+    assert load.guard_counts == Counter(
+        synthetic.relays.row(path.guard_node.fingerprint) for path in paths if path
+    )
+
+
+def test_exact_evaluation_matches_simulation(synthetic_selection):
+    from metrics import AdversaryAvoidance, CorrelationVulnerability, run_metrics
+    from analytic import evaluate_exact
+    from evaluate import get_adversaries
+
+    synthetic = synthetic_selection(300)
+    input_config = synthetic.config
+    selector = synthetic.selector()
+    adversaries = get_adversaries(input_config, 0.95)
+
+    exact = evaluate_exact(selector, adversaries)
+    pairwise = evaluate_exact(selector, adversaries, with_middle=True)
+    n_runs = 40_000
+    adversary, correlation = run_metrics(
+        selector,
+        [
+            AdversaryAvoidance(adversaries, n_runs, 0.95),
+            CorrelationVulnerability(input_config, n_runs),
+        ],
+        seed=3,
+        workers=1,
+    )
+
+    assert exact.valid == pytest.approx(1.0)
+    for name in ("guard_in_adversary", "exit_in_adversary", "correlation"):
+        assert getattr(exact, name) == pytest.approx(getattr(pairwise, name))
+    # Monte Carlo estimates are within ~4 standard deviations of the exact values
+    tolerance = 4 * (0.25 / n_runs) ** 0.5
+    assert abs(exact.guard_in_adversary - adversary.guard_hits / n_runs) < tolerance
+    assert (
+        abs(pairwise.middle_in_adversary - adversary.middle_hits / n_runs) < tolerance
+    )
+    assert abs(exact.exit_in_adversary - adversary.exit_hits / n_runs) < tolerance
+    assert abs(exact.correlation - correlation.vulnerable / n_runs) < tolerance
+
+
+def test_sweep_matches_independent_evaluations(synthetic_selection):
+    import io
+    import csv
+    from analytic import evaluate_exact
+    from taps import PathSelector
+    from evaluate import get_adversaries
+    from sweep import param_grid, sweep, write_results
+
+    synthetic = synthetic_selection(500)
+    relays, input_config = synthetic.relays, synthetic.config
+    guard_grid = param_grid(
+        GUARD_PARAMS, {"safe_upper": [0.8, 0.95], "bandwidth_frac": [0.1, 0.5]}
+    )
+    exit_grid = param_grid(EXIT_PARAMS, {"accept_upper": [0.1, 0.5]})
+    thresholds = [0.3, 0.9]
+
+    rows = list(
+        sweep(
+            [("synthetic", relays)],
+            {"config": input_config},
+            guard_grid,
+            exit_grid,
+            thresholds,
+        )
+    )
+    assert len(rows) == len(guard_grid) * len(exit_grid) * len(thresholds)
+
+    row = iter(rows)
+    for alpha_guard in guard_grid:
+        for alpha_exit in exit_grid:
+            selector = PathSelector(relays, input_config, alpha_guard, alpha_exit)
+            for threshold in thresholds:
+                exact = evaluate_exact(
+                    selector, get_adversaries(input_config, threshold)
+                )
+                expected = next(row)
+                assert expected["guard_safe_upper"] == alpha_guard.safe_upper
+                assert expected["exit_accept_upper"] == alpha_exit.accept_upper
+                assert expected["threshold"] == threshold
+                assert expected["guard_in_adversary"] == pytest.approx(
+                    exact.guard_in_adversary
+                )
+                assert expected["exit_in_adversary"] == pytest.approx(
+                    exact.exit_in_adversary
+                )
+                assert expected["correlation"] == pytest.approx(exact.correlation)
+
+    out = io.StringIO()
+    assert write_results(rows, out) == len(rows)
+    assert len(list(csv.DictReader(io.StringIO(out.getvalue())))) == len(rows)
+
+
+def test_dataset_registry_reloads_changed_files(tmp_path):
+    import os
+    from syntheticConsensus import generate_relays
+    from datasetRegistry import DatasetRegistry
+
+    nodes_path = tmp_path / "consensus.json"
+    nodes_path.write_text(json.dumps(list(generate_relays(50))))
+    db_path = str(tmp_path / "missing.mmdb")
+    registry = DatasetRegistry()
+
+    relays = registry.relays(str(nodes_path), db_path)
+    assert registry.relays(str(nodes_path), db_path) is relays
+    assert registry.geo_locator(db_path) is registry.geo_locator(db_path)
+    with pytest.raises(ValueError):
+        relays.bandwidth[0] = 0  # Shared tables are read-only
+
+    nodes_path.write_text(json.dumps(list(generate_relays(60))))
+    os.utime(nodes_path, ns=(0, 10**9))
+    assert len(registry.relays(str(nodes_path), db_path)) == 60
+    assert len(registry.nodes(str(nodes_path), db_path)) == 60
+
+
+def test_benchmark_flags_regressions_beyond_tolerance():
+    from dataclasses import asdict
+    from benchmark import BenchmarkResult, find_regressions, measure
+
+    result = measure(lambda: sum(range(100)), 1, 2)
+    assert result.calls_per_s == pytest.approx(1e6 / result.per_call_us)
+
+    baseline = {
+        "select_path": asdict(BenchmarkResult(1, 100.0, 10_000.0, 1000)),
+        "parse_tor_nodes": asdict(BenchmarkResult(1, 100.0, 10_000.0, 1000)),
+    }
+    results = {
+        "select_path": BenchmarkResult(1, 120.0, 8333.0, 1000),  # Within tolerance
+        "parse_tor_nodes": BenchmarkResult(
+            1, 100.0, 10_000.0, 2000
+        ),  # Twice the memory
+        "select_middle_node": BenchmarkResult(1, 1e9, 1.0, 1),  # Not in the baseline
+    }
+    regressions = find_regressions(results, baseline, tolerance=0.25)
+    assert len(regressions) == 1 and regressions[0].startswith("parse_tor_nodes")
+    assert len(find_regressions(results, baseline, tolerance=0.1)) == 2
+
+
+def test_benchmark_gate_fails_without_a_baseline(tmp_path, monkeypatch):
+    import benchmark
+    from benchmark import BenchmarkResult
+
+    results = {"select_path": BenchmarkResult(1, 100.0, 10_000.0, 1000)}
+    monkeypatch.setattr(benchmark, "run_benchmarks", lambda *args: results)
+    baseline_path = str(tmp_path / "baseline.json")
+
+    with pytest.raises(SystemExit) as exited:
+        benchmark.main(["--baseline", baseline_path])
+    assert exited.value.code != 0
+
+    benchmark.main(["--baseline", baseline_path, "--update-baseline"])
+    benchmark.main(["--baseline", baseline_path])  # Same results: the gate passes
+
+    results["select_path"] = BenchmarkResult(1, 200.0, 5_000.0, 1000)
+    with pytest.raises(SystemExit) as exited:
+        benchmark.main(["--baseline", baseline_path])
+    assert exited.value.code == 1
+
+
+def test_synthetic_consensus_is_seeded_and_loadable(tmp_path):
+    from collections import Counter
+    from syntheticConsensus import (
+        SyntheticGeoLocator,
+        generate_relays,
+        write_consensus,
+        COUNTRY_WEIGHTS,
+    )
+    from consensusLoader import load_relay_table
+    from scalingStudy import run_study
+
+    records = list(generate_relays(2000, seed=7))
+    assert records == list(generate_relays(2000, seed=7))
+    assert records != list(generate_relays(2000, seed=8))
+
+    geo_locator = SyntheticGeoLocator()
+    countries = Counter(geo_locator.get_country(r["ip"]) for r in records)
+    assert set(countries) <= set(COUNTRY_WEIGHTS)
+    assert countries.most_common(1)[0][0] in ("DE", "US")
+    # Families list each other
+    by_fingerprint = {r["fingerprint"]: r for r in records}
+    for record in records:
+        for member in record["family"]:
+            assert f"${record['fingerprint']}" in by_fingerprint[member[1:]]["family"]
+
+    path = tmp_path / "consensus.json"
+    write_consensus(str(path), 2000, seed=7)
+    relays = load_relay_table(str(path), geo_locator)
+    assert len(relays) == 2000
+    assert relays.node(0).fingerprint == records[0]["fingerprint"]
+
+    rows = run_study([300], [2], workdir=str(tmp_path))
+    assert [row["stage"] for row in rows] == [
+        "parse_tor_nodes",
+        "load_relay_table",
+        "PathSelector",
+        "PathSelector.select",
+        "select_path",
+    ]
+
+
+def test_profiling_records_stages_and_pool_sizes(synthetic_selection):
+    import instrumentation
+    from taps import PathSelector, select_path
+
+    synthetic = synthetic_selection(500)
+    relays, config = synthetic.relays, synthetic.config
+    guard_params, exit_params = synthetic.alpha_guard, synthetic.alpha_exit
+
+    select_path(relays, config, guard_params, exit_params)  # Not recorded
+    with instrumentation.profiling() as profile:
+        selector = PathSelector(relays, config, guard_params, exit_params)
+        for _ in range(10):
+            selector.select()
+        select_path(relays, config, guard_params, exit_params)
+    selector.select()  # Not recorded either
+    assert instrumentation.active_profile is None
+
+    assert profile.timings["select_path"].count == 1
+    for stage in ("guard_sampling", "exit_sampling", "middle_sampling"):
+        assert profile.timings[stage].count == 11
+    for stage in ("trust_model", "exit_filtering", "guard_scoring", "sort"):
+        assert profile.timings[stage].count >= 2
+    assert profile.sizes["secure_guards"].max == len(selector.guard_sampler.nodes)
+    assert profile.sizes["filtered_exits"].max == len(selector.exit_candidates)
+    assert profile.sizes["middle_candidates"].max <= len(relays) - 1
+    assert "secure_exits" in profile.report()
+
+
+def test_select_middle_matches_select_middle_node_distribution(synthetic_selection):
+    import random
+    import numpy as np
+    from taps import PathSelector, select_middle_node
+
+    synthetic = synthetic_selection(30)
+    nodes, relays = synthetic.nodes, synthetic.relays
+    selector = synthetic.selector()
+    other = PathSelector(
+        relays, synthetic.config, synthetic.alpha_exit, synthetic.alpha_guard
+    )
+    assert selector.middle_sampler is other.middle_sampler is relays.middle_sampler
+
+    guard, exit_node = 0, 1
+    bandwidth = relays.bandwidth.astype(float)
+    bandwidth[[guard, exit_node]] = 0
+    expected = bandwidth / bandwidth.sum()
+
+    draws = 40_000
+    random.seed(0)
+    sampled = np.bincount(
+        [selector.select_middle(guard, exit_node) for _ in range(draws)],
+        minlength=len(relays),
+    )
+    random.seed(0)
+    scanned = np.bincount(
+        [
+            relays.row(
+                select_middle_node(nodes, nodes[guard], nodes[exit_node]).fingerprint
+            )
+            for _ in range(draws)
+        ],
+        minlength=len(relays),
+    )
+
+    assert sampled[[guard, exit_node]].sum() == 0
+    assert np.abs(sampled / draws - expected).max() < 0.01
+    assert np.abs(scanned / draws - expected).max() < 0.01
+
+
+def test_service_caches_stay_bounded(monkeypatch):
+    import relayTable
+    from models import Params, parse_tor_nodes
+    from service import PathService
+    from syntheticConsensus import SyntheticGeoLocator, generate_relays
+
+    monkeypatch.setattr(relayTable, "EXIT_BITMAP_CACHE_SIZE", 4)
+    geo_locator = SyntheticGeoLocator()
+    relays = relayTable.RelayTable.from_nodes(
+        parse_tor_nodes(list(generate_relays(2_000)), geo_locator)
+    )
+    alliances = [{"countries": ["US", "GB"], "trust": 0.5}]
+    service = PathService(
+        relays, geo_locator, Params(**GUARD_PARAMS), Params(**EXIT_PARAMS), alliances
+    )
+    request = {"Client": "1.1.1.1", "count": 20}
+    one = service.handle({**request, "Destination": "2.0.0.0"})
+    service.cache_bytes = 3 * service._cached_bytes
+
+    for i in range(20):
+        response = service.handle({**request, "Destination": f"2.0.0.{i}"})
+        assert len(response["paths"]) == 20
+        assert service._cached_bytes <= service.cache_bytes
+        assert service._cached_bytes == sum(
+            selector.nbytes() for selector in service._selectors.values()
+        )
+    assert len(one["paths"]) == 20
+    assert 1 < len(service._selectors) < 20
+    assert len(relays._exit_bitmaps) == 4
+
+
+@pytest.mark.parametrize(
+    "weights",
+    [
+        [5, 1, 20, 3, 8, 13, 2, 40],
+        [0, 0, 7, 0, 3, 0, 0, 12, 0],  # Zero-bandwidth relays can never be picked
+        [0, 0, 0],
+        [9],
+    ],
+)
+def test_weighted_sampler_picks_like_the_linear_scan(weights):
+    import random
+    from types import SimpleNamespace
+    from sampler import WeightedSampler
+
+    def linear_scan(nodes):  # _bandwidth_weighted_choice before WeightedSampler
+        total_bandwidth = sum(node.bandwidth.measured for node in nodes)
+        selection_point = random.uniform(0, total_bandwidth)
+        current_weight = 0
+        for node in nodes:
+            current_weight += node.bandwidth.measured
+            if current_weight >= selection_point:
+                return node
+
+    nodes = [SimpleNamespace(bandwidth=SimpleNamespace(measured=w)) for w in weights]
+    sampler = WeightedSampler(nodes)
+
+    random.seed(11)
+    scanned = [linear_scan(nodes) for _ in range(2_000)]
+    random.seed(11)
+    sampled = [sampler.choice() for _ in range(2_000)]
+
+    assert [id(node) for node in sampled] == [id(node) for node in scanned]
+
+
+@pytest.mark.parametrize("filter_asn_country", [False, True])
+def test_secure_pools_match_find_secure_relays(synthetic_selection, filter_asn_country):
+    from batch import select_paths
+    from taps import (
+        PathSelector,
+        _filter_exit_nodes,
+        _find_secure_relays,
+        _get_country_trust_map,
+        guard_security,
+        exit_security,
+    )
+
+    synthetic = synthetic_selection()
+    nodes, relays, config = synthetic.nodes, synthetic.relays, synthetic.config
+    alpha_guard, alpha_exit = synthetic.alpha_guard, synthetic.alpha_exit
+    trust_map = _get_country_trust_map(config)
+
+    exit_candidates = _filter_exit_nodes(nodes, config.destination)
+
+    def secure_exits(guard):
+        candidates = exit_candidates
+        if filter_asn_country:
+            candidates = [node for node in candidates if node.asn != guard.asn]
+        scores = {
+            node.fingerprint: exit_security(
+                config.client_country,
+                config.destination_country,
+                guard.country,
+                node.country,
+                trust_map,
+            )
+            for node in candidates
+        }
+        return _find_secure_relays(
+            candidates,
+            scores,
+            alpha_exit,
+            sum(node.bandwidth.measured for node in candidates),
+        )
+
+    guard_scores = {
+        node.fingerprint: guard_security(config.client_country, node.country, trust_map)
+        for node in nodes
+    }
+    secure_guards = _find_secure_relays(
+        nodes,
+        guard_scores,
+        alpha_guard,
+        sum(node.bandwidth.measured for node in nodes),
+    )
+    guards_by_key = {
+        (guard.country, guard.asn if filter_asn_country else None): guard
+        for guard in secure_guards
+    }
+    exit_pools = {key: secure_exits(guard) for key, guard in guards_by_key.items()}
+
+    # PathSelector keeps the same pools, in the same order
+    selector = PathSelector(relays, config, alpha_guard, alpha_exit, filter_asn_country)
+    assert selector.guard_pool == secure_guards
+    for key, guard in guards_by_key.items():
+        exit_sampler = selector.exit_sampler(relays.row(guard.fingerprint))
+        assert [relays.node(i) for i in exit_sampler.nodes] == exit_pools[key]
+
+    # Batched selection only draws guards and exits from them
+    paths = select_paths(
+        relays, config, alpha_guard, alpha_exit, 2_000, 5, filter_asn_country
+    )
+    assert paths.valid.all()
+    secure_guard_fingerprints = {node.fingerprint for node in secure_guards}
+    exit_fingerprints = {
+        key: {node.fingerprint for node in pool} for key, pool in exit_pools.items()
+    }
+    for path in paths:
+        key = (
+            path.guard_node.country,
+            path.guard_node.asn if filter_asn_country else None,
+        )
+        assert path.guard_node.fingerprint in secure_guard_fingerprints
+        assert path.exit_node.fingerprint in exit_fingerprints[key]